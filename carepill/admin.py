@@ -1,3 +1,30 @@
 from django.contrib import admin
 
+from .models import Medication, Medicine, Scan, ScanJob
+
 # Register your models here.
+
+
+@admin.register(ScanJob)
+class ScanJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "client", "worker", "attempts", "created_at", "heartbeat_at", "queue_ms", "run_ms")
+    list_filter = ("status",)
+
+
+@admin.register(Medicine)
+class MedicineAdmin(admin.ModelAdmin):
+    list_display = ("name", "item_seq", "ingredient", "source", "updated_at")
+    list_filter = ("source",)
+    search_fields = ("name", "item_seq", "ingredient")
+
+
+@admin.register(Scan)
+class ScanAdmin(admin.ModelAdmin):
+    list_display = ("id", "owner", "patient_name", "prescription_number", "dispense_date", "envelopes", "created_at")
+    search_fields = ("patient_name", "prescription_number")
+
+
+@admin.register(Medication)
+class MedicationAdmin(admin.ModelAdmin):
+    list_display = ("medicine_name", "owner", "patient_name", "prescription_number", "dispense_date", "updated_at")
+    search_fields = ("medicine_name", "patient_name", "prescription_number")
@@ -1,6 +1,21 @@
+import os
+
 from django.apps import AppConfig
 
 
+def start_scan_jobs():
+    """비동기 스캔 작업: 죽은 워커가 남긴 작업 복구 + 실행 중 작업 heartbeat 스레드 시작.
+    웹 서버 진입점(config/wsgi.py, config/asgi.py)에서만 부른다 — 관리 명령/스크립트/테스트에서
+    django.setup() 만 해서는 백그라운드 스레드가 뜨지 않는다. SCAN_JOB_RECOVER=0 이면 끈다"""
+    if os.getenv("SCAN_JOB_RECOVER", "1") == "1":
+        from .views import _scan_jobs
+        _scan_jobs.start()
+
+
 class CarepillConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "carepill"
+
+    def ready(self):
+        from .pagecache import connect_signals
+        connect_signals()
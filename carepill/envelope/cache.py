@@ -0,0 +1,137 @@
+# carepill/envelope/cache.py
+import hashlib
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 약봉투 추출 결과 캐시
+# - 같은 사용자가 같은 사진을 다시 보낼 때(재시도/재전송) 업스트림 호출을 재사용: 이미지 바이트 sha256 이 같으면 히트
+# - 연사(burst): 한 요청/스캔 세션 안에서 찍은 거의 같은 프레임(dHash 거리 near_distance 이하)은 앞 샷의 결과를
+#   재사용하고, 앞 샷이 아직 분석 중이면 기다렸다가 쓴다 ("near").
+#   지각 해시는 같은 양식의 다른 봉투(환자명/약/용량만 다름)도 몇 비트 차이라, 근사 일치는 같은 사용자의
+#   같은 burst 안(burst_s 이내)으로만 제한한다. burst 밖에서는 바이트가 완전히 같을 때만 재사용.
+# - 항목은 넣은 순서로 보관 → TTL 만료/용량 초과는 넣을 때 앞에서부터만 정리 (조회마다 전체를 훑지 않음)
+
+
+def content_key(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes or b"").hexdigest()
+
+
+def dhash(image_bytes: bytes, hash_size: int = 16) -> Optional[int]:
+    """JPEG/PNG 바이트 → hash_size*hash_size 비트 difference hash. 디코드 실패 시 None"""
+    buf = np.frombuffer(image_bytes or b"", dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    img = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        return None
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class ExtractionCache:
+    def __init__(self, max_entries: int = 256, ttl_s: float = 1800.0, near_distance: int = 12, burst_s: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.near_distance = near_distance
+        self.burst_s = burst_s
+        self._lock = threading.Lock()
+        self._items = OrderedDict()    # (ns, key) -> (stored_at, value), 넣은 순서
+        self._inflight = {}            # (ns, key) -> threading.Event
+        self._bursts = OrderedDict()   # (ns, burst) -> (opened_at, [(dhash, key), ...]), 연 순서
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _fresh(self, k, now: float):
+        item = self._items.get(k)
+        if item is None:
+            return None
+        if now - item[0] > self.ttl_s:
+            del self._items[k]
+            self.evictions += 1
+            return None
+        return item[1]
+
+    def _trim(self, now: float):
+        while self._items:
+            k, (stored_at, _) = next(iter(self._items.items()))
+            if now - stored_at <= self.ttl_s and len(self._items) <= self.max_entries:
+                break
+            del self._items[k]
+            self.evictions += 1
+        while self._bursts and now - next(iter(self._bursts.values()))[0] > self.burst_s:
+            self._bursts.popitem(last=False)
+
+    def claim(self, ns: str, key: str, burst: Optional[str] = None, dh: Optional[int] = None) -> Tuple[str, Any]:
+        """조회 + 선점. ns 에 사용자 식별자를 넣어 사용자 간에는 결과를 공유하지 않는다.
+        burst(요청/세션 id)와 dh(dHash)를 주면 같은 burst 의 거의 같은 프레임도 찾는다.
+        ("hit", value)   : 같은 이미지의 캐시 결과 재사용
+        ("near", value)  : 같은 burst 의 거의 같은 프레임 결과 재사용
+        ("wait", event)  : 같은(거의 같은) 이미지가 이미 업스트림 호출 중 → event 대기 후 다시 claim
+        ("miss", None)   : 호출자가 업스트림을 호출하고 put() 또는 release() 해야 함
+        """
+        now = time.monotonic()
+        k = (ns, key)
+        with self._lock:
+            value = self._fresh(k, now)
+            if value is not None:
+                self.hits += 1
+                return "hit", value
+            ev = self._inflight.get(k)
+            if ev is not None:
+                self.coalesced += 1
+                return "wait", ev
+            if burst is not None and dh is not None:
+                b = self._bursts.get((ns, burst))
+                if b is not None and now - b[0] > self.burst_s:
+                    b = None
+                for h2, key2 in (b[1] if b is not None else ()):
+                    if key2 == key or hamming(dh, h2) > self.near_distance:
+                        continue
+                    value = self._fresh((ns, key2), now)
+                    if value is not None:
+                        self.near_hits += 1
+                        return "near", value
+                    ev = self._inflight.get((ns, key2))
+                    if ev is not None:
+                        self.coalesced += 1
+                        return "wait", ev
+                if b is None:
+                    self._trim(now)
+                    b = self._bursts[(ns, burst)] = (now, [])
+                b[1].append((dh, key))
+            self.misses += 1
+            self._inflight[k] = threading.Event()
+            return "miss", None
+
+    def put(self, ns: str, key: str, value: Any):
+        with self._lock:
+            now = time.monotonic()
+            self._items.pop((ns, key), None)
+            self._items[(ns, key)] = (now, value)
+            self._trim(now)
+        self.release(ns, key)
+
+    def release(self, ns: str, key: str):
+        with self._lock:
+            ev = self._inflight.pop((ns, key), None)
+        if ev is not None:
+            ev.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._items), "bursts": len(self._bursts), "hits": self.hits,
+                    "near_hits": self.near_hits, "misses": self.misses, "coalesced": self.coalesced,
+                    "evictions": self.evictions}
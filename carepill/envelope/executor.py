@@ -0,0 +1,131 @@
+# carepill/envelope/executor.py
+import contextvars
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, List, Optional
+
+# 약봉투 샷 분석용 병렬 실행기
+# - 요청당 동시 실행 수 제한(max_workers)
+# - 요청 전체 마감시간(deadline) + 샷 단위 취소
+
+
+class ShotCancelled(Exception):
+    """마감시간 초과 또는 명시적 취소로 샷 실행이 중단됨"""
+
+
+class ShotContext:
+    """샷 하나의 실행 컨텍스트. 작업 함수는 호출 전후로 check()를 부르고
+    업스트림 timeout은 timeout()으로 마감시간에 맞춰 줄인다."""
+
+    def __init__(self, index: int, deadline_at: float):
+        self.index = index
+        self.deadline_at = deadline_at
+        self._cancel = threading.Event()
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline_at - time.monotonic())
+
+    def timeout(self, cap: float) -> float:
+        return max(0.1, min(float(cap), self.remaining()))
+
+    def cancel(self):
+        self._cancel.set()
+
+    def cancelled(self) -> bool:
+        return self._cancel.is_set() or self.remaining() <= 0
+
+    def check(self):
+        if self.cancelled():
+            raise ShotCancelled("deadline_exceeded" if self.remaining() <= 0 else "cancelled")
+
+
+class ShotOutcome:
+    __slots__ = ("index", "ok", "value", "error", "elapsed_ms")
+
+    def __init__(self, index, ok=False, value=None, error=None, elapsed_ms=None):
+        self.index = index
+        self.ok = ok
+        self.value = value
+        self.error = error
+        self.elapsed_ms = elapsed_ms
+
+
+class ShotRun:
+    """run_shots() 한 번의 실행 핸들. 다른 스레드에서 cancel()/cancel_all() 가능"""
+
+    def __init__(self, n: int, deadline_at: float):
+        self.contexts = [ShotContext(i, deadline_at) for i in range(n)]
+        self.futures = [None] * n
+
+    def cancel(self, i: int):
+        self.contexts[i].cancel()
+        f = self.futures[i]
+        if f is not None:
+            f.cancel()
+
+    def cancel_all(self):
+        for i in range(len(self.contexts)):
+            self.cancel(i)
+
+
+def run_shots(fn: Callable[[Any, ShotContext], Any], items: List[Any],
+              max_workers: int = 4, deadline_s: float = 75.0,
+              on_done: Optional[Callable[[ShotOutcome, ShotRun], None]] = None,
+              run: Optional[ShotRun] = None) -> List[ShotOutcome]:
+    """items 각각에 fn(item, ctx)를 최대 max_workers개씩 병렬 실행한다.
+    결과는 완료 순서와 상관없이 입력 순서대로 반환.
+    deadline_s 가 지나면 대기 중인 샷은 취소하고, 실행 중인 샷은 기다리지 않는다.
+    on_done(outcome, run)은 샷 하나가 끝날 때마다 호출된다(조기 종료 판단 등)."""
+    n = len(items)
+    if run is None:
+        run = ShotRun(n, time.monotonic() + float(deadline_s))
+    outcomes = [ShotOutcome(i) for i in range(n)]
+    if n == 0:
+        return outcomes
+
+    def _task(i):
+        ctx = run.contexts[i]
+        t0 = time.monotonic()
+        ctx.check()
+        try:
+            return fn(items[i], ctx)
+        finally:
+            outcomes[i].elapsed_ms = int((time.monotonic() - t0) * 1000)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(int(max_workers), n)),
+                              thread_name_prefix="carepill-shot")
+    try:
+        pending = {}
+        for i in range(n):
+            # 호출자의 contextvars(업스트림 클라이언트 식별 등)를 샷 스레드로 전달
+            f = pool.submit(contextvars.copy_context().run, _task, i)
+            run.futures[i] = f
+            pending[f] = i
+
+        while pending:
+            timeout = run.contexts[0].remaining()
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                i = pending.pop(f)
+                o = outcomes[i]
+                if f.cancelled():
+                    o.error = ShotCancelled("cancelled")
+                else:
+                    exc = f.exception()
+                    if exc is None:
+                        o.ok, o.value = True, f.result()
+                    else:
+                        o.error = exc
+                if on_done is not None:
+                    on_done(o, run)
+
+        # 마감시간 초과: 남은 샷 전부 취소 (실행 중인 스레드는 ctx로 중단 신호만 전달)
+        for f, i in pending.items():
+            run.cancel(i)
+            outcomes[i].error = ShotCancelled("deadline_exceeded")
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+    return outcomes
@@ -0,0 +1,230 @@
+# carepill/envelope/jobs.py
+import os
+import shutil
+import socket
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# 비동기 스캔 작업 큐
+# - 제출: 이미지를 디스크에 저장 + ScanJob(queued) 생성 후 즉시 반환
+# - 로컬 워커 풀이 작업을 꺼내 runner(images, meta, options, client)를 실행 (client = 제출한 사용자)
+# - 실패(예외 또는 모든 샷 실패) 시 max_attempts 까지 재시도 (지수 백오프, 다음 시도 시각은 next_attempt_at 에 저장)
+#   retry_after() 가 0보다 크면(업스트림 차단기 열림) 시도 횟수를 쓰지 않고 그만큼 미룬다
+# - finish(result, client) 는 마지막 시도(성공 또는 재시도 소진)의 결과에만 한 번 호출된다 (Scan 저장 등)
+# - 결과 조회는 폴링 또는 long-poll(wait)
+# - 실행 중인 작업은 worker("host:pid") + heartbeat_at 으로 lease 를 잡는다.
+#   lease_s 동안 heartbeat 가 없는 running 작업만 죽은 워커의 것으로 보고 다시 queued 로 돌린다
+#   (여러 프로세스로 띄워도 살아 있는 다른 워커가 실행 중인 작업은 건드리지 않음)
+# - heartbeat/복구 스레드는 start() 를 부른 프로세스(웹 서버 진입점)에서만 돈다
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _job_dir(job_id) -> str:
+    media_root = getattr(settings, "MEDIA_ROOT", None) or os.path.join(os.getcwd(), "media")
+    return os.path.join(media_root, "scan_jobs", str(job_id))
+
+
+class ScanJobQueue:
+    def __init__(self, runner: Callable[[List, List, Dict, str], Dict], workers: int = 2,
+                 max_attempts: int = 3, retry_base_s: float = 1.0, lease_s: float = 60.0,
+                 retry_after: Optional[Callable[[], float]] = None,
+                 finish: Optional[Callable[[Dict, str], Dict]] = None):
+        self.runner = runner
+        self.finish = finish
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_s = retry_base_s
+        self.lease_s = lease_s
+        self.retry_after = retry_after
+        self._pool = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._running = set()          # 이 프로세스에서 실행 중인 job id (heartbeat 대상)
+        self._maintainer = None
+        self.recovered = 0
+
+    def _ensure_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="carepill-scanjob")
+
+    def start(self):
+        """워커 풀 + heartbeat/복구 스레드 시작 (웹 서버 진입점에서 호출). 시작하자마자 한 번 복구한다"""
+        self._ensure_pool()
+        with self._lock:
+            if self._maintainer is not None:
+                return
+            self._maintainer = threading.Thread(target=self._maintain, name="carepill-scanjob-lease", daemon=True)
+            self._maintainer.start()
+
+    def _maintain(self):
+        from django.db import DatabaseError
+        beat_s = max(1.0, self.lease_s / 3)
+        next_recover = 0.0
+        while True:
+            try:
+                self._heartbeat()
+                if time.monotonic() >= next_recover:
+                    self.recover()
+                    next_recover = time.monotonic() + self.lease_s
+            except DatabaseError as e:
+                # 마이그레이션 전 등: 다음 주기에 다시
+                logger.warning("scan job lease maintenance skipped: %s", e)
+            finally:
+                close_old_connections()
+            time.sleep(beat_s)
+
+    def _heartbeat(self):
+        from ..models import ScanJob
+        with self._lock:
+            ids = list(self._running)
+        if ids:
+            ScanJob.objects.filter(id__in=ids, status=ScanJob.RUNNING, worker=WORKER_ID).update(heartbeat_at=timezone.now())
+
+    def recover(self):
+        """lease 가 끊긴 running 작업과, 실행 예정 시각(next_attempt_at, 없으면 생성 시각)에서 lease_s 가 지나도록
+        아무도 집어가지 않은 queued 작업을 다시 워커에 넣는다. 재시도 백오프 중인 작업은 건드리지 않는다.
+        같은 작업이 두 번 들어가도 _run 의 queued → running 선점에서 하나만 실행된다"""
+        from django.db.models import Q
+        from ..models import ScanJob
+        if self.retry_after is not None and self.retry_after() > 0:
+            return
+        cutoff = timezone.now() - timedelta(seconds=self.lease_s)
+        dead = Q(status=ScanJob.RUNNING) & (Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff))
+        stale = list(ScanJob.objects.filter(dead).values_list("id", flat=True))
+        # 조건을 다시 걸어 갱신: 그 사이 heartbeat 를 보낸 작업은 그대로 둔다
+        requeued = ScanJob.objects.filter(dead, id__in=stale).update(status=ScanJob.QUEUED, worker="")
+        overdue = Q(next_attempt_at__isnull=True, created_at__lt=cutoff) | Q(next_attempt_at__lt=cutoff)
+        orphans = list(ScanJob.objects.filter(Q(id__in=stale) | overdue, status=ScanJob.QUEUED)
+                       .order_by("created_at").values_list("id", flat=True))
+        if requeued or orphans:
+            logger.info("scan jobs recovered: %d stale leases, %d queued", requeued, len(orphans))
+            self.recovered += len(orphans)
+        for job_id in orphans:
+            self._pool.submit(self._run, job_id)
+
+    def submit(self, images, meta: List, options: Dict, client: str = ""):
+        """이미지 바이트(iterable)를 한 장씩 디스크에 저장하고 작업을 큐에 넣는다"""
+        from ..models import ScanJob
+        self._ensure_pool()
+        job = ScanJob(options=options or {}, meta=meta or [], max_attempts=self.max_attempts, client=client[:80])
+        d = _job_dir(job.id)
+        os.makedirs(d, exist_ok=True)
+        paths = []
+        for i, data in enumerate(images, 1):
+            p = os.path.join(d, f"shot_{i}.jpg")
+            with open(p, "wb") as f:
+                f.write(data or b"")
+            paths.append(p)
+        job.image_paths = paths
+        job.save()
+        self._pool.submit(self._run, job.id)
+        return job
+
+    def _later(self, delay: float, job_id):
+        t = threading.Timer(delay, self._pool.submit, args=(self._run, job_id))
+        t.daemon = True
+        t.start()
+
+    def _run(self, job_id):
+        from ..models import ScanJob
+        close_old_connections()
+        try:
+            # 업스트림 차단기가 열려 있으면 시도 횟수를 쓰지 않고 미룬다
+            wait_s = self.retry_after() if self.retry_after is not None else 0.0
+            if wait_s > 0:
+                self._later(wait_s, job_id)
+                return
+            # 재시도 백오프 중이면 예정 시각까지 미룬다 (복구 등으로 일찍 들어온 경우)
+            now = timezone.now()
+            nxt = (ScanJob.objects.filter(id=job_id, status=ScanJob.QUEUED)
+                   .values_list("next_attempt_at", flat=True).first())
+            if nxt is not None and nxt > now:
+                self._later((nxt - now).total_seconds(), job_id)
+                return
+            # queued → running 선점 (다른 워커/프로세스와 중복 실행 방지)
+            if not ScanJob.objects.filter(id=job_id, status=ScanJob.QUEUED).update(
+                    status=ScanJob.RUNNING, started_at=now, worker=WORKER_ID, heartbeat_at=now):
+                return
+            with self._lock:
+                self._running.add(job_id)
+            job = ScanJob.objects.get(id=job_id)
+            job.attempts += 1
+            if job.queue_ms is None:
+                job.queue_ms = int((now - job.created_at).total_seconds() * 1000)
+            job.save(update_fields=["attempts", "queue_ms"])
+
+            t0 = time.monotonic()
+            error = None
+            try:
+                images = [open(p, "rb").read() if os.path.exists(p) else None for p in job.image_paths]
+                result = self.runner(images, job.meta, job.options, job.client)
+                shots = result.get("shots") or []
+                analyzed = [s for s in shots if not s.get("skipped")]
+                if analyzed and all(str(s.get("raw", "")).startswith("ERROR:") for s in analyzed):
+                    error = "all_shots_failed"
+            except Exception as e:
+                logger.exception("scan job %s failed", job_id)
+                result, error = None, f"{type(e).__name__}: {e}"
+
+            job.run_ms = int((time.monotonic() - t0) * 1000)
+            job.finished_at = timezone.now()
+            job.result = result
+            job.error = error or ""
+            job.worker = ""
+            fields = ["status", "run_ms", "finished_at", "result", "error", "worker", "next_attempt_at"]
+            if error and job.attempts < job.max_attempts:
+                delay = self.retry_base_s * (2 ** (job.attempts - 1))
+                job.status = ScanJob.QUEUED
+                job.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+                job.save(update_fields=fields)
+                self._later(delay, job_id)
+                return
+            if result is not None and self.finish is not None:
+                try:
+                    job.result = self.finish(result, job.client)
+                except Exception:
+                    logger.exception("scan job %s finish failed", job_id)
+            job.status = ScanJob.FAILED if error else ScanJob.SUCCEEDED
+            job.next_attempt_at = None
+            job.save(update_fields=fields)
+            shutil.rmtree(_job_dir(job_id), ignore_errors=True)
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+            close_old_connections()
+            with self._cond:
+                self._cond.notify_all()
+
+    def get(self, job_id, wait_s: float = 0.0):
+        """작업 조회. wait_s > 0 이면 완료될 때까지 최대 wait_s 초 대기(long-poll)"""
+        from ..models import ScanJob
+        deadline = time.monotonic() + max(0.0, wait_s)
+        while True:
+            job = ScanJob.objects.filter(id=job_id).first()
+            remaining = deadline - time.monotonic()
+            if job is None or job.done or remaining <= 0:
+                return job
+            with self._cond:
+                # 다른 프로세스의 워커가 처리할 수도 있으므로 1초마다 DB 재확인
+                self._cond.wait(timeout=min(1.0, remaining))
+
+    def stats(self) -> Dict:
+        from django.db.models import Count
+        from ..models import ScanJob
+        counts = dict(ScanJob.objects.values_list("status").annotate(n=Count("id")))
+        with self._lock:
+            running = len(self._running)
+        return {"workers": self.workers, "worker_id": WORKER_ID, "running_here": running,
+                "lease_s": self.lease_s, "recovered": self.recovered, "by_status": counts}
@@ -0,0 +1,213 @@
+# carepill/envelope/merge.py
+import re
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# 필드별 정규화 + 편집거리 군집 병합
+# 정확히 같은 문자열만 세던 다수결 대신, 정규화한 값을 편집거리로 묶어서 군집 크기로 신뢰도를 낸다.
+#   "김시원님" / "김시원"                                  → 같은 군집
+#   "레티리진(레보세티리진염산염) 5mg" / "레티나정(레보세티리진염산염) 5mg" → 같은 군집
+# 신뢰도 = 군집 크기 / 전체 샷 수 (빈 값 포함, 기존 _majority_merge 와 동일한 분모)
+# 숫자(+단위)는 편집거리로 보지 않는다: "1일 3회"/"1일 2회", "500mg"/"650mg", "30일분"/"3일분" 은
+# 한 글자 차이지만 다른 복용 정보다. 숫자 토큰 열이 호환될 때만 묶고, 편집거리는 숫자를 뺀 나머지에만 적용.
+#   호환 = 같거나, 한쪽 숫자 토큰이 다른 쪽의 부분집합 (숫자가 없는 값 포함: "레티리진(…)" / "레티나정(…) 5mg")
+#   덜 구체적인 값을 사이에 두고 서로 다른 숫자끼리 이어지지는 않는다 ("A" 가 "A 5mg" 과 "A 10mg" 을 잇지 않음)
+# 나머지가 짧으면 비율이 크게 튀므로 끼워 넣기만으로 SHORT_REST_EDITS 글자 이내면 같은 값으로 본다
+#   ("1일 3회 5일분" / "1일 3회 총 5일분")
+# 나머지는 가까운데 숫자가 호환되지 않는 군집이 있으면 그 표만큼 신뢰도를 깎는다 (numeric_conflict).
+
+HONORIFICS = re.compile(r"(님|씨|귀하|환자|고객)$")
+_UNITS = [
+    (re.compile(r"밀리그램|밀리그람|㎎", re.I), "mg"),
+    (re.compile(r"마이크로그램|㎍|mcg", re.I), "μg"),
+    (re.compile(r"밀리리터|㎖", re.I), "ml"),
+    (re.compile(r"(?<![a-z])그램|(?<=\d)\s*g(?![a-z])", re.I), "g"),
+    (re.compile(r"정제|정(?=\W|$)"), "정"),
+]
+_DATE = re.compile(r"(20\d{2}|19\d{2})\s*[.\-/년]?\s*(\d{1,2})\s*[.\-/월]?\s*(\d{1,2})")
+
+# 군집 기준: 정규화된 두 값의 편집거리 / 긴 쪽 길이 가 이 값 이하이면 같은 값으로 본다
+FIELD_THRESHOLDS = {
+    "patient_name": 0.34,
+    "age": 0.0,
+    "dispense_date": 0.0,
+    "pharmacy_name": 0.3,
+    "prescription_number": 0.1,
+    "medicine_name": 0.4,
+    "dosage_instructions": 0.3,
+    "frequency": 0.3,
+}
+DEFAULT_THRESHOLD = 0.3
+SHORT_REST_EDITS = 2
+# 정규화 값을 그대로 결과로 쓰는 필드 (나머지는 원문 표기를 살린다)
+NORMALIZED_OUTPUT = {"age", "prescription_number", "dispense_date", "patient_name"}
+
+
+# 숫자 + 바로 뒤 단위(영문 3자/한글 2자까지): "1일" "3회" "30일분" "500mg" "2.5ml"
+_NUM_TOKEN = re.compile(r"(\d+(?:\.\d+)?)\s*([a-zμ%]{1,3}|[가-힣]{1,2})?", re.I)
+
+
+def numeric_parts(s: str) -> Tuple[Tuple, str]:
+    """정규화 값 → (숫자 토큰 열 ((숫자, 단위), ...), 숫자 토큰을 뺀 나머지 문자열)"""
+    sig = tuple((m.group(1), (m.group(2) or "").lower()) for m in _NUM_TOKEN.finditer(s))
+    rest = re.sub(r"\s+", " ", _NUM_TOKEN.sub(" ", s)).strip()
+    return sig, rest
+
+
+def _digits(s: str) -> str:
+    return "".join(ch for ch in s if ch.isdigit())
+
+
+def _base(s: str) -> str:
+    s = unicodedata.normalize("NFKC", str(s or "")).strip()
+    return re.sub(r"\s+", " ", s)
+
+
+def normalize_value(field: str, value: str) -> str:
+    s = _base(value)
+    if not s:
+        return ""
+    if field == "age":
+        return _digits(s)
+    if field == "prescription_number":
+        return _digits(s) or s
+    if field == "dispense_date":
+        m = _DATE.search(s)
+        return f"{m.group(1)}-{int(m.group(2)):02d}-{int(m.group(3)):02d}" if m else s
+    if field == "patient_name":
+        s = re.sub(r"\(.*?\)|\d+\s*(세|년생).*$", "", s).strip()
+        return HONORIFICS.sub("", s.replace(" ", ""))
+    if field == "medicine_name":
+        for pat, rep in _UNITS:
+            s = pat.sub(rep, s)
+        s = re.sub(r"(\d+(?:\.\d+)?)\s*(mg|μg|ml|g)\b", r"\1\2", s, flags=re.I)
+        return re.sub(r"\s*([()])\s*", r"\1", s).lower()
+    if field == "pharmacy_name":
+        return s.replace(" ", "")
+    # 복용법/횟수 등: 구두점 주변 공백만 정리
+    return re.sub(r"\s*([,·/])\s*", r"\1 ", s).strip()
+
+
+def pairwise_levenshtein(strings: List[str]) -> np.ndarray:
+    """모든 쌍의 편집거리 (n x n). 쌍 축과 열 축을 NumPy로 벡터화하고 행만 반복한다.
+    D[i][j] = min(D[i-1][j]+1, D[i-1][j-1]+cost, D[i][j-1]+1) 에서 마지막 항은
+    누적 최솟값(cummin(t[k]-k)+j)으로 한 번에 계산한다."""
+    n = len(strings)
+    out = np.zeros((n, n), dtype=np.int32)
+    if n < 2:
+        return out
+    lens = np.array([len(s) for s in strings], dtype=np.int32)
+    L = int(lens.max())
+    codes = np.full((n, max(L, 1)), -1, dtype=np.int32)
+    for k, s in enumerate(strings):
+        if s:
+            codes[k, :len(s)] = [ord(ch) for ch in s]
+    I, J = np.triu_indices(n, 1)
+    A, B = codes[I], codes[J]
+    la, lb = lens[I], lens[J]
+    res = np.where(la == 0, lb, 0).astype(np.int32)
+    cols = np.arange(L + 1, dtype=np.int32)
+    prev = np.broadcast_to(cols, (len(I), L + 1)).copy()
+    for i in range(1, L + 1):
+        cost = (B[:, :L] != A[:, i - 1:i]).astype(np.int32)
+        t = np.empty_like(prev)
+        t[:, 0] = i
+        t[:, 1:] = np.minimum(prev[:, 1:] + 1, prev[:, :-1] + cost)
+        cur = np.minimum.accumulate(t - cols, axis=1) + cols
+        hit = la == i
+        if hit.any():
+            res[hit] = cur[hit, lb[hit]]
+        prev = cur
+    out[I, J] = res
+    out[J, I] = res
+    return out
+
+
+def _sig_subset(a: Tuple, b: Tuple) -> bool:
+    """숫자 토큰 열 a 가 b 에 (중복 포함) 모두 들어 있는지"""
+    return not (Counter(a) - Counter(b))
+
+
+def _links(vals: List[str], threshold: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """값 목록 → (숫자를 뺀 나머지가 가까운지, 숫자 토큰 열이 같은지, 숫자 토큰 열이 호환되는지) n x n 불리언 행렬"""
+    parts = [numeric_parts(v) for v in vals]
+    rests = [r for _, r in parts]
+    d = pairwise_levenshtein(rests)
+    lens = np.array([len(r) for r in rests])
+    rel = d / np.maximum(np.maximum.outer(lens, lens), 1)
+    # 짧은 나머지: 끼워 넣기만으로 된 차이(편집거리 = 길이 차)는 절대 글자 수로 본다
+    inserted = (d <= SHORT_REST_EDITS) & (d == np.abs(np.subtract.outer(lens, lens)))
+    sigs = [p for p, _ in parts]
+    n = len(vals)
+    same = np.array([[sigs[a] == sigs[b] for b in range(n)] for a in range(n)], dtype=bool).reshape(n, n)
+    compat = np.array([[_sig_subset(sigs[a], sigs[b]) or _sig_subset(sigs[b], sigs[a]) for b in range(n)]
+                       for a in range(n)], dtype=bool).reshape(n, n)
+    return (rel <= threshold + 1e-9) | inserted, same, compat
+
+
+def cluster_values(normalized: List[str], threshold: float) -> List[List[int]]:
+    """정규화된 값들을 single-linkage 로 묶는다. 빈 값은 제외. 반환: 인덱스 목록의 목록
+    숫자 토큰 열이 같은 값끼리 먼저 묶고, 부분집합 관계인 값은 군집 안 모든 값과 호환될 때만 합친다
+    (숫자가 호환되지 않는 값끼리는 나머지가 아무리 비슷해도 같은 군집이 되지 않음)"""
+    idx = [i for i, v in enumerate(normalized) if v]
+    if not idx:
+        return []
+    vals = [normalized[i] for i in idx]
+    text_adj, same_num, compat = _links(vals, threshold)
+    parent = list(range(len(vals)))
+    members = {k: [k] for k in range(len(vals))}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for adj in (text_adj & same_num, text_adj & compat):
+        for a, b in zip(*np.nonzero(np.triu(adj, 1))):
+            ra, rb = find(a), find(b)
+            if ra == rb or not compat[np.ix_(members[ra], members[rb])].all():
+                continue
+            parent[ra] = rb
+            members[rb] += members.pop(ra)
+    groups = {}
+    for k in range(len(vals)):
+        groups.setdefault(find(k), []).append(idx[k])
+    return list(groups.values())
+
+
+def cluster_merge(values: List[str], field: str = "") -> Tuple[str, float, Dict]:
+    """필드 값 목록 → (선택값, 신뢰도, 진단 정보)
+    가장 큰 군집에서 가장 많이 나온 정규화 값을 고르고, 동률이면 가장 긴 값(정보량 많은 쪽).
+    clusters[].members 는 1부터 시작하는 샷 번호."""
+    raw = [v if isinstance(v, str) else "" for v in values]
+    norm = [normalize_value(field, v) for v in raw]
+    groups = cluster_values(norm, FIELD_THRESHOLDS.get(field, DEFAULT_THRESHOLD))
+    if not groups:
+        return "", 0.0, {"normalized": norm, "clusters": []}
+
+    def rep(members):
+        cnt = Counter(norm[i] for i in members)
+        top = max(cnt.values())
+        best = max((v for v, c in cnt.items() if c == top), key=len)
+        if field in NORMALIZED_OUTPUT:
+            return best
+        return max((_base(raw[i]) for i in members if norm[i] == best), key=len)
+
+    clusters = sorted(({"value": rep(g), "members": [i + 1 for i in g], "size": len(g)} for g in groups),
+                      key=lambda c: (c["size"], len(c["value"])), reverse=True)
+    best = clusters[0]
+    # 나머지는 군집 기준 안인데 숫자가 호환되지 않는 값들만 반대표로 센다 (숫자가 없거나 부분집합이면 반대표 아님)
+    members = [i - 1 for i in best["members"]]
+    others = [i for c in clusters[1:] for i in (m - 1 for m in c["members"])]
+    conflict = 0
+    if others:
+        text_adj, _, compat = _links([norm[i] for i in members + others],
+                                     FIELD_THRESHOLDS.get(field, DEFAULT_THRESHOLD))
+        clash = text_adj & ~compat
+        conflict = int(clash[:len(members), len(members):].any(axis=0).sum())
+    conf = max(0, best["size"] - conflict) / max(1, len(values))
+    return best["value"], round(conf, 3), {"normalized": norm, "clusters": clusters, "numeric_conflict": conflict}
@@ -0,0 +1,131 @@
+# carepill/envelope/parsing.py
+import re
+import json
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 모델 출력 → JSON dict 관대한 파서
+# 코드펜스, 앞뒤 설명 문장, 끝 쉼표, max_tokens 로 잘린 출력(닫히지 않은 문자열/괄호)을 복구한다.
+# 잘린 출력은 마지막으로 완결된 원소/키-값 쌍까지만 살린다. 중간에 끊긴 값은 버린다
+# (잘린 "1일 3" 을 "1일 3회"처럼 믿고 병합하면 안 되므로).
+# 반환 상태: "ok"(그대로 파싱) | "repaired"(복구 후 파싱) | "failed"
+
+_FENCE = re.compile(r"^```[a-zA-Z]*\s*|\s*```$")
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+
+def _strip_fence(text: str) -> str:
+    return _FENCE.sub("", text.strip()).strip()
+
+
+def _cut_object(text: str) -> Tuple[str, str, List[str]]:
+    """첫 '{' 부터 짝이 맞는 '}' 까지 잘라낸다.
+    잘린 출력이면 마지막으로 "완결된" 지점(값이 끝난 원소/키-값 쌍 뒤, 또는 괄호를 연 직후)까지만 남긴다.
+    반환: (잘라낸 문자열, 닫아야 할 괄호들, 값이 끝나지 않아 버린 키 목록)"""
+    start = text.find("{")
+    if start < 0:
+        return "", "", []
+    # levels: [닫는 괄호, 상태(key|colon|value|comma), 채우는 중인 키]
+    levels, in_str, esc, str_start, scalar = [], False, False, 0, False
+    cut, closers = start, None
+
+    def _done(end):
+        # 현재 컨테이너의 값 하나가 끝남 → 안전하게 자를 수 있는 지점
+        nonlocal cut, closers
+        levels[-1][1], levels[-1][2] = "comma", levels[-1][2] if levels[-1][0] == "}" else None
+        cut, closers = end, "".join(l[0] for l in reversed(levels))
+
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+                top = levels[-1]
+                if top[0] == "}" and top[1] == "key":
+                    top[1], top[2] = "colon", text[str_start + 1:i]
+                else:
+                    _done(i + 1)
+            continue
+        if scalar:
+            if ch not in ",}] \t\r\n":
+                continue
+            scalar = False
+            _done(i)
+        if ch == '"':
+            in_str, str_start = True, i
+        elif ch in "{[":
+            if levels:
+                levels[-1][1] = "value"
+            levels.append(["}" if ch == "{" else "]", "key" if ch == "{" else "value", None])
+            cut, closers = i + 1, "".join(l[0] for l in reversed(levels))
+        elif ch in "}]":
+            levels.pop()
+            if not levels:
+                return text[start:i + 1], "", []
+            _done(i + 1)
+        elif ch == ":":
+            levels[-1][1] = "value"
+        elif ch == ",":
+            levels[-1][1] = "key" if levels[-1][0] == "}" else "value"
+            levels[-1][2] = None
+        elif not ch.isspace() and levels and levels[-1][1] == "value":
+            scalar = True
+    # 잘린 출력: 끝나지 않은 값(문자열 중간/숫자 중간 포함)은 완결된 것처럼 닫지 않고 버린다
+    dropped = [l[2] for l in levels if l[0] == "}" and l[2] is not None and l[1] != "comma"]
+    return text[start:cut], closers or "", dropped
+
+
+def repair_json(text: str) -> Tuple[str, List[str]]:
+    """→ (복구한 JSON 문자열, 값이 잘려 버린 키 목록)"""
+    body, closers, dropped = _cut_object(text)
+    if not body:
+        return "", []
+    return _TRAILING_COMMA.sub(r"\1", body.rstrip() + closers), dropped
+
+
+def parse_model_json(text: str, info: Optional[Dict] = None) -> Tuple[Dict, str]:
+    """info 를 주면 복구 시 잘려서 버린 키를 info["truncated"] 에 넣는다"""
+    if not isinstance(text, str) or not text.strip():
+        return {}, "failed"
+    t = _strip_fence(text)
+    try:
+        v = json.loads(t)
+        if isinstance(v, dict):
+            return v, "ok"
+    except Exception:
+        pass
+    try:
+        repaired, dropped = repair_json(t)
+        v = json.loads(repaired)
+        if isinstance(v, dict):
+            if info is not None:
+                info["truncated"] = dropped
+            return v, "repaired"
+    except Exception:
+        pass
+    return {}, "failed"
+
+
+class ParseStats:
+    """샷 단위 파싱 결과 누적 카운터 (프로세스 전역)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"ok": 0, "repaired": 0, "failed": 0}
+
+    def record(self, status: str):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            c = dict(self.counts)
+        total = sum(c.values())
+        c["total"] = total
+        c["failure_rate"] = round(c["failed"] / total, 4) if total else 0.0
+        c["repair_rate"] = round(c["repaired"] / total, 4) if total else 0.0
+        return c
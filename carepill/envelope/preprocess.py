@@ -0,0 +1,132 @@
+# carepill/envelope/preprocess.py
+import math
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# 업스트림 비전 호출 전 이미지 정규화
+# 1) 디코드  2) 봉투 사각형 원근 보정 (못 찾으면 기울기만 보정)
+# 3) 비전 모델이 실제로 타일링하는 해상도로 축소  4) JPEG 재인코딩
+#
+# detail=high 이미지는 2048x2048 안으로 맞춘 뒤 짧은 변을 768px로 줄여 512px 타일로 나눈다.
+# 그보다 큰 이미지는 업로드 바이트만 늘리고 정확도에는 기여하지 않는다.
+MAX_SIDE = 2048
+SHORT_SIDE = 768
+TILE = 512
+
+
+def decode_image(image_bytes: bytes) -> Optional[np.ndarray]:
+    buf = np.frombuffer(image_bytes or b"", dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def _order_quad(pts: np.ndarray) -> np.ndarray:
+    """4점을 좌상, 우상, 우하, 좌하 순서로 정렬"""
+    pts = pts.reshape(4, 2).astype(np.float32)
+    s = pts.sum(axis=1)
+    d = np.diff(pts, axis=1).ravel()
+    return np.array([pts[np.argmin(s)], pts[np.argmin(d)], pts[np.argmax(s)], pts[np.argmax(d)]], dtype=np.float32)
+
+
+def find_envelope_quad(img: np.ndarray, min_area_ratio: float = 0.25) -> Optional[np.ndarray]:
+    """가장 큰 사각형 윤곽(약봉투)을 찾는다. 화면 대비 min_area_ratio 미만이면 None"""
+    h, w = img.shape[:2]
+    scale = 600.0 / max(h, w) if max(h, w) > 600 else 1.0
+    small = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else img
+    gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    edges = cv2.dilate(cv2.Canny(gray, 50, 150), np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = min_area_ratio * small.shape[0] * small.shape[1]
+    for c in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(c) < min_area:
+            break
+        approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return _order_quad(approx) / scale
+    return None
+
+
+def warp_quad(img: np.ndarray, quad: np.ndarray) -> np.ndarray:
+    tl, tr, br, bl = quad
+    out_w = int(max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl)))
+    out_h = int(max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr)))
+    dst = np.array([[0, 0], [out_w - 1, 0], [out_w - 1, out_h - 1], [0, out_h - 1]], dtype=np.float32)
+    m = cv2.getPerspectiveTransform(quad.astype(np.float32), dst)
+    return cv2.warpPerspective(img, m, (out_w, out_h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def estimate_skew(img: np.ndarray, max_deg: float = 15.0) -> float:
+    """글자 픽셀의 최소 외접 사각형으로 기울기(도)를 추정. 범위를 벗어나면 0"""
+    h, w = img.shape[:2]
+    if max(h, w) > 1000:
+        img = cv2.resize(img, (w * 1000 // max(h, w), h * 1000 // max(h, w)), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    _, bw = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    ys, xs = np.nonzero(bw)
+    if xs.size < 100:
+        return 0.0
+    angle = cv2.minAreaRect(np.column_stack((xs, ys)).astype(np.float32))[-1]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    return float(angle) if abs(angle) <= max_deg else 0.0
+
+
+def rotate(img: np.ndarray, deg: float) -> np.ndarray:
+    h, w = img.shape[:2]
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), deg, 1.0)
+    return cv2.warpAffine(img, m, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def target_size(w: int, h: int, max_side: int = MAX_SIDE, short_side: int = SHORT_SIDE) -> Tuple[int, int]:
+    """비전 모델 타일링 규칙에 맞춘 크기 (확대는 하지 않는다)"""
+    s = min(1.0, max_side / max(w, h))
+    if min(w, h) * s > short_side:
+        s = short_side / min(w, h)
+    return max(1, int(round(w * s))), max(1, int(round(h * s)))
+
+
+def image_tokens(w: int, h: int) -> int:
+    """detail=high 이미지 토큰 추정치 (85 + 170 * 타일 수)"""
+    return 85 + 170 * math.ceil(w / TILE) * math.ceil(h / TILE)
+
+
+def normalize_envelope(image_bytes: bytes, quality: int = 85, deskew: bool = True) -> Tuple[bytes, Dict]:
+    """약봉투 이미지를 정규화해 (jpeg_bytes, stats)를 반환한다.
+    디코드할 수 없는 입력이면 ValueError."""
+    img = decode_image(image_bytes)
+    if img is None:
+        raise ValueError("image_decode_failed")
+    h0, w0 = img.shape[:2]
+    stats = {"bytes_in": len(image_bytes), "size_in": [w0, h0], "warped": False, "deskew_deg": 0.0}
+
+    quad = find_envelope_quad(img)
+    if quad is not None:
+        img = warp_quad(img, quad)
+        stats["warped"] = True
+    elif deskew:
+        deg = estimate_skew(img)
+        if abs(deg) >= 0.5:
+            img = rotate(img, deg)
+            stats["deskew_deg"] = round(deg, 2)
+
+    h, w = img.shape[:2]
+    tw, th = target_size(w, h)
+    if (tw, th) != (w, h):
+        img = cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA)
+
+    ok, buf = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    if not ok:
+        raise ValueError("jpeg_encode_failed")
+    out = buf.tobytes()
+    # 이미 작은 이미지를 재인코딩해서 오히려 커졌다면 원본 유지
+    if len(out) >= len(image_bytes) and not stats["warped"] and not stats["deskew_deg"] and (tw, th) == (w0, h0):
+        out = image_bytes
+    stats.update({"bytes_out": len(out), "size_out": [tw, th],
+                  "est_image_tokens_in": image_tokens(*target_size(w0, h0)),
+                  "est_image_tokens_out": image_tokens(tw, th)})
+    return out, stats
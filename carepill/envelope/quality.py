@@ -0,0 +1,66 @@
+# carepill/envelope/quality.py
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+# 연사 프레임 품질 점수
+# - sharpness : 라플라시안 분산 (흔들림/초점 흐림이면 작아짐)
+# - clipped   : 하이라이트 포화(>=250) 픽셀 비율 (비닐 약봉투 반사광)
+# - dark      : 암부(<=10) 픽셀 비율
+# - mean      : 평균 밝기
+# score 는 카메라별 상위 K장 선택용 상대값 (같은 카메라 안에서만 비교)
+CLIP_LEVEL = 250
+DARK_LEVEL = 10
+ANALYZE_SIDE = 960
+
+
+def _gray(image_bytes: bytes) -> Optional[np.ndarray]:
+    buf = np.frombuffer(image_bytes or b"", dtype=np.uint8)
+    if buf.size == 0:
+        return None
+    g = cv2.imdecode(buf, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    if g is None:
+        return None
+    h, w = g.shape[:2]
+    if max(h, w) > ANALYZE_SIDE:
+        s = ANALYZE_SIDE / max(h, w)
+        g = cv2.resize(g, (int(w * s), int(h * s)), interpolation=cv2.INTER_AREA)
+    return g
+
+
+def score_gray(g: np.ndarray) -> Dict:
+    lap = cv2.Laplacian(g, cv2.CV_32F, ksize=3)
+    sharpness = float(lap.var())
+    n = float(g.size)
+    hist = np.bincount(g.ravel(), minlength=256)
+    clipped = float(hist[CLIP_LEVEL:].sum() / n)
+    dark = float(hist[:DARK_LEVEL + 1].sum() / n)
+    mean = float(np.dot(hist, np.arange(256)) / n)
+    # 선명도(log) × 반사광 패널티 × 노출 패널티
+    exposure = 1.0 - 0.5 * abs(mean - 128.0) / 128.0
+    score = np.log1p(sharpness) * max(0.0, 1.0 - 4.0 * clipped) * max(0.0, 1.0 - 2.0 * dark) * exposure
+    return {"sharpness": round(sharpness, 1), "clipped": round(clipped, 4), "dark": round(dark, 4),
+            "mean": round(mean, 1), "score": round(float(score), 3)}
+
+
+def score_frame(image_bytes: bytes) -> Optional[Dict]:
+    """JPEG 바이트 → 품질 점수 dict. 디코드 실패 시 None"""
+    g = _gray(image_bytes)
+    return score_gray(g) if g is not None else None
+
+
+def select_top_k(scores: List[Optional[Dict]], groups: List, k: int) -> List[bool]:
+    """groups(카메라 번호)별로 score 상위 k장만 True. 점수를 못 낸 프레임은 판단 불가이므로 유지"""
+    keep = [s is None for s in scores]
+    if k <= 0:
+        return [True] * len(scores)
+    by_group = {}
+    for i, (s, g) in enumerate(zip(scores, groups)):
+        if s is not None:
+            by_group.setdefault(g, []).append(i)
+    for idxs in by_group.values():
+        order = np.argsort([-scores[i]["score"] for i in idxs], kind="stable")
+        for j in order[:k]:
+            keep[idxs[j]] = True
+    return keep
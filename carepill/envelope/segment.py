@@ -0,0 +1,157 @@
+# carepill/envelope/segment.py
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+
+from .cache import dhash, hamming
+from .preprocess import _order_quad, decode_image, target_size, warp_quad
+
+# 한 프레임에 약봉투가 여러 개일 때: 사각형 윤곽을 전부 찾아 봉투별로 잘라내고,
+# 샷 간에는 지각 해시로 같은 봉투끼리 묶는다 (같은 카메라 샷끼리는 화면 위치도 함께 본다).
+#   segment_frame(jpeg) → [Crop...]      (봉투 1개 이하거나 아래 조건을 못 맞추면 빈 리스트 → 기존 단일 봉투 경로)
+# 봉투 한 장 안의 표/박스(조제 내역표, 복용법 칸 등)도 사각형으로 잡히므로 여러 개로 인정하는 건
+#   - 사각형끼리 서로 겹치거나 포개지지 않고 (nested_overlap 이하)
+#   - 합쳐서 프레임의 min_coverage 이상을 덮을 때 (봉투 여러 장이 화면을 채운 경우) 뿐이다.
+#   group_crops([[Crop...] per shot]) → [[Crop...] per envelope]
+# 좌표는 프레임 크기 대비 비율(0~1)이라 카메라 해상도가 달라도 비교할 수 있다.
+
+
+class Crop:
+    __slots__ = ("shot", "center", "bbox", "jpeg", "hash", "camera")
+
+    def __init__(self, shot: int, center, bbox, jpeg: bytes, h: Optional[int], camera=None):
+        self.shot = shot          # 1부터 시작하는 샷 번호
+        self.center = center      # (cx, cy) 비율
+        self.bbox = bbox          # [x, y, w, h] 비율
+        self.jpeg = jpeg
+        self.hash = h
+        self.camera = camera      # 카메라 번호 (모르면 None)
+
+    def as_dict(self) -> Dict:
+        return {"shot_index": self.shot, "camera_index": self.camera, "center": [round(v, 4) for v in self.center],
+                "bbox": [round(v, 4) for v in self.bbox], "bytes": len(self.jpeg)}
+
+
+def find_envelope_quads(img: np.ndarray, min_area_ratio: float = 0.03, max_count: int = 6) -> List[np.ndarray]:
+    """봉투로 보이는 사각형(좌상,우상,우하,좌하)을 면적 큰 순으로 전부 찾는다. 다른 사각형 안에 든 것은 제외"""
+    h, w = img.shape[:2]
+    scale = 800.0 / max(h, w) if max(h, w) > 800 else 1.0
+    small = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else img
+    gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    edges = cv2.dilate(cv2.Canny(gray, 50, 150), np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    frame_area = small.shape[0] * small.shape[1]
+
+    quads = []
+    for c in sorted(contours, key=cv2.contourArea, reverse=True):
+        area = cv2.contourArea(c)
+        if area < min_area_ratio * frame_area:
+            break
+        if area > 0.95 * frame_area:
+            continue
+        approx = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            quad = _order_quad(approx)
+        else:
+            # 모서리가 가려졌거나 구겨진 봉투: 외접 회전 사각형이 윤곽을 충분히 채우면 채택
+            rect = cv2.minAreaRect(c)
+            if area < 0.85 * rect[1][0] * rect[1][1]:
+                continue
+            quad = _order_quad(cv2.boxPoints(rect))
+        cx, cy = quad.mean(axis=0)
+        if any(cv2.pointPolygonTest(q.reshape(-1, 1, 2), (float(cx), float(cy)), False) >= 0 for q in quads):
+            continue
+        quads.append(quad)
+        if len(quads) >= max_count:
+            break
+    return [q / scale for q in quads]
+
+
+def _overlap_ratio(a: np.ndarray, b: np.ndarray) -> float:
+    """두 사각형의 교집합 면적 / 작은 쪽 면적 (0 = 떨어짐, 1 = 한쪽이 다른 쪽 안에)"""
+    inter, _ = cv2.intersectConvexConvex(a.astype(np.float32), b.astype(np.float32))
+    small = min(cv2.contourArea(a.astype(np.float32)), cv2.contourArea(b.astype(np.float32)))
+    return float(inter) / small if small > 0 else 1.0
+
+
+def separate_envelopes(quads: List[np.ndarray], frame_area: float, min_coverage: float = 0.5,
+                       nested_overlap: float = 0.1) -> bool:
+    """사각형 여러 개를 봉투 여러 장으로 볼지: 서로 포개지지 않고, 합쳐서 프레임 대부분을 덮어야 한다"""
+    if len(quads) < 2 or frame_area <= 0:
+        return False
+    for i in range(len(quads)):
+        for j in range(i + 1, len(quads)):
+            if _overlap_ratio(quads[i], quads[j]) > nested_overlap:
+                return False
+    covered = sum(cv2.contourArea(q.astype(np.float32)) for q in quads)
+    return covered / frame_area >= min_coverage
+
+
+def segment_frame(image_bytes: bytes, shot: int, quality: int = 90, min_area_ratio: float = 0.03,
+                  min_coverage: float = 0.5, camera=None) -> List[Crop]:
+    """프레임 하나 → 봉투별 Crop 목록. 디코드 실패거나 봉투 여러 장으로 볼 수 없으면 []"""
+    img = decode_image(image_bytes)
+    if img is None:
+        return []
+    quads = find_envelope_quads(img, min_area_ratio)
+    H, W = img.shape[:2]
+    if not separate_envelopes(quads, float(H * W), min_coverage):
+        return []
+    crops = []
+    for q in quads:
+        warped = warp_quad(img, q)
+        h, w = warped.shape[:2]
+        tw, th = target_size(w, h)
+        if (tw, th) != (w, h):
+            warped = cv2.resize(warped, (tw, th), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", warped, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        if not ok:
+            continue
+        jpeg = buf.tobytes()
+        x0, y0 = q.min(axis=0)
+        x1, y1 = q.max(axis=0)
+        cx, cy = q.mean(axis=0)
+        crops.append(Crop(shot, (float(cx / W), float(cy / H)),
+                          [float(x0 / W), float(y0 / H), float((x1 - x0) / W), float((y1 - y0) / H)],
+                          jpeg, dhash(jpeg), camera))
+    return crops
+
+
+def group_crops(per_shot: List[List[Crop]], max_dist: float = 0.15, max_hamming: int = 40) -> List[List[Crop]]:
+    """샷마다 나온 Crop 들을 봉투별로 묶는다. 해시가 max_hamming 안이어야 같은 봉투 후보다 (위치만으로는 묶지 않음).
+    화면 위치는 같은 카메라 샷끼리만 비교할 수 있으므로(카메라마다 구도가 다름) 그룹에 같은 카메라 Crop 이 있으면
+    비용 = 해시 거리(비율) + 중심 거리(max_dist 넘으면 움직인 것으로 보고 가산), 없으면 해시 거리만으로 탐욕 매칭.
+    한 샷의 Crop 은 한 그룹에 하나만 들어간다. 그룹은 왼쪽→오른쪽, 위→아래 순으로 정렬."""
+    groups: List[List[Crop]] = []
+    for crops in per_shot:
+        pairs = []
+        for ci, c in enumerate(crops):
+            if c.hash is None:
+                continue
+            for gi, g in enumerate(groups):
+                hd = min((hamming(c.hash, r.hash) for r in g if r.hash is not None), default=256)
+                if hd > max_hamming:
+                    continue
+                cost = hd / 256
+                same_cam = [r for r in g if r.camera == c.camera]
+                if same_cam:
+                    ref = same_cam[-1]
+                    dist = float(np.hypot(c.center[0] - ref.center[0], c.center[1] - ref.center[1]))
+                    cost += dist if dist <= max_dist else 1.0 + dist
+                pairs.append((cost, ci, gi))
+        used_c, used_g = set(), set()
+        for _, ci, gi in sorted(pairs):
+            if ci in used_c or gi in used_g:
+                continue
+            groups[gi].append(crops[ci])
+            used_c.add(ci)
+            used_g.add(gi)
+        groups.extend([c] for ci, c in enumerate(crops) if ci not in used_c)
+
+    def _pos(g):
+        cx = sum(c.center[0] for c in g) / len(g)
+        cy = sum(c.center[1] for c in g) / len(g)
+        # 같은 줄(세로 1/4 이내)이면 x 순
+        return (round(cy * 4), cx)
+    return sorted(groups, key=_pos)
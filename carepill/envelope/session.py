@@ -0,0 +1,202 @@
+# carepill/envelope/session.py
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from .executor import ShotContext, ShotOutcome
+
+# 스캔 세션: 샷을 찍는 즉시 하나씩 올리고, 서버는 받는 즉시 전처리/업스트림 분석을 시작한다
+#   open → shot × N (admit 를 통과한 샷만 바로 분석 시작) → finalize(build 에 전체 샷을 넘겨 일반 스캔 파이프라인으로 병합)
+# 촬영 간격 동안 앞 샷의 업로드/분석이 진행되므로 촬영·전송·분석이 겹친다.
+# finalize 의 파이프라인(top-K/쿼럼/봉투 분리)은 SessionShot.future 로 이미 시작된 분석을 기다려 재사용하고,
+# 시작하지 않은 샷은 필요할 때만 분석한다.
+# 세션은 프로세스 메모리에만 있고 ttl_s 동안 갱신이 없으면 버린다.
+# owner 를 주면 연 사용자가 아닌 요청에는 세션이 없는 것처럼(not_found) 응답한다.
+# 업로드는 병렬로 도착하므로 샷 순서는 도착 순서가 아니라 호출자가 준 order(샷 번호, 카메라 번호)로 정한다
+# (finalize 의 쿼럼 웨이브가 shot-major 순서를 전제로 한다). 같은 order 가 두 번 오면 duplicate_shot.
+# 샷 추가/분석 완료/finalize 때마다 version 이 올라가므로 wait() 로 진행 상황을 기다릴 수 있다 (부분 결과 스트림).
+
+
+class SessionError(Exception):
+    """code: not_found | finalized | too_many_shots | too_many_sessions | duplicate_shot"""
+
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.code = code
+
+
+class SessionShot:
+    """세션에 올라온 샷: 이미지 바이트 + 미리 시작한 분석(future → ShotOutcome, 시작 안 했으면 None)"""
+    __slots__ = ("image", "future", "context", "order")
+
+    def __init__(self, image: bytes, future=None, context: Optional[ShotContext] = None, order: tuple = ()):
+        self.image = image
+        self.future = future
+        self.context = context
+        self.order = order
+
+
+class ScanSession:
+    def __init__(self, options: Dict, deadline_s: float, owner: str = ""):
+        self.id = str(uuid.uuid4())
+        self.owner = owner
+        self.options = options
+        self.deadline_s = deadline_s
+        self.opened_at = time.monotonic()
+        self.touched_at = self.opened_at
+        self.meta: List[Any] = []
+        self.shots: List[SessionShot] = []
+        self.state: Dict = {}          # admit 정책이 쓰는 세션별 상태 (카메라별 품질 점수 등)
+        self.finalized = False
+        self.closed = False            # 취소/만료됨
+        self.result = None
+        self.lock = threading.Lock()
+        self.version = 0
+        self._changed = threading.Condition()
+
+    def bump(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait(self, version: int, timeout: float) -> int:
+        """version 이후 변화(샷 추가/분석 완료/finalize/취소)가 있을 때까지 최대 timeout 초 대기 → 현재 version"""
+        with self._changed:
+            if self.version == version:
+                self._changed.wait(timeout)
+            return self.version
+
+    def status(self) -> Dict:
+        started = [sh.future for sh in self.shots if sh.future is not None]
+        return {"session_id": self.id, "shots": len(self.shots), "started": len(started),
+                "analyzed": sum(1 for f in started if f.done()),
+                "finalized": self.finalized, "age_ms": int((time.monotonic() - self.opened_at) * 1000)}
+
+
+class ScanSessionStore:
+    def __init__(self, analyze: Callable[[bytes, ShotContext], Any], max_workers: int = 4,
+                 ttl_s: float = 300.0, max_shots: int = 9, max_sessions: int = 64, deadline_s: float = 75.0,
+                 admit: Optional[Callable[[ScanSession, int, bytes, Any], bool]] = None):
+        """admit(session, idx, image, meta) → 도착 즉시 분석을 시작할지 (None 이면 전부 시작)"""
+        self.analyze = analyze
+        self.admit = admit
+        self.ttl_s = ttl_s
+        self.max_shots = max_shots
+        self.max_sessions = max_sessions
+        self.deadline_s = deadline_s
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="carepill-session")
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, ScanSession] = {}
+        self.opened = self.finalized = self.expired = 0
+
+    def _expire(self, now: float):
+        for sid in [sid for sid, s in self._sessions.items() if now - s.touched_at > self.ttl_s]:
+            self._cancel(self._sessions.pop(sid))
+            self.expired += 1
+
+    @staticmethod
+    def _cancel(s: ScanSession):
+        s.closed = True
+        for sh in s.shots:
+            if sh.future is not None:
+                sh.context.cancel()
+                sh.future.cancel()
+        s.bump()
+
+    def open(self, options: Optional[Dict] = None, owner: str = "") -> ScanSession:
+        with self._lock:
+            self._expire(time.monotonic())
+            if len(self._sessions) >= self.max_sessions:
+                raise SessionError("too_many_sessions")
+            s = ScanSession(options or {}, self.deadline_s, owner)
+            self._sessions[s.id] = s
+            self.opened += 1
+            return s
+
+    def get(self, sid: str, owner: Optional[str] = None) -> ScanSession:
+        with self._lock:
+            s = self._sessions.get(sid)
+            if s is None or (owner is not None and s.owner != owner):
+                raise SessionError("not_found")
+            s.touched_at = time.monotonic()
+            return s
+
+    def add_shot(self, sid: str, image: bytes, meta: Any = None, owner: Optional[str] = None,
+                 order: Optional[tuple] = None) -> int:
+        """샷 추가 후 (admit 를 통과하면) 바로 분석 시작. 반환: 1부터 시작하는 도착 번호
+        order: 세션 안 샷 위치 (예: (샷 번호, 카메라 번호)). 없으면 도착 순서대로 뒤에 붙는다"""
+        s = self.get(sid, owner)
+        with s.lock:
+            if s.finalized:
+                raise SessionError("finalized")
+            if len(s.shots) >= self.max_shots:
+                raise SessionError("too_many_shots")
+            idx = len(s.shots) + 1
+            order = tuple(order) if order is not None else (s.shots[-1].order[0] + 1 if s.shots else 1, 0, idx)
+            keys = [sh.order for sh in s.shots]
+            pos = bisect.bisect_left(keys, order)
+            if pos < len(keys) and keys[pos] == order:
+                raise SessionError("duplicate_shot")
+            shot = SessionShot(image, order=order)
+            s.meta.insert(pos, meta)
+            s.shots.insert(pos, shot)
+            s.bump()
+            if self.admit is not None and not self.admit(s, idx, image, meta):
+                return idx
+            ctx = ShotContext(idx, time.monotonic() + s.deadline_s)
+            outcome = ShotOutcome(idx)
+
+            def _task():
+                t0 = time.monotonic()
+                try:
+                    ctx.check()
+                    outcome.value, outcome.ok = self.analyze(image, ctx), True
+                except Exception as e:
+                    outcome.error = e
+                finally:
+                    outcome.elapsed_ms = int((time.monotonic() - t0) * 1000)
+                return outcome
+
+            shot.context = ctx
+            # 호출자의 contextvars(업스트림 클라이언트 식별)를 분석 스레드로 전달
+            shot.future = self._pool.submit(contextvars.copy_context().run, _task)
+            shot.future.add_done_callback(lambda f: s.bump())
+            return idx
+
+    def finalize(self, sid: str, build: Callable[[ScanSession], Dict], owner: Optional[str] = None) -> Dict:
+        """build(session) 결과를 반환 (남은 분석 대기는 build 의 파이프라인 마감시간을 따른다).
+        두 번째 호출부터는 같은 결과"""
+        s = self.get(sid, owner)
+        with s.lock:
+            if s.result is not None:
+                return s.result
+            s.finalized = True
+            try:
+                s.result = build(s)
+            finally:
+                # 파이프라인이 쓰지 않은(쿼럼/top-K 로 빠진) 샷의 분석은 중단
+                for sh in s.shots:
+                    if sh.future is not None and not sh.future.done():
+                        sh.context.cancel()
+                        sh.future.cancel()
+                s.bump()
+        with self._lock:
+            self.finalized += 1
+        return s.result
+
+    def discard(self, sid: str, owner: Optional[str] = None):
+        with self._lock:
+            s = self._sessions.get(sid)
+            if s is None or (owner is not None and s.owner != owner):
+                raise SessionError("not_found")
+            del self._sessions[sid]
+        self._cancel(s)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"active": len(self._sessions), "opened": self.opened,
+                    "finalized": self.finalized, "expired": self.expired}
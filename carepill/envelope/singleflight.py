@@ -0,0 +1,89 @@
+# carepill/envelope/singleflight.py
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Optional, Tuple
+
+# 중복 스캔 요청 합치기 (single-flight) + 완료 결과 재생 창
+# - 같은 키로 진행 중인 계산이 있으면 새로 시작하지 않고 그 결과를 기다린다 (joined)
+# - 끝난 결과는 replay_ttl_s 동안 그대로 돌려준다 (replay)
+# - 예외는 저장하지 않는다: 대기 중이던 요청에만 전달되고 다음 요청은 새로 계산
+
+
+class KeyConflict(Exception):
+    """같은 Idempotency-Key 가 다른 요청 내용으로 재사용됨"""
+
+
+class _Call:
+    __slots__ = ("event", "value", "error", "done_at", "fingerprint")
+
+    def __init__(self, fingerprint):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+        self.done_at = None
+        self.fingerprint = fingerprint
+
+
+class SingleFlight:
+    def __init__(self, replay_ttl_s: float = 120.0, max_entries: int = 128):
+        self.replay_ttl_s = replay_ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._calls = OrderedDict()   # key -> _Call
+        self.leaders = self.joined = self.replayed = 0
+
+    def _expire(self, now: float):
+        for k in [k for k, c in self._calls.items() if c.done_at is not None and now - c.done_at > self.replay_ttl_s]:
+            del self._calls[k]
+        while len(self._calls) > self.max_entries:
+            k, c = next(iter(self._calls.items()))
+            if c.done_at is None:
+                break
+            del self._calls[k]
+
+    def do(self, key: str, fn: Callable[[], Any], fingerprint: Optional[str] = None,
+           timeout: Optional[float] = None) -> Tuple[Any, str]:
+        """fn() 결과와 상태("leader" | "joined" | "replay")를 반환"""
+        with self._lock:
+            self._expire(time.monotonic())
+            call = self._calls.get(key)
+            if call is not None and fingerprint and call.fingerprint and call.fingerprint != fingerprint:
+                raise KeyConflict(key)
+            if call is None:
+                call = self._calls[key] = _Call(fingerprint)
+                self.leaders += 1
+                state = "leader"
+            elif call.done_at is not None:
+                self._calls.move_to_end(key)
+                self.replayed += 1
+                return call.value, "replay"
+            else:
+                self.joined += 1
+                state = "joined"
+
+        if state == "joined":
+            if not call.event.wait(timeout):
+                raise TimeoutError(key)
+            if call.error is not None:
+                raise call.error
+            return call.value, state
+
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._calls.pop(key, None)
+            raise
+        finally:
+            call.event.set()
+        with self._lock:
+            call.done_at = time.monotonic()
+        return call.value, state
+
+    def stats(self) -> dict:
+        with self._lock:
+            inflight = sum(1 for c in self._calls.values() if c.done_at is None)
+            return {"inflight": inflight, "replayable": len(self._calls) - inflight,
+                    "leaders": self.leaders, "joined": self.joined, "replayed": self.replayed}
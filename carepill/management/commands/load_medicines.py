@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from carepill.models import Medicine
+
+CRAWL_FIELDS = ("effect", "usage", "warning_general", "storage")
+
+
+class Command(BaseCommand):
+    help = "크롤링한 약품 정보(JSON 배열: item_seq, item_name, effect, usage, warning_general, storage)를 Medicine 에 적재"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="JSON 파일 경로")
+
+    def handle(self, *args, **opts):
+        try:
+            with open(opts["path"], encoding="utf-8") as f:
+                rows = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"읽기 실패: {e}")
+        if not isinstance(rows, list):
+            raise CommandError("JSON 배열이어야 합니다.")
+
+        created = updated = 0
+        for r in rows:
+            name = str(r.get("item_name") or r.get("name") or "").strip()
+            if not name:
+                continue
+            defaults = {k: str(r.get(k) or "").strip() for k in CRAWL_FIELDS}
+            defaults.update(item_seq=str(r.get("item_seq") or "").strip(),
+                            ingredient=str(r.get("ingredient") or "").strip(),
+                            source=Medicine.CRAWL)
+            _, was_created = Medicine.objects.update_or_create(name=name, defaults=defaults)
+            created += was_created
+            updated += not was_created
+        self.stdout.write(self.style.SUCCESS(f"created={created} updated={updated}"))
@@ -0,0 +1,218 @@
+import base64
+import glob
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+
+from carepill import views
+from carepill.envelope.merge import normalize_value
+from carepill.envelope.preprocess import decode_image, image_tokens
+
+# 녹화된 캡처(proto_test/captures)를 api_scan_envelope 파이프라인에 다시 흘려보내는 벤치마크
+# - 업스트림(_post_openai_chat)은 proto_test/results 에 기록된 샷별 응답을 돌려주는 스텁으로 교체
+# - 스캔 기록 저장(_record_scan)은 끈다 (벤치가 실제 DB 에 Scan 행을 쌓지 않게)
+# - 스텁 지연은 분포(fixed/uniform/lognormal)에서 샘플링
+# - 지표: 종단 지연 p50/p95/p99, 스캔당 업스트림 호출 수, 업로드 바이트, 토큰(추정), 골든 결과와 필드 일치율
+
+
+def parse_latency(spec: str):
+    """'fixed:800' | 'uniform:500,1500' | 'lognormal:900,0.35'(중앙값 ms, sigma) → 샘플러(초)"""
+    kind, _, args = spec.partition(":")
+    try:
+        nums = [float(x) for x in args.split(",") if x.strip()]
+        if kind == "fixed":
+            return lambda rng: nums[0] / 1000
+        if kind == "uniform":
+            return lambda rng: rng.uniform(nums[0], nums[1]) / 1000
+        if kind == "lognormal":
+            mu, sigma = np.log(nums[0]), nums[1]
+            return lambda rng: rng.lognormvariate(mu, sigma) / 1000
+    except (ValueError, IndexError):
+        pass
+    raise CommandError(f"지연 분포 형식 오류: {spec}")
+
+
+def load_sets(captures_dir: str, results_dir: str):
+    """결과 파일 하나 = 캡처 세트 하나. shots[].image_path 의 파일명으로 캡처를 찾는다"""
+    sets = []
+    for path in sorted(glob.glob(os.path.join(results_dir, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            res = json.load(f)
+        shots = []
+        for sh in res.get("shots") or []:
+            name = os.path.basename(str(sh.get("image_path", "")).replace("\\", "/"))
+            img_path = os.path.join(captures_dir, name)
+            if not os.path.exists(img_path):
+                continue
+            with open(img_path, "rb") as f:
+                img = f.read()
+            shots.append({"name": name, "bytes": img, "raw": sh.get("raw") or json.dumps(sh.get("json") or {}, ensure_ascii=False)})
+        if shots:
+            sets.append({"name": os.path.basename(path), "shots": shots, "golden": res.get("merged") or {}})
+    return sets
+
+
+class StubUpstream:
+    """_post_openai_chat 대체. 샷 모드는 현재 분석 중인 원본 이미지(sha1)로 녹화 응답을 찾는다"""
+
+    def __init__(self, latency, seed: int):
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.tls = threading.local()
+        self.recordings = {}
+        self.order = []
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.bytes_up = 0
+        self.lock = threading.Lock()
+
+    def load(self, shots):
+        self.recordings = {hashlib.sha1(s["bytes"]).hexdigest(): s["raw"] for s in shots}
+        self.order = [s["raw"] for s in shots]
+
+    def wrap_analyze(self, fn):
+        def traced(src, ctx):
+            self.tls.key = hashlib.sha1(views._read_shot(src) or b"").hexdigest()
+            try:
+                return fn(src, ctx)
+            finally:
+                self.tls.key = None
+        return traced
+
+    def __call__(self, payload, timeout=60, usage=None):
+        body = json.dumps(payload, ensure_ascii=False)
+        images = [c for m in payload.get("messages", []) if isinstance(m.get("content"), list)
+                  for c in m["content"] if c.get("type") == "image_url"]
+        key = getattr(self.tls, "key", None)
+        if len(images) > 1 or key is None:
+            content = json.dumps({"shots": [json.loads(r) if r.strip().startswith("{") else {} for r in self.order],
+                                  "reconciled": {}}, ensure_ascii=False)
+        else:
+            content = self.recordings.get(key, "{}")
+        with self.rng_lock:
+            delay = self.latency(self.rng)
+        time.sleep(min(delay, timeout))
+        with self.lock:
+            self.calls += 1
+            self.bytes_up += len(body.encode("utf-8"))
+        if usage is not None:
+            img_tokens = 0
+            for c in images:
+                b64 = c["image_url"]["url"].split(",", 1)[-1]
+                im = decode_image(base64.b64decode(b64))
+                if im is not None:
+                    img_tokens += image_tokens(im.shape[1], im.shape[0])
+            text_chars = len(body) - sum(len(c["image_url"]["url"]) for c in images)
+            # 토큰 수는 추정치: 한글 위주 텍스트 ~1.5자/토큰
+            prompt = img_tokens + int(text_chars / 1.5)
+            completion = int(len(content) / 1.5)
+            usage.update(prompt_tokens=prompt, completion_tokens=completion, total_tokens=prompt + completion)
+        return content
+
+
+def _pct(xs, q):
+    return round(float(np.percentile(xs, q)), 1) if xs else None
+
+
+class Command(BaseCommand):
+    help = "녹화 캡처로 약봉투 스캔 파이프라인 벤치마크 (지연/호출 수/바이트/토큰/골든 일치율)"
+
+    def add_arguments(self, parser):
+        base = os.path.join(str(settings.BASE_DIR), "proto_test")
+        parser.add_argument("--captures", default=os.path.join(base, "captures"))
+        parser.add_argument("--results", default=os.path.join(base, "results"))
+        parser.add_argument("--runs", type=int, default=20, help="세트당 반복 횟수")
+        parser.add_argument("--latency", default="lognormal:900,0.35", help="fixed:ms | uniform:a,b | lognormal:median_ms,sigma")
+        parser.add_argument("--mode", choices=views.SCAN_MODES, default="fanout")
+        parser.add_argument("--top-k", type=int, default=0, help="품질 상위 K (0이면 전부)")
+        parser.add_argument("--quorum", action="store_true")
+        parser.add_argument("--cache", action="store_true", help="추출 결과 캐시 사용 (기본 끔: 반복 실행이 전부 히트가 됨)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", action="store_true", help="결과를 JSON으로 출력")
+
+    def handle(self, *args, **opts):
+        sets = load_sets(opts["captures"], opts["results"])
+        if not sets:
+            raise CommandError("캡처 세트를 찾지 못했습니다.")
+
+        stub = StubUpstream(parse_latency(opts["latency"]), opts["seed"])
+        saved = (views._post_openai_chat, views._analyze_shot, views._record_scan, views.SCAN_CACHE, views.MED_FEATURES_LLM)
+        views._post_openai_chat = stub
+        views._analyze_shot = stub.wrap_analyze(saved[1])
+        views._record_scan = lambda client, out: out   # 벤치 실행은 Scan 기록을 남기지 않는다
+        views.SCAN_CACHE = opts["cache"]
+        views.MED_FEATURES_LLM = False
+        os.environ.setdefault("OPENAI_API_KEY", "bench")
+        rf = RequestFactory()
+        report = {"config": {k: opts[k] for k in ("runs", "latency", "mode", "top_k", "quorum", "cache", "seed")}, "sets": []}
+        try:
+            for s in sets:
+                stub.load(s["shots"])
+                body = json.dumps({
+                    "images": [base64.b64encode(sh["bytes"]).decode("ascii") for sh in s["shots"]],
+                    "mode": opts["mode"], "top_k": opts["top_k"], "quorum": opts["quorum"],
+                })
+                lat, calls, ups, ptok, ctok = [], [], [], [], []
+                agree = defaultdict(int)
+                golden = {k: v for k, v in s["golden"].items() if isinstance(v, str) and v.strip()}
+                for _ in range(opts["runs"]):
+                    stub.reset()
+                    t0 = time.perf_counter()
+                    resp = views.api_scan_envelope(rf.post("/api/scan/envelope/", data=body, content_type="application/json"))
+                    lat.append((time.perf_counter() - t0) * 1000)
+                    out = json.loads(resp.content)
+                    if resp.status_code != 200:
+                        raise CommandError(f"{s['name']}: {resp.status_code} {out}")
+                    perf = out.get("perf") or {}
+                    calls.append(stub.calls)
+                    ups.append(stub.bytes_up)
+                    ptok.append(perf.get("prompt_tokens", 0))
+                    ctok.append(perf.get("completion_tokens", 0))
+                    merged = out.get("merged") or {}
+                    for k, v in golden.items():
+                        agree[k] += normalize_value(k, merged.get(k, "")) == normalize_value(k, v)
+                n = opts["runs"]
+                report["sets"].append({
+                    "set": s["name"],
+                    "shots": len(s["shots"]),
+                    "bytes_in": sum(len(sh["bytes"]) for sh in s["shots"]),
+                    "latency_ms": {"p50": _pct(lat, 50), "p95": _pct(lat, 95), "p99": _pct(lat, 99), "max": round(max(lat), 1)},
+                    "upstream_calls": round(sum(calls) / n, 2),
+                    "bytes_uploaded": int(sum(ups) / n),
+                    "prompt_tokens": int(sum(ptok) / n),
+                    "completion_tokens": int(sum(ctok) / n),
+                    "field_agreement": {k: round(agree[k] / n, 3) for k in golden},
+                    "agreement": round(sum(agree.values()) / max(1, n * len(golden)), 3),
+                })
+        finally:
+            (views._post_openai_chat, views._analyze_shot, views._record_scan,
+             views.SCAN_CACHE, views.MED_FEATURES_LLM) = saved
+
+        if opts["json"]:
+            self.stdout.write(json.dumps(report, ensure_ascii=False, indent=2))
+            return
+        c = report["config"]
+        self.stdout.write(f"mode={c['mode']} latency={c['latency']} runs={c['runs']} top_k={c['top_k']} "
+                          f"quorum={c['quorum']} cache={c['cache']}")
+        for r in report["sets"]:
+            l = r["latency_ms"]
+            self.stdout.write(
+                f"\n[{r['set']}] shots={r['shots']} in={r['bytes_in']:,}B\n"
+                f"  latency p50={l['p50']}ms p95={l['p95']}ms p99={l['p99']}ms max={l['max']}ms\n"
+                f"  calls/scan={r['upstream_calls']} upload/scan={r['bytes_uploaded']:,}B "
+                f"tokens/scan={r['prompt_tokens']}+{r['completion_tokens']}\n"
+                f"  agreement={r['agreement']:.1%} "
+                + " ".join(f"{k}={v:.0%}" for k, v in r["field_agreement"].items())
+            )
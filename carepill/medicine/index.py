@@ -0,0 +1,154 @@
+# carepill/medicine/index.py
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+# 약품명 퍼지 인덱스: 한글을 자모로 분해한 뒤 n-gram 역색인으로 후보를 찾는다
+# OCR 오타는 대부분 음절 하나 안에서 자모 하나가 틀리는 형태라("레티나정" → "레티지정")
+# 음절 단위보다 자모 단위 n-gram 이 훨씬 많이 겹친다.
+
+_LEAD = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+_VOWEL = "ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ"
+_TAIL = ["", "ㄱ", "ㄲ", "ㄳ", "ㄴ", "ㄵ", "ㄶ", "ㄷ", "ㄹ", "ㄺ", "ㄻ", "ㄼ", "ㄽ", "ㄾ", "ㄿ", "ㅀ",
+         "ㅁ", "ㅂ", "ㅄ", "ㅅ", "ㅆ", "ㅇ", "ㅈ", "ㅊ", "ㅋ", "ㅌ", "ㅍ", "ㅎ"]
+_UNIT = [(re.compile(r"밀리그람|밀리그램|㎎"), "mg"), (re.compile(r"밀리리터|㎖"), "ml")]
+
+NGRAM = 3
+SEED_PATH = os.path.join(os.path.dirname(__file__), "seed.json")
+
+
+def decompose(text: str) -> str:
+    """한글 음절 → 호환 자모 문자열. 영문은 소문자, 숫자는 그대로, 나머지 기호/공백은 버린다"""
+    out = []
+    for ch in unicodedata.normalize("NFC", text or ""):
+        code = ord(ch) - 0xAC00
+        if 0 <= code < 11172:
+            out.append(_LEAD[code // 588])
+            out.append(_VOWEL[(code % 588) // 28])
+            out.append(_TAIL[code % 28])
+        elif ch.isalnum():
+            out.append(ch.lower())
+    return "".join(out)
+
+
+def normalize_name(name: str) -> str:
+    s = unicodedata.normalize("NFKC", name or "")
+    for pat, rep in _UNIT:
+        s = pat.sub(rep, s)
+    return s
+
+
+def ngrams(text: str, n: int = NGRAM) -> Counter:
+    j = decompose(normalize_name(text))
+    if not j:
+        return Counter()
+    j = f"^{j}$"
+    if len(j) <= n:
+        return Counter([j])
+    return Counter(j[i:i + n] for i in range(len(j) - n + 1))
+
+
+def _keys_for(entry: Dict) -> List[str]:
+    """검색 키: 전체 이름, 괄호 앞 제품명, 별칭"""
+    name = entry["name"]
+    keys = [name, re.split(r"[(\[]", name)[0]]
+    keys += [a for a in entry.get("aliases") or [] if isinstance(a, str)]
+    seen, out = set(), []
+    for k in keys:
+        k = k.strip()
+        if k and k not in seen:
+            seen.add(k)
+            out.append(k)
+    return out
+
+
+class MedicineIndex:
+    """메모리 역색인. search() 는 n-gram 겹침(Dice 계수) 순으로 후보를 돌려준다"""
+
+    def __init__(self, entries: Iterable[Dict] = ()):
+        self.entries: List[Dict] = []
+        self._keys: List[tuple] = []          # (entry_idx, gram_count)
+        self._post: Dict[str, List[tuple]] = {}   # gram → [(key_idx, count)]
+        for e in entries:
+            self.add(e)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry: Dict):
+        if not entry.get("name"):
+            return
+        ei = len(self.entries)
+        self.entries.append(entry)
+        for key in _keys_for(entry):
+            grams = ngrams(key)
+            if not grams:
+                continue
+            ki = len(self._keys)
+            self._keys.append((ei, sum(grams.values())))
+            for g, c in grams.items():
+                self._post.setdefault(g, []).append((ki, c))
+
+    def search(self, query: str, limit: int = 5) -> List[Dict]:
+        q = ngrams(query)
+        if not q:
+            return []
+        q_total = sum(q.values())
+        shared = Counter()
+        for g, qc in q.items():
+            for ki, kc in self._post.get(g, ()):
+                shared[ki] += min(qc, kc)
+        best: Dict[int, float] = {}
+        for ki, s in shared.items():
+            ei, k_total = self._keys[ki]
+            score = 2.0 * s / (q_total + k_total)
+            if score > best.get(ei, 0.0):
+                best[ei] = score
+        ranked = sorted(best.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+        return [dict(self.entries[ei], score=round(sc, 3)) for ei, sc in ranked]
+
+    def resolve(self, query: str, min_score: float = 0.5) -> Optional[Dict]:
+        hits = self.search(query, limit=1)
+        return hits[0] if hits and hits[0]["score"] >= min_score else None
+
+
+def load_seed(path: str = SEED_PATH) -> List[Dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [e for e in json.load(f) if isinstance(e, dict)]
+    except (OSError, ValueError):
+        return []
+
+
+_index: Optional[MedicineIndex] = None
+_lock = threading.Lock()
+
+
+def load_entries() -> List[Dict]:
+    """시드 파일 + DB(크롤링된 Medicine). 이름이 겹치면 DB 쪽을 쓴다"""
+    from .store import db_entries
+    db = db_entries()
+    names = {e["name"] for e in db}
+    return [e for e in load_seed(os.getenv("MEDICINE_SEED_PATH", SEED_PATH)) if e.get("name") not in names] + db
+
+
+def get_index() -> MedicineIndex:
+    """프로세스 전역 인덱스 (최초 호출 시 구성)"""
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                _index = MedicineIndex(load_entries())
+    return _index
+
+
+def reload_index(entries: Optional[Iterable[Dict]] = None) -> MedicineIndex:
+    global _index
+    idx = MedicineIndex(load_entries() if entries is None else entries)
+    with _lock:
+        _index = idx
+    return idx
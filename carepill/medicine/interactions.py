@@ -0,0 +1,249 @@
+# carepill/medicine/interactions.py
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .index import get_index
+
+# 성분 중복/상호작용 로컬 검사기
+# 1) 성분 정규화: 제품명 괄호 "(레보세티리진염산염)" → 성분 목록 → 염/수화물 접미사를 떼어 기준 성분명
+# 2) 규칙(interactions.json)을 성분 번호 기준 비트셋으로 미리 계산
+#      same_class[i]: i 와 같은 계열인 다른 성분들의 비트마스크
+#      inter[i]     : i 와 상호작용하는 성분들의 비트마스크
+# 3) 복용약 목록 검사는 약마다 성분 마스크를 만들고 쌍별 AND 만 한다 (겹치는 비트만 메시지로 풀어냄)
+# 의학적 판단을 대신하지 않으며, 걸리는 조합이 있으면 약사/의사 확인을 권하는 용도다.
+
+RULES_PATH = os.path.join(os.path.dirname(__file__), "interactions.json")
+
+# 긴 것부터 반복 제거 ("아토르바스타틴칼슘삼수화물" → "아토르바스타틴")
+_SALTS = sorted([
+    "수화물", "삼수화물", "이수화물", "무수물", "염산염", "황산염", "말레산염", "베실산염", "시트르산염",
+    "타르타르산염", "브롬화수소산염", "메실산염", "푸마르산염", "나트륨", "칼륨", "칼슘", "마그네슘",
+], key=len, reverse=True)
+_PREFIX = re.compile(r"^(dl|d|l)-")
+_DOSE = re.compile(r"\d+(\.\d+)?\s*(mg|g|ml|μg|mcg|밀리그람|밀리그램|%)$")
+_PAREN = re.compile(r"\(([^()]*)\)")
+_SPLIT = re.compile(r"[,·/+]|및")
+
+
+def normalize_ingredient(text: str) -> str:
+    s = unicodedata.normalize("NFKC", text or "").strip().lower().replace(" ", "")
+    s = _DOSE.sub("", _PREFIX.sub("", s))
+    changed = True
+    while changed and s:
+        changed = False
+        for suf in _SALTS:
+            if s.endswith(suf) and len(s) > len(suf) + 1:
+                s, changed = s[:-len(suf)], True
+                break
+    return s
+
+
+def split_ingredients(text: str) -> List[str]:
+    out = []
+    for part in _SPLIT.split(text or ""):
+        n = normalize_ingredient(part)
+        if n and n not in out:
+            out.append(n)
+    return out
+
+
+def parse_ingredients(name: str) -> List[str]:
+    """제품명 괄호 안 성분 → 기준 성분명 목록. "게보린정(아세트아미노펜,이소프로필안티피린,카페인무수물)" → 3개"""
+    out = []
+    for inner in _PAREN.findall(unicodedata.normalize("NFKC", name or "")):
+        for ing in split_ingredients(inner):
+            # "(수출명: …)" 같은 괄호나 용량만 든 괄호는 성분이 아니다
+            if not re.search(r"\d|:", ing) and ing not in out:
+                out.append(ing)
+    return out
+
+
+def ingredients_for(name: str, ingredient: str = "", min_score: float = 0.5) -> Tuple[List[str], Optional[str]]:
+    """약품명(+알면 성분 문자열) → (성분 목록, 매칭된 표준 제품명)
+    성분 문자열 → 제품명 괄호 → 약품명 인덱스 매칭 순으로 찾는다"""
+    if ingredient:
+        return split_ingredients(ingredient), None
+    parsed = parse_ingredients(name)
+    if parsed:
+        return parsed, None
+    hit = get_index().resolve(name, min_score) if name else None
+    if hit is not None:
+        return split_ingredients(hit.get("ingredient", "")) or parse_ingredients(hit["name"]), hit["name"]
+    return [], None
+
+
+def _bits(mask: int):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class InteractionMatrix:
+    def __init__(self, rules: Dict):
+        self.notes = {normalize_ingredient(k): v for k, v in (rules.get("ingredients") or {}).items()}
+        self.classes: List[Dict] = []
+        self.ids: Dict[str, int] = {}
+        self.names: List[str] = []
+        members = {}
+        for key, c in (rules.get("classes") or {}).items():
+            members[key] = [self._id(m) for m in c.get("members") or []]
+            self.classes.append({"key": key, "label": c.get("label", key), "message": c.get("message", "")})
+        pairs = []
+        for r in rules.get("interactions") or []:
+            ea = [i for ref in r.get("a") or [] for i in self._expand(ref, members)]
+            eb = [i for ref in r.get("b") or [] for i in self._expand(ref, members)]
+            pairs.append((ea, eb, {"level": r.get("level", "caution"), "message": r.get("message", "")}))
+
+        n = len(self.names)
+        self.class_of = [0] * n      # 성분 → 소속 계열 비트마스크
+        self.same_class = [0] * n    # 성분 → 같은 계열 다른 성분 비트마스크
+        self.inter = [0] * n         # 성분 → 상호작용 성분 비트마스크
+        self.rules: Dict[Tuple[int, int], Dict] = {}
+        for ci, c in enumerate(self.classes):
+            mask = 0
+            for i in members[c["key"]]:
+                mask |= 1 << i
+                self.class_of[i] |= 1 << ci
+            for i in members[c["key"]]:
+                self.same_class[i] |= mask & ~(1 << i)
+        for ea, eb, rule in pairs:
+            for i in ea:
+                for j in eb:
+                    if i == j:
+                        continue
+                    self.inter[i] |= 1 << j
+                    self.inter[j] |= 1 << i
+                    self.rules[(i, j)] = self.rules[(j, i)] = rule
+
+    def _id(self, name: str) -> int:
+        name = normalize_ingredient(name)
+        if name not in self.ids:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+        return self.ids[name]
+
+    def _expand(self, ref: str, members: Dict) -> List[int]:
+        return members.get(ref[1:], []) if ref.startswith("@") else [self._id(ref)]
+
+    def check(self, meds: List[Dict]) -> Dict:
+        """meds: [{label, ingredients: [기준 성분명...]}] → {duplicates, class_duplicates, interactions}
+        규칙에 없는 성분도 같은 성분끼리의 중복은 잡는다 (검사마다 임시 번호 부여)"""
+        extra: Dict[str, int] = {}
+        n = len(self.names)
+
+        def _mask(ings):
+            m = 0
+            for ing in ings:
+                i = self.ids.get(ing)
+                if i is None:
+                    i = extra.setdefault(ing, n + len(extra))
+                m |= 1 << i
+            return m
+
+        def _name(i):
+            return self.names[i] if i < n else next(k for k, v in extra.items() if v == i)
+
+        masks = [_mask(m["ingredients"]) for m in meds]
+        known = (1 << n) - 1
+        same_cls, inter = [], []
+        for m in masks:
+            sc = it = 0
+            for i in _bits(m & known):
+                sc |= self.same_class[i]
+                it |= self.inter[i]
+            same_cls.append(sc)
+            inter.append(it)
+
+        dup: Dict[int, set] = {}
+        cls: Dict[int, set] = {}
+        hits = []
+        for a in range(len(masks)):
+            for b in range(a + 1, len(masks)):
+                for i in _bits(masks[a] & masks[b]):
+                    dup.setdefault(i, set()).update((a, b))
+                for j in _bits(same_cls[a] & masks[b]):
+                    for i in _bits(masks[a] & known):
+                        for ci in _bits(self.class_of[i] & self.class_of[j]):
+                            cls.setdefault(ci, set()).update((a, b))
+                for j in _bits(inter[a] & masks[b]):
+                    for i in _bits(masks[a] & self.inter[j]):
+                        hits.append((a, b, i, j, self.rules[(i, j)]))
+
+        def label(k):
+            return meds[k]["label"]
+
+        return {
+            "duplicates": [{"ingredient": _name(i), "medicines": [label(k) for k in sorted(ks)],
+                            "message": self.notes.get(_name(i), "같은 성분이 중복됩니다.")}
+                           for i, ks in sorted(dup.items())],
+            "class_duplicates": [{"class": self.classes[ci]["key"], "label": self.classes[ci]["label"],
+                                  "medicines": [label(k) for k in sorted(ks)], "message": self.classes[ci]["message"]}
+                                 for ci, ks in sorted(cls.items())],
+            "interactions": [{"medicines": [label(a), label(b)], "ingredients": [self.names[i], self.names[j]],
+                              "level": rule["level"], "message": rule["message"]}
+                             for a, b, i, j, rule in hits],
+        }
+
+
+def load_rules(path: str = RULES_PATH) -> Dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+_matrix: Optional[InteractionMatrix] = None
+_lock = threading.Lock()
+
+
+def get_matrix() -> InteractionMatrix:
+    global _matrix
+    if _matrix is None:
+        with _lock:
+            if _matrix is None:
+                _matrix = InteractionMatrix(load_rules())
+    return _matrix
+
+
+def check_medicines(items: Iterable[Dict]) -> Dict:
+    """items: [{name, ingredient?, id?}] → 약별 성분 + 검사 결과 (+ elapsed_us: 성분 해석 제외 검사 시간)
+    저장된 복용약(id 있음)은 처방(행)마다 따로 검사한다 — 두 병원에서 받은 타이레놀도 아세트아미노펜 중복.
+    보낸 항목(id 없음)은 같은 표준 제품으로 해석되는 저장 약이나 앞 항목이 있으면 뺀다
+    (말로 한 "타이레놀" = 저장된 타이레놀정500… 그 자체)"""
+    resolved = []
+    for it in items:
+        ings, matched = ingredients_for(it.get("name", ""), it.get("ingredient", ""))
+        resolved.append((it, ings, matched, matched or it.get("name", "")))
+    seen = {key for it, _, _, key in resolved if it.get("id") is not None}
+    meds = []
+    for it, ings, matched, key in resolved:
+        if it.get("id") is None:
+            if key in seen:
+                continue
+            seen.add(key)
+        med = {"label": it.get("name", ""), "matched": matched, "ingredients": ings,
+               "source": it.get("source", "request")}
+        if it.get("id") is not None:
+            med.update(id=it["id"], prescription_number=it.get("prescription_number", ""),
+                       pharmacy_name=it.get("pharmacy_name", ""))
+        meds.append(med)
+    # 같은 이름이 여러 처방에 있으면 경고 문구에서 구분되게 약국/처방번호를 붙인다
+    names = Counter(m["label"] for m in meds)
+    for m in meds:
+        if names[m["label"]] > 1 and m.get("id") is not None:
+            rx = f"처방 {m['prescription_number']}" if m["prescription_number"] else ""
+            tag = ", ".join(t for t in (m["pharmacy_name"], rx) if t) or f"#{m['id']}"
+            m["label"] = f"{m['label']} ({tag})"
+    t = time.perf_counter()
+    out = get_matrix().check(meds)
+    out["elapsed_us"] = int((time.perf_counter() - t) * 1e6)
+    out["medicines"] = meds
+    return out
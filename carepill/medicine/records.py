@@ -0,0 +1,117 @@
+# carepill/medicine/records.py
+import datetime
+import logging
+from typing import Dict, List, Optional
+
+from django.core.paginator import Paginator
+from django.db import DatabaseError, transaction
+
+from ..pagecache import invalidate
+
+logger = logging.getLogger(__name__)
+
+# 스캔 결과 저장 + 현재 복용약(Medication) upsert
+# 스캔 1회 = 고정된 왕복 수: Scan insert 1 + ScanShot bulk insert 1 + Medicine 조회 1 + Medication bulk upsert 1
+# (봉투/샷/필드 수와 무관). 커밋되면 owner 의 페이지 캐시를 무효화한다
+
+MEDS_PER_PAGE = 12
+
+
+def _date(v) -> Optional[datetime.date]:
+    try:
+        return datetime.date.fromisoformat(str(v or ""))
+    except ValueError:
+        return None
+
+
+def _envelopes(out: Dict) -> List[Dict]:
+    """스캔 응답 → 봉투별 {merged, shots} 목록 (단일 봉투 응답도 같은 모양으로)"""
+    if out.get("envelopes"):
+        return [{"merged": e.get("merged") or {}, "shots": e.get("shots") or []} for e in out["envelopes"]]
+    return [{"merged": out.get("merged") or {}, "shots": out.get("shots") or []}]
+
+
+def save_scan(owner: str, out: Dict) -> Optional[str]:
+    """스캔 응답 dict 를 저장하고 scan id 를 반환. DB를 쓸 수 없으면 경고만 남기고 None"""
+    from ..models import Medication, Medicine, Scan, ScanShot
+
+    envs = _envelopes(out)
+    first = envs[0]["merged"]
+    try:
+        with transaction.atomic():
+            scan = Scan.objects.create(
+                owner=owner,
+                patient_name=first.get("patient_name", "")[:100],
+                prescription_number=first.get("prescription_number", "")[:50],
+                dispense_date=_date(first.get("dispense_date")),
+                pharmacy_name=first.get("pharmacy_name", "")[:200],
+                envelopes=len(envs),
+                merged=first if len(envs) == 1 else {"envelopes": [e["merged"] for e in envs]},
+                perf=out.get("perf") or {},
+            )
+            ScanShot.objects.bulk_create([
+                ScanShot(scan=scan, envelope=e, index=sh.get("index") or 0,
+                         camera_index=(sh.get("meta") or {}).get("camera_index") if isinstance(sh.get("meta"), dict) else None,
+                         ok=not str(sh.get("raw", "")).startswith(("ERROR", "SKIPPED")),
+                         parse=sh.get("parse") or "", cache=sh.get("cache") or "",
+                         elapsed_ms=sh.get("elapsed_ms"), raw=sh.get("raw") or "", data=sh.get("json") or {})
+                for e, env in enumerate(envs, 1) for sh in env["shots"]
+            ])
+
+            rows = {}
+            for env in envs:
+                m = env["merged"]
+                std = m.get("medicine") or {}
+                name = (std.get("name") or m.get("medicine_name") or "").strip()[:200]
+                if not name:
+                    continue
+                rx = m.get("prescription_number", "")[:50]
+                # 같은 스캔에 같은 약이 두 번 나오면 마지막 봉투 기준
+                rows[(rx, name)] = Medication(
+                    owner=owner, patient_name=m.get("patient_name", "")[:100], prescription_number=rx,
+                    dispense_date=_date(m.get("dispense_date")), pharmacy_name=m.get("pharmacy_name", "")[:200],
+                    medicine_name=name, dosage_instructions=m.get("dosage_instructions", "")[:200],
+                    frequency=m.get("frequency", "")[:200],
+                    description=(m.get("med_features") or {}).get("description", ""), last_scan=scan,
+                )
+            if rows:
+                known = dict(Medicine.objects.filter(name__in=[n for _, n in rows]).values_list("name", "pk"))
+                for (_, name), row in rows.items():
+                    row.medicine_id = known.get(name)
+                Medication.objects.bulk_create(
+                    list(rows.values()), update_conflicts=True,
+                    unique_fields=["owner", "prescription_number", "medicine_name"],
+                    update_fields=["patient_name", "dispense_date", "pharmacy_name", "medicine",
+                                   "dosage_instructions", "frequency", "description", "last_scan", "updated_at"],
+                )
+            # bulk upsert 는 post_save 를 보내지 않으므로 직접
+            transaction.on_commit(lambda: invalidate(owner))
+        return str(scan.id)
+    except DatabaseError as e:
+        logger.warning("scan store unavailable: %s", e)
+        return None
+
+
+def current_medications(owner: str, page=1, per_page: int = MEDS_PER_PAGE):
+    """owner 의 현재 복용약 한 페이지 ((owner, -updated_at) 인덱스 사용)"""
+    from ..models import Medication
+
+    qs = (Medication.objects.filter(owner=owner)
+          .select_related("medicine")
+          .order_by("-updated_at", "-id"))
+    return Paginator(qs, per_page).get_page(page)
+
+
+def current_medicine_items(owner: str, limit: int = 100) -> List[Dict]:
+    """성분 검사용: owner 의 복용약 [{id, name, ingredient, prescription_number, pharmacy_name, source}] (쿼리 1번)
+    같은 제품이라도 처방(행)이 다르면 따로 내려간다"""
+    from ..models import Medication
+
+    try:
+        rows = (Medication.objects.filter(owner=owner).order_by("-updated_at")
+                .values_list("id", "medicine_name", "medicine__ingredient", "prescription_number", "pharmacy_name")[:limit])
+        return [{"id": pk, "name": n, "ingredient": ing or "", "prescription_number": rx, "pharmacy_name": ph,
+                 "source": "saved"} for pk, n, ing, rx, ph in rows]
+    except DatabaseError as e:
+        logger.warning("scan store unavailable: %s", e)
+        return []
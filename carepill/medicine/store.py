@@ -0,0 +1,130 @@
+# carepill/medicine/store.py
+import logging
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import Future
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from django.db import DatabaseError
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# 약품 지식 저장소 (Medicine 모델)
+# 스캔 결과의 med_features(한줄설명/적응증/주의사항)는 약마다 항상 같으므로
+# 비전 호출에서 빼고, 표준 제품명으로 여기서 조회한다.
+#   1) crawl 행이 있으면 그대로 사용
+#   2) 없거나 llm 행이 만료됐으면 fetch(name, ingredient) 를 한 번 호출해 llm 행으로 저장
+#      - 인덱스에서 표준 제품으로 확인된 이름(resolved=True)만. OCR 이 읽은 그대로의 이름으로는 생성/저장하지 않는다
+#      - 같은 약은 동시에 여러 스캔이 와도 한 번만 호출 (이름별 single-flight, 네트워크 호출 중에는 락을 잡지 않음)
+
+MED_FEATURES_TTL_S = float(os.getenv("MED_FEATURES_TTL_S", str(30 * 24 * 3600)))
+FEATURE_KEYS = ("description", "indications", "cautions")
+
+FETCH_WAIT_S = 25.0
+
+_inflight_lock = threading.Lock()
+_inflight: Dict[str, Future] = {}     # 정규화된 이름 → 생성 중인 (features, source)
+
+
+def _flight_key(name: str) -> str:
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", name)).lower()
+
+
+def _first_sentence(text: str, limit: int = 80) -> str:
+    s = re.split(r"(?<=[.다])\s", (text or "").strip(), maxsplit=1)[0]
+    return s if len(s) <= limit else s[:limit].rstrip() + "…"
+
+
+def to_features(row) -> Dict:
+    return {
+        "description": row.description or _first_sentence(row.effect),
+        "indications": row.effect,
+        "cautions": row.warning_general,
+        "usage": row.usage,
+        "storage": row.storage,
+    }
+
+
+def empty_features() -> Dict:
+    return {k: "" for k in FEATURE_KEYS}
+
+
+def _fresh(row) -> bool:
+    if row.source == row.CRAWL:
+        return True
+    return row.updated_at and timezone.now() - row.updated_at < timedelta(seconds=MED_FEATURES_TTL_S)
+
+
+def _lookup(name: str, item_seq: str = ""):
+    from ..models import Medicine
+    qs = Medicine.objects.filter(item_seq=item_seq) if item_seq else Medicine.objects.none()
+    return qs.first() or Medicine.objects.filter(name=name).first()
+
+
+def features_for(name: str, ingredient: str = "", item_seq: str = "",
+                 fetch: Optional[Callable[[str, str], Dict]] = None, resolved: bool = False) -> Tuple[Dict, str]:
+    """표준 제품명 → (med_features, source). source: crawl | llm | fetched | none
+    resolved=False(인덱스에서 확인 안 된 이름)면 저장된 행만 쓰고 fetch 하지 않는다"""
+    if not name:
+        return empty_features(), "none"
+    from ..models import Medicine
+    try:
+        row = _lookup(name, item_seq)
+        if row and _fresh(row):
+            return to_features(row), row.source
+        if fetch is None or not resolved:
+            return (to_features(row), row.source) if row else (empty_features(), "none")
+        # 같은 약이 동시에 여러 번 스캔돼도 생성 호출은 한 번만: 먼저 온 쪽이 호출하고 나머지는 기다렸다가 다시 조회
+        key = _flight_key(name)
+        with _inflight_lock:
+            fut = _inflight.get(key)
+            leader = fut is None
+            if leader:
+                fut = _inflight[key] = Future()
+        if not leader:
+            return fut.result(timeout=FETCH_WAIT_S)
+        try:
+            row = _lookup(name, item_seq)
+            if row and _fresh(row):
+                out = to_features(row), row.source
+            else:
+                feats = fetch(name, ingredient) or {}
+                row, _ = Medicine.objects.update_or_create(
+                    name=name,
+                    defaults={
+                        "source": Medicine.LLM,
+                        "ingredient": ingredient or "",
+                        "description": feats.get("description", ""),
+                        "effect": feats.get("indications", ""),
+                        "warning_general": feats.get("cautions", ""),
+                    },
+                )
+                out = to_features(row), "fetched"
+            fut.set_result(out)
+            return out
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key, None)
+    except DatabaseError as e:
+        logger.warning("medicine store unavailable: %s", e)
+        return empty_features(), "none"
+    except Exception as e:
+        logger.warning("med_features fetch failed for %s: %s", name, e)
+        return empty_features(), "none"
+
+
+def db_entries() -> List[Dict]:
+    """크롤링으로 들어온 약품을 인덱스 항목으로 (테이블이 없으면 빈 목록)"""
+    from ..models import Medicine
+    try:
+        rows = Medicine.objects.filter(source=Medicine.CRAWL).values("name", "item_seq", "ingredient")
+        return [dict(r, aliases=[]) for r in rows]
+    except DatabaseError:
+        return []
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.14 on 2026-10-18 05:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carepill', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Medicine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True)),
+                ('item_seq', models.CharField(blank=True, db_index=True, default='', max_length=20)),
+                ('ingredient', models.CharField(blank=True, default='', max_length=500)),
+                ('description', models.TextField(blank=True, default='')),
+                ('effect', models.TextField(blank=True, default='')),
+                ('usage', models.TextField(blank=True, default='')),
+                ('warning_general', models.TextField(blank=True, default='')),
+                ('storage', models.TextField(blank=True, default='')),
+                ('source', models.CharField(choices=[('crawl', 'crawl'), ('llm', 'llm')], default='crawl', max_length=8)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.0.14 on 2026-10-18 05:25
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carepill', '0002_medicine'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Scan',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('owner', models.CharField(max_length=80)),
+                ('patient_name', models.CharField(blank=True, default='', max_length=100)),
+                ('prescription_number', models.CharField(blank=True, default='', max_length=50)),
+                ('dispense_date', models.DateField(blank=True, null=True)),
+                ('pharmacy_name', models.CharField(blank=True, default='', max_length=200)),
+                ('envelopes', models.PositiveSmallIntegerField(default=1)),
+                ('merged', models.JSONField(blank=True, default=dict)),
+                ('perf', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-created_at'], name='carepill_sc_owner_cd9be2_idx'), models.Index(fields=['patient_name', 'dispense_date'], name='carepill_sc_patient_349087_idx'), models.Index(fields=['prescription_number'], name='carepill_sc_prescri_22b3a0_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ScanShot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('envelope', models.PositiveSmallIntegerField(default=1)),
+                ('index', models.PositiveSmallIntegerField()),
+                ('camera_index', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('ok', models.BooleanField(default=False)),
+                ('parse', models.CharField(blank=True, default='', max_length=16)),
+                ('cache', models.CharField(blank=True, default='', max_length=16)),
+                ('elapsed_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('raw', models.TextField(blank=True, default='')),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('scan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shots', to='carepill.scan')),
+            ],
+            options={
+                'ordering': ['scan', 'envelope', 'index'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Medication',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('owner', models.CharField(max_length=80)),
+                ('patient_name', models.CharField(blank=True, default='', max_length=100)),
+                ('prescription_number', models.CharField(blank=True, default='', max_length=50)),
+                ('dispense_date', models.DateField(blank=True, null=True)),
+                ('pharmacy_name', models.CharField(blank=True, default='', max_length=200)),
+                ('medicine_name', models.CharField(max_length=200)),
+                ('dosage_instructions', models.CharField(blank=True, default='', max_length=200)),
+                ('frequency', models.CharField(blank=True, default='', max_length=200)),
+                ('description', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('medicine', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='medications', to='carepill.medicine')),
+                ('last_scan', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='carepill.scan')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-updated_at'], name='carepill_me_owner_ab6365_idx'), models.Index(fields=['patient_name'], name='carepill_me_patient_c459fe_idx'), models.Index(fields=['prescription_number'], name='carepill_me_prescri_169a6f_idx'), models.Index(fields=['dispense_date'], name='carepill_me_dispens_9c549b_idx'), models.Index(fields=['medicine_name'], name='carepill_me_medicin_38dba3_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='medication',
+            constraint=models.UniqueConstraint(fields=('owner', 'prescription_number', 'medicine_name'), name='uniq_medication_rx'),
+        ),
+    ]
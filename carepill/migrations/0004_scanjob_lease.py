@@ -0,0 +1,28 @@
+# Generated by Django 5.0.14 on 2026-10-18 05:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carepill', '0003_scan_medication'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='client',
+            field=models.CharField(blank=True, default='', max_length=80),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='scanjob',
+            name='worker',
+            field=models.CharField(blank=True, default='', max_length=80),
+        ),
+    ]
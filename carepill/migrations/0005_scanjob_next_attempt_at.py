@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 05:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carepill', '0004_scanjob_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scanjob',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,3 +1,164 @@
+import uuid
+
 from django.db import models
 
 # Create your models here.
+
+
+class ScanJob(models.Model):
+    """비동기 약봉투 스캔 작업. 입력 이미지는 MEDIA_ROOT/scan_jobs/<id>/ 에 저장"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "queued"), (RUNNING, "running"), (SUCCEEDED, "succeeded"), (FAILED, "failed")]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    options = models.JSONField(default=dict, blank=True)   # mode/quorum/top_k 등 스캔 옵션
+    meta = models.JSONField(default=list, blank=True)      # 샷별 camera_index/shot_index
+    image_paths = models.JSONField(default=list, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    client = models.CharField(max_length=80, blank=True, default="")   # 제출한 사용자 (스케줄러 공정 분배/결과 소유자)
+    worker = models.CharField(max_length=80, blank=True, default="")   # 실행 중인 워커 "host:pid"
+    heartbeat_at = models.DateTimeField(null=True, blank=True)         # 실행 중 주기적으로 갱신 (lease)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)      # 재시도 백오프: 이 시각 전에는 실행하지 않음
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    queue_ms = models.PositiveIntegerField(null=True, blank=True)  # 제출 → 첫 실행 시작
+    run_ms = models.PositiveIntegerField(null=True, blank=True)    # 마지막 실행 시작 → 종료
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"ScanJob({self.id}, {self.status})"
+
+    @property
+    def done(self) -> bool:
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def as_dict(self, include_result: bool = True) -> dict:
+        out = {
+            "job_id": str(self.id),
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "error": self.error or None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "queue_ms": self.queue_ms,
+            "run_ms": self.run_ms,
+        }
+        if include_result:
+            out["result"] = self.result
+        return out
+
+
+class Medicine(models.Model):
+    """약품 지식 저장소. 스캔 결과의 med_features 를 비전 호출 대신 여기서 채운다.
+    source=crawl: 의약품안전나라 크롤링(proto_test/crawling) 필드, 만료 없음
+    source=llm:   한 번 생성한 설명을 MED_FEATURES_TTL_S 동안 재사용"""
+
+    CRAWL = "crawl"
+    LLM = "llm"
+    SOURCE_CHOICES = [(CRAWL, "crawl"), (LLM, "llm")]
+
+    name = models.CharField(max_length=200, unique=True)
+    item_seq = models.CharField(max_length=20, blank=True, default="", db_index=True)
+    ingredient = models.CharField(max_length=500, blank=True, default="")
+    description = models.TextField(blank=True, default="")      # 한줄 설명
+    effect = models.TextField(blank=True, default="")           # 효능효과
+    usage = models.TextField(blank=True, default="")            # 용법용량
+    warning_general = models.TextField(blank=True, default="")  # 사용상 주의사항
+    storage = models.TextField(blank=True, default="")          # 저장방법
+    source = models.CharField(max_length=8, choices=SOURCE_CHOICES, default=CRAWL)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Scan(models.Model):
+    """약봉투 스캔 1회의 병합 결과. owner 는 업스트림 스케줄러와 같은 클라이언트 식별자(user:/session:)"""
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.CharField(max_length=80)
+    patient_name = models.CharField(max_length=100, blank=True, default="")
+    prescription_number = models.CharField(max_length=50, blank=True, default="")
+    dispense_date = models.DateField(null=True, blank=True)
+    pharmacy_name = models.CharField(max_length=200, blank=True, default="")
+    envelopes = models.PositiveSmallIntegerField(default=1)
+    merged = models.JSONField(default=dict, blank=True)   # 봉투가 여러 개면 envelopes[].merged 목록
+    perf = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["owner", "-created_at"]),
+            models.Index(fields=["patient_name", "dispense_date"]),
+            models.Index(fields=["prescription_number"]),
+        ]
+
+    def __str__(self):
+        return f"Scan({self.id}, {self.patient_name or '-'})"
+
+
+class ScanShot(models.Model):
+    """스캔의 샷별 추출 결과 (봉투가 여러 개면 봉투 × 샷)"""
+
+    scan = models.ForeignKey(Scan, on_delete=models.CASCADE, related_name="shots")
+    envelope = models.PositiveSmallIntegerField(default=1)
+    index = models.PositiveSmallIntegerField()
+    camera_index = models.PositiveSmallIntegerField(null=True, blank=True)
+    ok = models.BooleanField(default=False)
+    parse = models.CharField(max_length=16, blank=True, default="")
+    cache = models.CharField(max_length=16, blank=True, default="")
+    elapsed_ms = models.PositiveIntegerField(null=True, blank=True)
+    raw = models.TextField(blank=True, default="")
+    data = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        ordering = ["scan", "envelope", "index"]
+
+
+class Medication(models.Model):
+    """현재 복용 중인 약. 같은 owner + 처방번호 + 약품명이면 마지막 스캔으로 덮어쓴다(upsert)"""
+
+    owner = models.CharField(max_length=80)
+    patient_name = models.CharField(max_length=100, blank=True, default="")
+    prescription_number = models.CharField(max_length=50, blank=True, default="")
+    dispense_date = models.DateField(null=True, blank=True)
+    pharmacy_name = models.CharField(max_length=200, blank=True, default="")
+    medicine_name = models.CharField(max_length=200)      # 표준 제품명(매칭되면) 또는 봉투에 적힌 이름
+    medicine = models.ForeignKey(Medicine, null=True, blank=True, on_delete=models.SET_NULL, related_name="medications")
+    dosage_instructions = models.CharField(max_length=200, blank=True, default="")
+    frequency = models.CharField(max_length=200, blank=True, default="")
+    description = models.TextField(blank=True, default="")
+    last_scan = models.ForeignKey(Scan, null=True, blank=True, on_delete=models.SET_NULL, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "prescription_number", "medicine_name"], name="uniq_medication_rx"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-updated_at"]),   # /meds/ 목록 페이지
+            models.Index(fields=["patient_name"]),
+            models.Index(fields=["prescription_number"]),
+            models.Index(fields=["dispense_date"]),
+            models.Index(fields=["medicine_name"]),
+        ]
+
+    def __str__(self):
+        return self.medicine_name
@@ -0,0 +1,90 @@
+# carepill/pagecache.py
+import hashlib
+import os
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+# 페이지/프래그먼트 캐시 (사용자별)
+# - 사용자(owner)마다 버전(마지막 변경 시각)을 두고, ETag/Last-Modified 는 버전으로 계산한다
+#   → 조건부 GET 은 렌더링/DB 조회 없이 304
+# - 렌더링한 HTML 은 ETag 를 키로 PAGE_CACHE_TTL_S 동안 보관 → 304 를 못 받는 클라이언트도 즉시 응답
+# - 스캔/복용약 저장 시 invalidate(owner) 로 버전을 올리면 이전 ETag/HTML 은 전부 무효
+# 버전은 django cache 에 있으므로 여러 프로세스로 띄우면 CACHES 를 공유 백엔드(redis/memcached)로 설정해야 한다.
+
+PAGE_CACHE = os.getenv("PAGE_CACHE", "1") == "1"
+PAGE_CACHE_TTL_S = int(os.getenv("PAGE_CACHE_TTL_S", "600"))
+
+
+def _version_key(owner: str) -> str:
+    return "pagever:" + hashlib.md5(owner.encode("utf-8")).hexdigest()
+
+
+def owner_version(owner: str) -> float:
+    """owner 페이지들의 현재 버전. 없으면(첫 방문/캐시 축출) 지금 시각으로 새로 만든다"""
+    return cache.get_or_set(_version_key(owner), time.time, None)
+
+
+def invalidate(owner: str):
+    cache.set(_version_key(owner), time.time(), None)
+
+
+def cached_page(name: str, owner_fn, csrf: bool = False):
+    """GET/HEAD 페이지 뷰 데코레이터. owner_fn(request) 로 사용자를 구분한다.
+    csrf=True 인 페이지(템플릿에 csrf_token)는 CSRF 쿠키별로 캐시하고, 쿠키가 없으면 캐시하지 않는다."""
+    def deco(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not PAGE_CACHE or request.method not in ("GET", "HEAD"):
+                return view(request, *args, **kwargs)
+            token = request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")
+            if csrf and not token:
+                # 첫 방문: 렌더링하면서 CSRF 쿠키부터 발급
+                return view(request, *args, **kwargs)
+            owner = owner_fn(request)
+            version = owner_version(owner)
+            etag = '"%s"' % hashlib.md5(f"{name}|{owner}|{version}|{token}|{request.get_full_path()}".encode("utf-8")).hexdigest()
+            last_modified = int(version)
+
+            resp = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if resp is None:
+                key = "page:" + etag.strip('"')
+                hit = cache.get(key)
+                if hit is not None:
+                    resp = HttpResponse(hit[1], content_type=hit[0])
+                    resp["X-Page-Cache"] = "hit"
+                else:
+                    resp = view(request, *args, **kwargs)
+                    if resp.status_code != 200 or resp.streaming:
+                        return resp
+                    cache.set(key, (resp["Content-Type"], resp.content), PAGE_CACHE_TTL_S)
+                    resp["X-Page-Cache"] = "miss"
+            resp["ETag"] = etag
+            resp["Last-Modified"] = http_date(last_modified)
+            # 브라우저는 보관하되 매번 재검증 → 변경 없으면 304
+            patch_cache_control(resp, private=True, no_cache=True)
+            patch_vary_headers(resp, ("Cookie",))
+            return resp
+        return wrapper
+    return deco
+
+
+def _on_owner_change(sender, instance, **kwargs):
+    owner = getattr(instance, "owner", "")
+    if owner:
+        transaction.on_commit(lambda: invalidate(owner))
+
+
+def connect_signals():
+    """admin 등에서 Scan/Medication 을 직접 고쳐도 해당 사용자 페이지를 무효화"""
+    from .models import Medication, Scan
+    for model in (Scan, Medication):
+        post_save.connect(_on_owner_change, sender=model, dispatch_uid=f"pagecache_save_{model.__name__}")
+        post_delete.connect(_on_owner_change, sender=model, dispatch_uid=f"pagecache_delete_{model.__name__}")
@@ -169,6 +169,12 @@
     if (t === "input_audio_buffer.speech_started") { logEvt("input_audio_buffer.speech_started"); return; }
     if (t === "input_audio_buffer.speech_stopped") { logEvt("input_audio_buffer.speech_stopped"); return; }
 
+    // 도구 호출: 성분 중복/상호작용은 서버 로컬 검사 결과로 답하게 한다
+    if (t === "response.function_call_arguments.done") {
+      runTool(msg).catch(err => logSys("tool error: " + (err.message || err)));
+      return;
+    }
+
     // CarePill 응답: 한 응답당 1번만 출력(완료 기준)
     if (t.startsWith("response.")) {
       const id = (msg.response && msg.response.id) || null;
@@ -204,6 +210,25 @@
     logEvt(t);
   }
 
+  // ===== Tools =====
+  async function runTool(msg) {
+    let output = { error: "unknown_tool" };
+    if (msg.name === "check_medications") {
+      let args = {}; try { args = JSON.parse(msg.arguments || "{}"); } catch {}
+      logEvt("check_medications " + JSON.stringify(args.medicines || []));
+      const r = await fetch("/api/meds/check/", {
+        method: "POST", headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ medicines: args.medicines || [], include_current: true })
+      });
+      output = await r.json();
+    }
+    dc?.send(JSON.stringify({
+      type: "conversation.item.create",
+      item: { type: "function_call_output", call_id: msg.call_id, output: JSON.stringify(output) }
+    }));
+    dc?.send(JSON.stringify({ type: "response.create" }));
+  }
+
   // ===== Bind =====
   document.addEventListener("DOMContentLoaded", () => {
     ui("idle");
@@ -1,3 +1,274 @@
-from django.test import TestCase
+import threading
+import time
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .envelope.cache import ExtractionCache
+from .envelope.executor import ShotCancelled, run_shots
+from .envelope.merge import cluster_merge
+from .envelope.parsing import parse_model_json, repair_json
+from .envelope.segment import Crop, group_crops
+from .envelope.session import ScanSessionStore, SessionError
+from .medicine.index import MedicineIndex, decompose
+from .medicine.interactions import InteractionMatrix, check_medicines, normalize_ingredient, parse_ingredients
+from .upstream.scheduler import client_scope, current_client
+
+
+class RunShotsTests(SimpleTestCase):
+    def test_results_keep_input_order(self):
+        out = run_shots(lambda x, ctx: (time.sleep(0.05 * (3 - x)), x * 10)[1], [0, 1, 2], max_workers=3)
+        self.assertEqual([o.value for o in out], [0, 10, 20])
+        self.assertTrue(all(o.ok for o in out))
+
+    def test_errors_stay_on_their_shot(self):
+        def fn(x, ctx):
+            if x == 1:
+                raise ValueError("bad_image")
+            return x
+        out = run_shots(fn, [0, 1, 2])
+        self.assertEqual([o.ok for o in out], [True, False, True])
+        self.assertIsInstance(out[1].error, ValueError)
+
+    def test_deadline_cancels_pending_shots(self):
+        release = threading.Event()
+
+        def fn(x, ctx):
+            release.wait(1.0)
+            return x
+        t0 = time.monotonic()
+        out = run_shots(fn, [0, 1, 2], max_workers=1, deadline_s=0.2)
+        release.set()
+        self.assertLess(time.monotonic() - t0, 0.9)
+        self.assertTrue(all(isinstance(o.error, ShotCancelled) for o in out))
+
+    def test_max_workers_bounds_concurrency(self):
+        lock, running, peak = threading.Lock(), [0], [0]
+
+        def fn(x, ctx):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+        run_shots(fn, list(range(6)), max_workers=2)
+        self.assertLessEqual(peak[0], 2)
+
+    def test_on_done_can_cancel_the_rest(self):
+        def on_done(o, run):
+            for i in range(len(run.contexts)):
+                run.cancel(i)
+        out = run_shots(lambda x, ctx: (time.sleep(0.05 * x), ctx.check(), x)[2], [0, 1, 2, 3],
+                        max_workers=1, on_done=on_done)
+        self.assertTrue(out[0].ok)
+        self.assertTrue(all(isinstance(o.error, ShotCancelled) for o in out[1:]))
+
+    def test_client_scope_reaches_shot_threads(self):
+        with client_scope("session:abc"):
+            out = run_shots(lambda x, ctx: current_client(), [0, 1])
+        self.assertEqual([o.value for o in out], ["session:abc", "session:abc"])
+
+
+class ExtractionCacheTests(SimpleTestCase):
+    def test_exact_hit_is_per_namespace(self):
+        c = ExtractionCache()
+        self.assertEqual(c.claim("u1", "k")[0], "miss")
+        c.put("u1", "k", "v")
+        self.assertEqual(c.claim("u1", "k"), ("hit", "v"))
+        self.assertEqual(c.claim("u2", "k")[0], "miss")
+
+    def test_near_frame_reuses_within_the_same_burst_only(self):
+        c = ExtractionCache(near_distance=4)
+        c.claim("u1", "a", "burst1", 0b1111_0000)
+        c.put("u1", "a", "va")
+        self.assertEqual(c.claim("u1", "b", "burst1", 0b1111_0011), ("near", "va"))
+        self.assertEqual(c.claim("u1", "c", "burst2", 0b1111_0011)[0], "miss")
+        self.assertEqual(c.claim("u2", "d", "burst1", 0b1111_0011)[0], "miss")
+        self.assertEqual(c.claim("u1", "e", "burst1", 0b0000_1111)[0], "miss")
+
+    def test_near_frame_waits_for_the_frame_in_flight(self):
+        c = ExtractionCache(near_distance=4)
+        c.claim("u1", "a", "b", 0)
+        state, ev = c.claim("u1", "b", "b", 1)
+        self.assertEqual(state, "wait")
+        c.put("u1", "a", "va")
+        self.assertTrue(ev.is_set())
+        self.assertEqual(c.claim("u1", "b", "b", 1), ("near", "va"))
+
+    def test_failed_frame_does_not_block_the_burst(self):
+        c = ExtractionCache(near_distance=4)
+        c.claim("u1", "a", "b", 0)
+        c.release("u1", "a")
+        self.assertEqual(c.claim("u1", "b", "b", 1)[0], "miss")
+
+    def test_ttl_and_capacity(self):
+        c = ExtractionCache(max_entries=2, ttl_s=0.05)
+        for k in "abc":
+            c.claim("u", k)
+            c.put("u", k, k)
+        self.assertEqual(c.stats()["entries"], 2)
+        self.assertEqual(c.claim("u", "a")[0], "miss")
+        c.release("u", "a")
+        time.sleep(0.06)
+        self.assertEqual(c.claim("u", "c")[0], "miss")
+
+
+class ParseModelJsonTests(SimpleTestCase):
+    def test_plain_and_fenced(self):
+        self.assertEqual(parse_model_json('{"a": 1}'), ({"a": 1}, "ok"))
+        self.assertEqual(parse_model_json('```json\n{"a": 1}\n```'), ({"a": 1}, "ok"))
+
+    def test_prose_and_trailing_comma_are_repaired(self):
+        self.assertEqual(parse_model_json('결과입니다: {"a": 1, "b": [2, 3,],} 끝'),
+                         ({"a": 1, "b": [2, 3]}, "repaired"))
+
+    def test_truncated_value_is_dropped_not_completed(self):
+        info = {}
+        v, status = parse_model_json('{"medicine_name": "타이레놀", "dosage": "1일 3', info)
+        self.assertEqual(status, "repaired")
+        self.assertEqual(v, {"medicine_name": "타이레놀"})
+        self.assertEqual(info["truncated"], ["dosage"])
+
+    def test_truncated_inside_nested_list(self):
+        text, dropped = repair_json('{"items": [{"name": "a"}, {"name": "b", "dose": 5')
+        self.assertEqual(text, '{"items": [{"name": "a"}, {"name": "b"}]}')
+        self.assertEqual(dropped, ["items", "dose"])
+
+    def test_garbage_fails(self):
+        self.assertEqual(parse_model_json("no json here"), ({}, "failed"))
+        self.assertEqual(parse_model_json(""), ({}, "failed"))
+
+
+class ClusterMergeTests(SimpleTestCase):
+    def test_value_without_strength_is_not_a_conflict(self):
+        value, conf, diag = cluster_merge(["레티리진(레보세티리진염산염)", "레티나정(레보세티리진염산염) 5mg"],
+                                          "medicine_name")
+        self.assertEqual(value, "레티나정(레보세티리진염산염) 5mg")
+        self.assertEqual(conf, 1.0)
+        self.assertEqual(diag["numeric_conflict"], 0)
+
+    def test_short_filler_word_still_clusters(self):
+        value, conf, _ = cluster_merge(["1일 3회 5일분", "1일 3회 총 5일분"], "dosage_instructions")
+        self.assertEqual(conf, 1.0)
+        self.assertEqual(value, "1일 3회 총 5일분")
+
+    def test_different_numbers_conflict(self):
+        value, conf, diag = cluster_merge(["1일 3회", "1일 3회", "1일 2회"], "frequency")
+        self.assertEqual(value, "1일 3회")
+        self.assertEqual(diag["numeric_conflict"], 1)
+        self.assertEqual(conf, 0.333)
+
+    def test_numberless_value_does_not_bridge_conflicting_strengths(self):
+        _, _, diag = cluster_merge(["타이레놀", "타이레놀 500mg", "타이레놀 650mg"], "medicine_name")
+        self.assertEqual(sorted(c["size"] for c in diag["clusters"]), [1, 2])
+        self.assertEqual(diag["numeric_conflict"], 1)
+
+
+class MedicineIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = MedicineIndex([
+            {"name": "레티나정(레보세티리진염산염) 5mg", "aliases": ["레티나"]},
+            {"name": "타이레놀정 500mg"},
+            {"name": "판콜에이내복액"},
+        ])
+
+    def test_decompose_splits_syllables_into_jamo(self):
+        self.assertEqual(decompose("약 5mg!"), "ㅇㅑㄱ5mg")
+
+    def test_single_jamo_typo_still_resolves(self):
+        hit = self.index.resolve("레티지정")
+        self.assertEqual(hit["name"], "레티나정(레보세티리진염산염) 5mg")
+
+    def test_alias_and_unit_spelling(self):
+        self.assertEqual(self.index.search("레티나", limit=1)[0]["score"], 1.0)
+        self.assertEqual(self.index.resolve("타이레놀정 500밀리그램")["name"], "타이레놀정 500mg")
+
+    def test_unrelated_query_does_not_resolve(self):
+        self.assertIsNone(self.index.resolve("아스피린"))
+        self.assertEqual(self.index.search(""), [])
+
+
+class InteractionTests(SimpleTestCase):
+    RULES = {
+        "classes": {"nsaid": {"label": "NSAID", "members": ["이부프로펜", "나프록센", "아스피린"]}},
+        "interactions": [{"a": ["아스피린"], "b": ["@nsaid"], "level": "avoid", "message": "m"}],
+    }
+
+    def test_salt_and_dose_suffixes_are_stripped(self):
+        self.assertEqual(normalize_ingredient("레보세티리진염산염"), "레보세티리진")
+        self.assertEqual(normalize_ingredient("카페인무수물 50mg"), "카페인")
+        self.assertEqual(parse_ingredients("게보린정(아세트아미노펜,이소프로필안티피린,카페인무수물)"),
+                         ["아세트아미노펜", "이소프로필안티피린", "카페인"])
+
+    def test_class_duplicate_and_interaction(self):
+        out = InteractionMatrix(self.RULES).check([
+            {"label": "A", "ingredients": ["이부프로펜"]},
+            {"label": "B", "ingredients": ["아스피린"]},
+        ])
+        self.assertEqual(out["class_duplicates"][0]["medicines"], ["A", "B"])
+        self.assertEqual(out["interactions"][0]["level"], "avoid")
+
+    def test_unknown_ingredient_still_duplicates(self):
+        out = InteractionMatrix({}).check([{"label": "A", "ingredients": ["x"]}, {"label": "B", "ingredients": ["x"]}])
+        self.assertEqual(out["duplicates"][0]["medicines"], ["A", "B"])
+
+    def test_same_product_on_two_prescriptions_warns(self):
+        rx = "타이레놀정(아세트아미노펜)"
+        out = check_medicines([
+            {"name": rx, "id": 1, "pharmacy_name": "가약국", "prescription_number": "11"},
+            {"name": rx, "id": 2, "pharmacy_name": "나약국", "prescription_number": "22"},
+            {"name": rx},
+        ])
+        self.assertEqual(len(out["medicines"]), 2)
+        self.assertEqual(out["duplicates"][0]["ingredient"], "아세트아미노펜")
+        self.assertEqual(out["duplicates"][0]["medicines"],
+                         [f"{rx} (가약국, 처방 11)", f"{rx} (나약국, 처방 22)"])
+
+
+class GroupCropsTests(SimpleTestCase):
+    A, B = 0, (1 << 256) - 1     # 해시가 완전히 다른 두 봉투
+
+    def crop(self, shot, x, h, camera=0):
+        return Crop(shot, (x, 0.5), [x - 0.1, 0.3, 0.2, 0.4], b"", h, camera)
+
+    def test_position_alone_does_not_group(self):
+        groups = group_crops([[self.crop(1, 0.3, self.A)], [self.crop(2, 0.3, self.B)]])
+        self.assertEqual(len(groups), 2)
+
+    def test_same_camera_prefers_the_crop_in_place(self):
+        near_b = self.B ^ 0b111
+        groups = group_crops([
+            [self.crop(1, 0.25, self.A), self.crop(1, 0.75, self.B)],
+            [self.crop(2, 0.75, near_b), self.crop(2, 0.25, self.A ^ 0b1)],
+        ])
+        self.assertEqual([[c.hash for c in g] for g in groups], [[self.A, self.A ^ 0b1], [self.B, near_b]])
+
+    def test_other_camera_matches_by_hash_not_position(self):
+        groups = group_crops([
+            [self.crop(1, 0.25, self.A, camera=0), self.crop(1, 0.75, self.B, camera=0)],
+            [self.crop(2, 0.25, self.B, camera=1), self.crop(2, 0.75, self.A, camera=1)],
+        ])
+        self.assertEqual([sorted(c.shot for c in g) for g in groups], [[1, 2], [1, 2]])
+        self.assertEqual([{c.hash for c in g} for g in groups], [{self.A}, {self.B}])
+
+
+class ScanSessionStoreTests(SimpleTestCase):
+    def test_shots_are_placed_by_order_not_arrival(self):
+        store = ScanSessionStore(lambda img, ctx: img, admit=lambda *a: False)
+        sess = store.open()
+        for order in [(2, 1), (1, 2), (1, 1)]:
+            store.add_shot(sess.id, repr(order).encode(), {"order": order}, order=order)
+        self.assertEqual([m["order"] for m in sess.meta], [(1, 1), (1, 2), (2, 1)])
+        with self.assertRaises(SessionError) as cm:
+            store.add_shot(sess.id, b"x", None, order=(1, 1))
+        self.assertEqual(cm.exception.code, "duplicate_shot")
+
+    def test_wait_wakes_when_an_analysis_finishes(self):
+        store = ScanSessionStore(lambda img, ctx: (time.sleep(0.05), img)[1])
+        sess = store.open()
+        store.add_shot(sess.id, b"a")
+        version = sess.version
+        deadline = time.monotonic() + 1.0
+        while not sess.shots[0].future.done() and time.monotonic() < deadline:
+            version = sess.wait(version, 0.5)
+        self.assertTrue(sess.shots[0].future.result().ok)
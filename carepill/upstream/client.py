@@ -0,0 +1,339 @@
+# carepill/upstream/client.py
+import email.utils
+import importlib.util
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+from .resilience import CircuitBreaker, HedgeBudget, LatencyTracker
+from .scheduler import SCAN, Scheduler, UpstreamBusy
+
+logger = logging.getLogger(__name__)
+
+# OpenAI 공용 업스트림 클라이언트
+# - 프로세스 전체에서 httpx.Client 하나를 공유 → keep-alive 커넥션 재사용 (요청마다 TCP+TLS 핸드셰이크 제거)
+# - h2 패키지(requirements: h2)가 있으면 HTTP/2 (없으면 경고 후 HTTP/1.1 풀). 실제 협상된 버전은 로그/스냅샷으로 확인
+# - 모든 호출은 상대 경로("/chat/completions" 등)로 보내 OPENAI_BASE_URL 설정을 따른다
+# - timeout 은 재시도를 포함한 호출 전체 예산. 429/5xx 와 연결 오류는 Retry-After 또는 지터 백오프 후 재시도
+# - 호출마다 타이밍 훅 호출: hook({name, method, url, status, elapsed_ms, attempt, error, http_version})
+# - scheduler 가 있으면 매 시도 전에 우선순위/토큰 버킷 허가를 받는다 (scheduler.py)
+# - hedge=True 호출은 학습된 지연 백분위를 넘기면 같은 요청을 한 번 더 보내 먼저 끝난 쪽을 쓴다
+#   진 쪽 요청도 업스트림에서 끝까지 처리되므로 hedge 된 POST 는 두 번 과금된다 (토큰 버킷에도 두 번 청구).
+#   결과를 버려도 되는(부작용 없는) 호출에만 쓰고, 비율은 hedge_budget 으로 제한한다
+# - 이름별 차단기: 업스트림 장애 시 타임아웃까지 기다리지 않고 CircuitOpen 으로 즉시 실패 (resilience.py)
+
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def h2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def openai_headers(api_key: Optional[str] = None, content_type: str = "application/json", beta: str = None) -> Dict:
+    h = {"Authorization": f"Bearer {api_key or os.getenv('OPENAI_API_KEY', '')}", "Content-Type": content_type}
+    if beta:
+        h["OpenAI-Beta"] = beta
+    return h
+
+
+def retry_after_s(resp: httpx.Response) -> Optional[float]:
+    """Retry-After (초 또는 HTTP-date) → 초. 없으면 None"""
+    v = (resp.headers.get("retry-after") or "").strip()
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(v).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_chat_tokens(payload: Dict) -> int:
+    """chat/completions 요청의 대략적 토큰 (텍스트 ~2자/토큰 + 이미지당 detail=high 평균치 + max_tokens)"""
+    chars, images = 0, 0
+    for m in payload.get("messages") or []:
+        c = m.get("content")
+        if isinstance(c, str):
+            chars += len(c)
+        elif isinstance(c, list):
+            for part in c:
+                if part.get("type") == "image_url":
+                    images += 1
+                else:
+                    chars += len(part.get("text") or "")
+    return int(chars / 2) + 765 * images + int(payload.get("max_tokens") or 500)
+
+
+class UpstreamStats:
+    """이름(name)별 호출 수/재시도/오류/지연 합계"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_name = defaultdict(lambda: {"calls": 0, "attempts": 0, "retries": 0, "errors": 0,
+                                             "elapsed_ms": 0, "max_ms": 0, "status": defaultdict(int)})
+        self.http_versions = defaultdict(int)
+
+    def __call__(self, info: Dict):
+        with self._lock:
+            s = self._by_name[info["name"]]
+            s["attempts"] += 1
+            s["retries"] += info["attempt"] > 0
+            s["elapsed_ms"] += info["elapsed_ms"]
+            s["max_ms"] = max(s["max_ms"], info["elapsed_ms"])
+            if info["error"]:
+                s["errors"] += 1
+            else:
+                s["status"][str(info["status"])] += 1
+            if info["final"]:
+                s["calls"] += 1
+            if info.get("http_version"):
+                self.http_versions[info["http_version"]] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            out = {}
+            for name, s in self._by_name.items():
+                out[name] = dict(s, status=dict(s["status"]),
+                                 avg_ms=int(s["elapsed_ms"] / s["attempts"]) if s["attempts"] else 0)
+            return {"by_name": out, "http_versions": dict(self.http_versions)}
+
+
+class UpstreamClient:
+    def __init__(self, base_url: str = OPENAI_BASE_URL, timeout: float = 60.0, connect_timeout: float = 5.0,
+                 max_connections: int = 32, max_keepalive: int = 16, retries: int = 2,
+                 backoff_base_s: float = 0.5, backoff_max_s: float = 8.0, http2: Optional[bool] = None,
+                 scheduler: Optional[Scheduler] = None, hedge_percentile: float = 95.0,
+                 hedge_budget: float = 0.1, hedge_min_s: float = 0.3, hedging: bool = True):
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self.http2 = h2_available() if http2 is None else (http2 and h2_available())
+        if http2 and not self.http2:
+            logger.warning("upstream HTTP/2 requested but the h2 package is not installed; using HTTP/1.1")
+        self.base_url = base_url
+        self.negotiated = None      # 마지막 응답의 HTTP 버전 (바뀔 때마다 로그)
+        self._client = httpx.Client(
+            base_url=base_url,
+            http2=self.http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=60.0),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self.scheduler = scheduler
+        self.latency = LatencyTracker()
+        self.hedge = HedgeBudget(ratio=hedge_budget)
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_s = hedge_min_s
+        self._hedge_pool = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix="carepill-hedge")
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+        self.stats = UpstreamStats()
+        self._hooks: List[Callable[[Dict], None]] = [self.stats]
+
+    def add_hook(self, fn: Callable[[Dict], None]):
+        self._hooks.append(fn)
+
+    def _emit(self, info: Dict):
+        for fn in self._hooks:
+            try:
+                fn(info)
+            except Exception:
+                logger.exception("upstream hook failed")
+
+    def backoff_s(self, attempt: int) -> float:
+        """full jitter: U(0, min(max, base * 2^attempt))"""
+        return random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2 ** attempt)))
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        with self._breakers_lock:
+            b = self._breakers.get(name)
+            if b is None:
+                b = self._breakers[name] = CircuitBreaker(name)
+            return b
+
+    def _send(self, method: str, url: str, timeout_s: float, **kwargs) -> httpx.Response:
+        return self._client.request(method, url, timeout=httpx.Timeout(
+            timeout_s, connect=min(self.connect_timeout, timeout_s)), **kwargs)
+
+    def _send_hedged(self, name: str, method: str, url: str, deadline: float, priority: int,
+                     client: Optional[str], est_tokens: int = 0, **kwargs) -> httpx.Response:
+        """학습된 백분위까지 기다려도 응답이 없으면 같은 요청을 한 번 더 보내고 먼저 성공한 쪽을 반환.
+        예비 요청도 업스트림에서 과금되므로 스케줄러에 est_tokens 를 따로 청구한다"""
+        remaining = max(0.1, deadline - time.monotonic())
+        self.hedge.on_request()
+        p = self.latency.percentile(name, self.hedge_percentile)
+        if p is None or max(p, self.hedge_min_s) >= remaining:
+            return self._send(method, url, remaining, **kwargs)
+        primary = self._hedge_pool.submit(self._send, method, url, remaining, **kwargs)
+        try:
+            return primary.result(timeout=max(p, self.hedge_min_s))
+        except FutureTimeout:
+            pass
+        if not self.hedge.allow():
+            return primary.result()
+        if self.scheduler is not None:
+            try:
+                self.scheduler.acquire(priority, est_tokens, client=client, deadline_at=time.monotonic())
+            except UpstreamBusy:
+                return primary.result()
+        backup = self._hedge_pool.submit(self._send, method, url, max(0.1, deadline - time.monotonic()), **kwargs)
+        done, _ = wait([primary, backup], return_when=FIRST_COMPLETED)
+        first = done.pop()
+        other = backup if first is primary else primary
+
+        def good(f):
+            return f.exception() is None and f.result().status_code < 500
+
+        winner = first
+        if not good(first):
+            wait([other])
+            if good(other):
+                winner = other
+        if winner is backup:
+            self.hedge.on_win()
+        # 진 쪽 응답은 끝나는 대로 닫는다
+        loser = other if winner is first else first
+        loser.add_done_callback(lambda f: f.exception() is None and f.result().close())
+        return winner.result()
+
+    def request(self, method: str, url: str, *, name: str = "", timeout: Optional[float] = None,
+                retries: Optional[int] = None, priority: int = SCAN, est_tokens: int = 0,
+                client: Optional[str] = None, hedge: bool = False, **kwargs) -> httpx.Response:
+        """method/url/headers/json/content 는 httpx 와 같다. 마지막 응답을 그대로 반환(상태코드 판단은 호출자),
+        연결 오류가 재시도 후에도 계속되면 httpx.HTTPError, 스케줄러 대기가 예산을 넘으면 UpstreamBusy,
+        차단기가 열려 있으면 CircuitOpen(UpstreamBusy 하위)."""
+        budget = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + budget
+        retries = self.retries if retries is None else retries
+        name = name or url
+        breaker = self.breaker(name)
+        attempt = 0
+        while True:
+            # 스케줄러 허가 → 차단기 순서: 스케줄러 대기(UpstreamBusy)가 half-open 시험 자리를 잡고 있지 않게
+            grant = None
+            if self.scheduler is not None:
+                grant = self.scheduler.acquire(priority, est_tokens, client=client, deadline_at=deadline)
+            try:
+                breaker.before()
+            except UpstreamBusy:
+                if grant is not None:
+                    grant.refund()
+                raise
+            recorded = False
+            try:
+                t0 = time.monotonic()
+                info = {"name": name, "method": method, "url": url, "attempt": attempt, "status": None,
+                        "error": None, "http_version": None, "final": False}
+                try:
+                    if hedge and self.hedging:
+                        resp = self._send_hedged(name, method, url, deadline, priority, client, est_tokens, **kwargs)
+                    else:
+                        resp = self._send(method, url, max(0.1, deadline - time.monotonic()), **kwargs)
+                except httpx.TransportError as e:
+                    breaker.record(False)
+                    recorded = True
+                    info.update(elapsed_ms=int((time.monotonic() - t0) * 1000), error=type(e).__name__)
+                    delay = self.backoff_s(attempt)
+                    if attempt >= retries or time.monotonic() + delay >= deadline:
+                        info["final"] = True
+                        self._emit(info)
+                        raise
+                    self._emit(info)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+
+                breaker.record(resp.status_code < 500)
+                recorded = True
+                info.update(elapsed_ms=int((time.monotonic() - t0) * 1000), status=resp.status_code,
+                            http_version=resp.http_version)
+                if resp.http_version != self.negotiated:
+                    self.negotiated = resp.http_version
+                    logger.info("upstream %s negotiated %s (http2 %s)", self.base_url, resp.http_version,
+                                "enabled" if self.http2 else "disabled")
+                if resp.status_code < 400:
+                    self.latency.record(name, time.monotonic() - t0)
+                ra = retry_after_s(resp)
+                if resp.status_code == 429 and self.scheduler is not None:
+                    self.scheduler.pause(self.backoff_s(attempt) if ra is None else ra)
+                if resp.status_code in RETRY_STATUSES and attempt < retries:
+                    delay = self.backoff_s(attempt) if ra is None else ra
+                    if time.monotonic() + delay < deadline:
+                        self._emit(info)
+                        logger.info("upstream %s %s → retry in %.2fs", name, resp.status_code, delay)
+                        resp.close()
+                        time.sleep(delay)
+                        attempt += 1
+                        continue
+                info["final"] = True
+                self._emit(info)
+                if grant is not None and est_tokens and resp.status_code == 200:
+                    try:
+                        grant.settle((resp.json().get("usage") or {}).get("total_tokens") or 0)
+                    except (ValueError, AttributeError):
+                        pass
+                return resp
+            finally:
+                # 판정 없이 빠져나가는 모든 경로(예외 포함)에서 half-open 시험 자리 반환
+                if not recorded:
+                    breaker.release()
+
+    def snapshot(self) -> Dict:
+        with self._breakers_lock:
+            breakers = {k: b.snapshot() for k, b in self._breakers.items()}
+        return {
+            "base_url": self.base_url,
+            "http2_enabled": self.http2,
+            "negotiated": self.negotiated,
+            "calls": self.stats.snapshot(),
+            "latency": self.latency.snapshot(),
+            "hedge": self.hedge.snapshot(),
+            "breakers": breakers,
+            "scheduler": self.scheduler.snapshot() if self.scheduler else None,
+        }
+
+    def post(self, url: str, **kwargs) -> httpx.Response:
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+_client: Optional[UpstreamClient] = None
+_lock = threading.Lock()
+
+
+def get_client() -> UpstreamClient:
+    """프로세스 공용 클라이언트 (최초 호출 시 생성)"""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                scheduler = None
+                if os.getenv("UPSTREAM_SCHEDULER", "1") == "1":
+                    scheduler = Scheduler(rpm=float(os.getenv("UPSTREAM_RPM", "500")),
+                                          tpm=float(os.getenv("UPSTREAM_TPM", "200000")))
+                _client = UpstreamClient(
+                    retries=int(os.getenv("UPSTREAM_RETRIES", "2")),
+                    max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "32")),
+                    http2=os.getenv("UPSTREAM_HTTP2", "1") == "1",
+                    scheduler=scheduler,
+                    hedge_percentile=float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95")),
+                    hedge_budget=float(os.getenv("UPSTREAM_HEDGE_BUDGET", "0.1")),
+                    hedging=os.getenv("UPSTREAM_HEDGE", "1") == "1",
+                )
+    return _client
@@ -0,0 +1,160 @@
+# carepill/upstream/resilience.py
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, Optional
+
+import numpy as np
+
+from .scheduler import UpstreamBusy
+
+# 꼬리 지연 대응
+# - LatencyTracker: 호출 이름별 최근 성공 지연 → 헤지 시점(p95 등) 학습
+# - HedgeBudget: 헤지(중복 요청)는 전체 요청의 ratio 이내로만 (업스트림 부하/비용 상한)
+# - CircuitBreaker: 최근 실패율이 높거나 연속 실패가 이어지면 open_s 동안 즉시 실패 → half-open 에서 1건 시험
+
+
+class CircuitOpen(UpstreamBusy):
+    """업스트림 장애로 차단기가 열려 있음 (retry_after_s 후 재시도)"""
+
+    def __init__(self, name: str, retry_after_s: float):
+        super().__init__(f"circuit open for {name} (retry in {retry_after_s:.0f}s)")
+        self.name = name
+        self.retry_after_s = retry_after_s
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            self._samples[name].append(seconds)
+
+    def percentile(self, name: str, q: float) -> Optional[float]:
+        with self._lock:
+            xs = list(self._samples.get(name) or ())
+        if len(xs) < self.min_samples:
+            return None
+        return float(np.percentile(xs, q))
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            items = {k: list(v) for k, v in self._samples.items()}
+        return {k: {"samples": len(v), "p50_ms": int(np.percentile(v, 50) * 1000),
+                    "p95_ms": int(np.percentile(v, 95) * 1000), "p99_ms": int(np.percentile(v, 99) * 1000)}
+                for k, v in items.items() if v}
+
+
+class HedgeBudget:
+    """요청 1건마다 ratio 만큼 크레딧 적립, 헤지 1건에 1 소모 (최대 max_credit 까지 적립)"""
+
+    def __init__(self, ratio: float = 0.1, max_credit: float = 5.0):
+        self.ratio = ratio
+        self.max_credit = max_credit
+        self.credit = 1.0
+        self._lock = threading.Lock()
+        self.requests = self.started = self.won = self.skipped = 0
+
+    def on_request(self):
+        with self._lock:
+            self.requests += 1
+            self.credit = min(self.max_credit, self.credit + self.ratio)
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.credit >= 1.0:
+                self.credit -= 1.0
+                self.started += 1
+                return True
+            self.skipped += 1
+            return False
+
+    def on_win(self):
+        with self._lock:
+            self.won += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"requests": self.requests, "hedged": self.started, "hedge_won": self.won,
+                    "skipped_budget": self.skipped, "credit": round(self.credit, 2), "ratio": self.ratio}
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, window: int = 20, min_calls: int = 10, failure_rate: float = 0.5,
+                 consecutive: int = 5, open_s: float = 30.0):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.consecutive = consecutive
+        self.open_s = open_s
+        self.state = self.CLOSED
+        self._lock = threading.Lock()
+        self._results = deque(maxlen=window)
+        self._streak = 0
+        self._opened_at = 0.0
+        self._probe = False
+        self.opened = self.rejected = 0
+
+    def retry_after_s(self) -> float:
+        return max(0.0, self._opened_at + self.open_s - time.monotonic())
+
+    def before(self):
+        """호출 전 확인. 열려 있으면 CircuitOpen.
+        통과했으면 반드시 record() 또는 release() 중 하나를 불러야 한다 (half-open 시험 호출 자리)"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if self.retry_after_s() > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, self.retry_after_s())
+                self.state = self.HALF_OPEN
+                self._probe = False
+            if self.state == self.HALF_OPEN:
+                if self._probe:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, 1.0)
+                self._probe = True
+
+    def release(self):
+        """before() 를 통과했지만 성공/실패 판정 없이 끝난 호출 (스케줄러 거절, 응답 처리 중 예외 등).
+        half-open 시험 호출 자리를 돌려줘서 다음 호출이 다시 시험할 수 있게 한다"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probe = False
+
+    def record(self, ok: bool):
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if ok:
+                    self.state = self.CLOSED
+                    self._results.clear()
+                    self._streak = 0
+                else:
+                    self._trip()
+                return
+            self._results.append(ok)
+            self._streak = 0 if ok else self._streak + 1
+            fails = self._results.count(False)
+            if self._streak >= self.consecutive or (
+                    len(self._results) >= self.min_calls and fails / len(self._results) >= self.failure_rate):
+                self._trip()
+
+    def _trip(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe = False
+        self.opened += 1
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == self.OPEN and self.retry_after_s() > 0
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"state": self.state, "opened": self.opened, "rejected": self.rejected,
+                    "recent_failures": self._results.count(False), "recent_calls": len(self._results),
+                    "retry_after_s": round(self.retry_after_s(), 1) if self.state == self.OPEN else 0}
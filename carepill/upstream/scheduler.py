@@ -0,0 +1,188 @@
+# carepill/upstream/scheduler.py
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# 프로세스 전역 업스트림 스케줄러
+# - 토큰 버킷 2개: 분당 요청 수(RPM), 분당 토큰 수(TPM)
+# - 우선순위: realtime(세션 발급) > scan > summary. 높은 클래스가 기다리는 동안 낮은 클래스는 출발하지 않고,
+#   낮은 클래스는 버킷의 일부(reserve)를 남겨 두어 음성 경로가 429 폭풍에 밀리지 않게 한다
+# - 같은 클래스 안에서는 클라이언트(사용자/세션)별 큐를 라운드로빈 → 한 사용자의 9샷 스캔이 다른 사용자를 막지 않음
+# - 대기는 호출의 deadline 까지. 넘으면 UpstreamBusy
+# - 429 를 받으면 pause(초) 동안 전체 출발을 멈춘다
+
+REALTIME, SCAN, SUMMARY = 0, 1, 2
+PRIORITY_NAMES = {REALTIME: "realtime", SCAN: "scan", SUMMARY: "summary"}
+# 클래스별로 남겨 둘 버킷 비율 (realtime 은 전부 사용 가능)
+RESERVE = {REALTIME: 0.0, SCAN: 0.1, SUMMARY: 0.25}
+
+_current_client = contextvars.ContextVar("upstream_client", default="anonymous")
+
+
+class UpstreamBusy(Exception):
+    """스케줄러 대기 중 deadline 초과"""
+
+
+@contextmanager
+def client_scope(client_id: str):
+    """이 블록에서 나가는 업스트림 호출의 공정 분배 단위(로그인 사용자/세션)"""
+    token = _current_client.set(client_id or "anonymous")
+    try:
+        yield
+    finally:
+        _current_client.reset(token)
+
+
+def current_client() -> str:
+    return _current_client.get()
+
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate = rate_per_s
+        self.capacity = capacity
+        self.level = capacity
+        self.t = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.t) * self.rate)
+        self.t = now
+
+    def wait_s(self, n: float, reserve: float = 0.0) -> float:
+        """n 을 꺼내고도 capacity*reserve 이상 남으려면 기다려야 하는 시간 (0이면 즉시 가능)"""
+        need = n + self.capacity * reserve - self.level
+        return 0.0 if need <= 0 else need / self.rate
+
+    def take(self, n: float):
+        self.level -= n   # 실제 사용량 정산으로 음수(빚)가 될 수 있다
+
+
+class _Ticket:
+    __slots__ = ("priority", "client", "tokens")
+
+    def __init__(self, priority, client, tokens):
+        self.priority = priority
+        self.client = client
+        self.tokens = tokens
+
+
+class Grant:
+    """acquire() 결과. 실제 토큰 사용량을 알게 되면 settle() 로 예상치와의 차이를 정산"""
+
+    def __init__(self, scheduler, tokens: float, waited_ms: int):
+        self._s = scheduler
+        self.tokens = tokens
+        self.waited_ms = waited_ms
+
+    def refund(self):
+        """호출하지 않고 끝남 (차단기 거절 등) → 예상 토큰을 돌려준다"""
+        if self.tokens:
+            self._s._adjust_tokens(-self.tokens)
+            self.tokens = 0
+
+    def settle(self, actual_tokens: float):
+        if actual_tokens and actual_tokens != self.tokens:
+            self._s._adjust_tokens(actual_tokens - self.tokens)
+            self.tokens = actual_tokens
+
+
+class Scheduler:
+    def __init__(self, rpm: float = 500, tpm: float = 200_000, burst_s: float = 10.0):
+        self.requests = TokenBucket(rpm / 60.0, max(1.0, rpm / 60.0 * burst_s))
+        self.tokens = TokenBucket(tpm / 60.0, max(1.0, tpm / 60.0 * burst_s))
+        self._cond = threading.Condition()
+        # priority -> OrderedDict(client -> deque[_Ticket]); OrderedDict 순서가 라운드로빈 순서
+        self._queues: Dict[int, "OrderedDict[str, deque]"] = {p: OrderedDict() for p in PRIORITY_NAMES}
+        self._paused_until = 0.0
+        self.granted = {p: 0 for p in PRIORITY_NAMES}
+        self.rejected = {p: 0 for p in PRIORITY_NAMES}
+        self.wait_ms = {p: 0 for p in PRIORITY_NAMES}
+
+    def _head(self) -> Optional[_Ticket]:
+        for p in sorted(self._queues):
+            q = self._queues[p]
+            if q:
+                return next(iter(q.values()))[0]
+        return None
+
+    def _pop(self, t: _Ticket):
+        q = self._queues[t.priority]
+        dq = q.pop(t.client)
+        dq.popleft()
+        if dq:
+            q[t.client] = dq   # 남은 요청은 클라이언트 순서 맨 뒤로 (라운드로빈)
+
+    def _remove(self, t: _Ticket):
+        q = self._queues[t.priority]
+        dq = q.get(t.client)
+        if dq is not None and t in dq:
+            dq.remove(t)
+            if not dq:
+                del q[t.client]
+
+    def acquire(self, priority: int = SCAN, tokens: float = 0, client: Optional[str] = None,
+                deadline_at: Optional[float] = None) -> Grant:
+        priority = priority if priority in self._queues else SCAN
+        client = client or current_client()
+        t = _Ticket(priority, client, float(tokens))
+        t0 = time.monotonic()
+        with self._cond:
+            self._queues[priority].setdefault(client, deque()).append(t)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = self._paused_until - now
+                    if self._head() is t and wait <= 0:
+                        r = RESERVE[priority]
+                        wait = max(self.requests.wait_s(1, r), self.tokens.wait_s(min(t.tokens, self.tokens.capacity), r))
+                        if wait <= 0:
+                            self._pop(t)
+                            self.requests.take(1)
+                            self.tokens.take(t.tokens)
+                            waited = int((now - t0) * 1000)
+                            self.granted[priority] += 1
+                            self.wait_ms[priority] += waited
+                            self._cond.notify_all()
+                            return Grant(self, t.tokens, waited)
+                    if deadline_at is not None and now >= deadline_at:
+                        raise UpstreamBusy(f"upstream queue timeout ({PRIORITY_NAMES[priority]})")
+                    timeout = 0.5 if wait <= 0 else min(wait, 0.5)
+                    if deadline_at is not None:
+                        timeout = min(timeout, max(0.001, deadline_at - now))
+                    self._cond.wait(timeout)
+            except BaseException:
+                self._remove(t)
+                self.rejected[priority] += 1
+                self._cond.notify_all()
+                raise
+
+    def _adjust_tokens(self, delta: float):
+        with self._cond:
+            self.tokens.take(delta)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """업스트림이 429 를 돌려줬을 때: 그 동안 새 요청 출발 중지"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + max(0.0, seconds))
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                "requests_available": round(self.requests.level, 1),
+                "tokens_available": int(self.tokens.level),
+                "paused_s": round(max(0.0, self._paused_until - now), 2),
+                "queued": {PRIORITY_NAMES[p]: sum(len(d) for d in q.values()) for p, q in self._queues.items()},
+                "granted": {PRIORITY_NAMES[p]: n for p, n in self.granted.items()},
+                "rejected": {PRIORITY_NAMES[p]: n for p, n in self.rejected.items()},
+                "avg_wait_ms": {PRIORITY_NAMES[p]: int(self.wait_ms[p] / self.granted[p]) if self.granted[p] else 0
+                                for p in PRIORITY_NAMES},
+            }
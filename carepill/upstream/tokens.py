@@ -0,0 +1,125 @@
+# carepill/upstream/tokens.py
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# realtime 임시 토큰(ephemeral client_secret) 사전 발급 풀
+# - 음성 페이지가 연결을 시작할 때 업스트림 왕복 없이 바로 토큰을 내준다
+# - 토큰마다 expires_at 을 추적하고, 남은 시간이 min_remaining_s 미만이면 버린다
+#   (임시 토큰은 갱신이 안 되므로 만료 전에 새로 발급해 교체)
+# - 목표 크기 = 최근 window_s 동안의 요청률 × 토큰 유효시간을 반올림 (max_size 상한)
+#   토큰 하나가 살아 있는 동안 요청이 평균 0.5건 미만이면 0 → 드문 요청 하나 때문에
+#   window_s 내내 아무도 안 쓰는 토큰을 계속 발급하지 않는다. 곧 올 요청은 expect() 로 알린다
+# - 풀이 비었으면 호출자가 직접 발급 (take() → None)
+
+
+class EphemeralPool:
+    def __init__(self, mint: Callable[[], Dict], max_size: int = 4, min_size: int = 0,
+                 min_remaining_s: float = 20.0, window_s: float = 600.0, expect_s: float = 120.0,
+                 default_ttl_s: float = 60.0):
+        """mint() → {value, expires_at(epoch 초), session}. 실패하면 예외"""
+        self.mint = mint
+        self.max_size = max_size
+        self.min_size = min_size
+        self.min_remaining_s = min_remaining_s
+        self.window_s = window_s
+        self.expect_s = expect_s
+        self.default_ttl_s = default_ttl_s
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._tokens = deque()          # expires_at 오름차순
+        self._demand = deque()          # 최근 take() 시각
+        self._expect_until = 0.0
+        self._ttl_s = default_ttl_s     # 최근 발급 토큰의 실제 유효시간
+        self._thread: Optional[threading.Thread] = None
+        self._backoff_s = 0.0
+        self.hits = self.misses = self.minted = self.expired = self.failures = 0
+
+    # ----- 풀 크기 -----
+    def _target(self, now: float) -> int:
+        while self._demand and now - self._demand[0] > self.window_s:
+            self._demand.popleft()
+        rate = len(self._demand) / self.window_s
+        usable = max(1.0, self._ttl_s - self.min_remaining_s)
+        target = int(rate * usable + 0.5)
+        if now < self._expect_until:
+            target = max(target, 1)
+        return max(self.min_size, min(self.max_size, target))
+
+    def _prune(self, now: float):
+        while self._tokens and self._tokens[0]["expires_at"] - now < self.min_remaining_s:
+            self._tokens.popleft()
+            self.expired += 1
+
+    # ----- 호출자 API -----
+    def take(self) -> Optional[Dict]:
+        """만료 여유가 있는 토큰 하나 (없으면 None → 직접 발급)"""
+        self._ensure_thread()
+        with self._lock:
+            now = time.time()
+            self._demand.append(now)
+            self._prune(now)
+            tok = self._tokens.popleft() if self._tokens else None
+            if tok is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._wake.notify()
+            return tok
+
+    def expect(self):
+        """곧 요청이 올 것(음성 페이지 진입 등) → expect_s 동안 최소 1개 유지"""
+        self._ensure_thread()
+        with self._lock:
+            self._expect_until = max(self._expect_until, time.time() + self.expect_s)
+            self._wake.notify()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            return {"size": len(self._tokens), "target": self._target(now), "hits": self.hits,
+                    "misses": self.misses, "minted": self.minted, "expired": self.expired,
+                    "failures": self.failures, "ttl_s": round(self._ttl_s, 1),
+                    "next_expiry_s": round(self._tokens[0]["expires_at"] - now, 1) if self._tokens else None}
+
+    # ----- 백그라운드 발급 -----
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="carepill-rt-pool", daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._prune(now)
+                need = self._target(now) - len(self._tokens)
+                if need <= 0:
+                    # 다음 토큰이 버려질 시각 또는 take()/expect() 까지 대기
+                    wait = self._tokens[0]["expires_at"] - self.min_remaining_s - now if self._tokens else 30.0
+                    self._wake.wait(max(0.5, min(30.0, wait)))
+                    continue
+            try:
+                tok = self.mint()
+            except Exception as e:
+                with self._lock:
+                    self.failures += 1
+                self._backoff_s = min(30.0, max(1.0, self._backoff_s * 2))
+                logger.warning("ephemeral pre-mint failed (retry in %.0fs): %s", self._backoff_s, e)
+                time.sleep(self._backoff_s)
+                continue
+            self._backoff_s = 0.0
+            now = time.time()
+            if not tok.get("expires_at"):
+                tok["expires_at"] = now + self.default_ttl_s
+            with self._lock:
+                self.minted += 1
+                self._ttl_s = max(1.0, tok["expires_at"] - now)
+                self._tokens.append(tok)
+                self._tokens = deque(sorted(self._tokens, key=lambda t: t["expires_at"]))
@@ -16,6 +16,17 @@ urlpatterns = [
     path("api/conversation/download/", views.api_conversation_download),
 
     path("api/scan/envelope/", views.api_scan_envelope, name="api_scan_envelope"),
+    path("api/scan/envelope/stream/", views.api_scan_envelope_stream, name="api_scan_envelope_stream"),
+    path("api/scan/jobs/", views.api_scan_jobs, name="api_scan_jobs"),
+    path("api/scan/jobs/<uuid:job_id>/", views.api_scan_job, name="api_scan_job"),
+    path("api/scan/sessions/", views.api_scan_sessions, name="api_scan_sessions"),
+    path("api/scan/sessions/<uuid:session_id>/", views.api_scan_session, name="api_scan_session"),
+    path("api/scan/sessions/<uuid:session_id>/shots/", views.api_scan_session_shot, name="api_scan_session_shot"),
+    path("api/scan/sessions/<uuid:session_id>/events/", views.api_scan_session_events, name="api_scan_session_events"),
+    path("api/scan/sessions/<uuid:session_id>/finalize/", views.api_scan_session_finalize, name="api_scan_session_finalize"),
+    path("api/scan/stats/", views.api_scan_stats, name="api_scan_stats"),
+    path("api/meds/check/", views.api_meds_check, name="api_meds_check"),
+    path("api/upstream/stats/", views.api_upstream_stats, name="api_upstream_stats"),
     
     ]
 
@@ -1,50 +1,159 @@
-import os, requests
-from django.http import JsonResponse
+# views.py
+import base64
+import contextvars
+import datetime
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+import httpx
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.csrf import csrf_exempt
+
+from .pagecache import PAGE_CACHE_TTL_S, cached_page, owner_version
+from .upstream.client import estimate_chat_tokens, get_client as get_upstream, openai_headers
+from .upstream.scheduler import REALTIME, SCAN, SUMMARY, UpstreamBusy, client_scope, current_client
+from .upstream.tokens import EphemeralPool
+from .envelope.cache import ExtractionCache, content_key, dhash
+from .envelope.jobs import ScanJobQueue
+from .envelope.parsing import ParseStats, parse_model_json
+from .envelope.session import ScanSessionStore, SessionError, SessionShot
+from .envelope.singleflight import KeyConflict, SingleFlight
+from .envelope.merge import cluster_merge
+from .envelope.executor import ShotCancelled, ShotOutcome, run_shots
+from .envelope.preprocess import normalize_envelope
+from .envelope.segment import group_crops, segment_frame
+from .envelope.quality import score_frame, select_top_k
+from .medicine.index import get_index as get_medicine_index
+from .medicine.interactions import check_medicines
+from .medicine.records import current_medicine_items, current_medications, save_scan
+from .medicine.store import features_for as medicine_features
 
+logger = logging.getLogger(__name__)
+
+def _client_id(request) -> str:
+    """업스트림 스케줄러의 공정 분배 단위이자 스캔/복용약 기록의 소유자: 로그인 사용자 > 세션.
+    세션이 없으면 여기서 만들어 쿠키로 내려 준다. 건강 정보의 소유자이므로 클라이언트가 보내는 헤더
+    (X-Forwarded-For 등)나 접속 IP 로는 절대 정하지 않는다"""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    session = getattr(request, "session", None)
+    if session is None:
+        # 세션 미들웨어가 없는 호출: 요청마다 새 식별자 (다른 사람 기록과 절대 섞이지 않게)
+        return f"anon:{uuid.uuid4()}"
+    if not session.session_key:
+        session.save()
+        session.modified = True   # 응답에 세션 쿠키를 싣게 한다
+    return f"session:{session.session_key}"
+
+@cached_page("home", _client_id)
 def home(request):  return render(request, "carepill/home.html")
+@cached_page("scan", _client_id, csrf=True)
 def scan(request):  return render(request, "carepill/scan.html")
-def meds(request):  return render(request, "carepill/meds.html")
-def voice(request): return render(request, "carepill/voice.html")
-
-def issue_ephemeral(request):
-    r = requests.post(
-        "https://api.openai.com/v1/realtime/sessions",
-        headers={
-            "Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}",
-            "Content-Type": "application/json",
-            "OpenAI-Beta": "realtime=v1",
-        },
-        json={
-            "model": "gpt-4o-mini-realtime-preview-2024-12-17",
-            "voice": "verse",
-            "modalities": ["audio", "text"],
-            "turn_detection": {
-                "type": "server_vad", 
-                "create_response": True, 
-                "silence_duration_ms": 500
+@cached_page("voice", _client_id)
+def _voice_page(request): return render(request, "carepill/voice.html")
+def voice(request):
+    # 캐시 히트/304 여도 곧 /api/realtime/session/ 이 올 것이므로 풀을 데워 둔다
+    if RT_POOL:
+        _rt_pool.expect()
+    return _voice_page(request)
+
+@cached_page("meds", _client_id)
+def meds(request):
+    """현재 복용약 목록 (스캔할 때마다 upsert 된 Medication, 페이지당 MEDS_PER_PAGE)
+    카드 목록은 owner 버전별 프래그먼트 캐시 → 캐시 히트면 DB 조회 없음 (page 는 지연 평가)"""
+    owner = _client_id(request)
+    page_no = request.GET.get("page") or 1
+    page = SimpleLazyObject(lambda: current_medications(owner, page_no))
+    return render(request, "carepill/meds.html", {
+        "page": page, "page_no": page_no,
+        "frag_key": f"{owner}:{owner_version(owner)}", "frag_ttl": PAGE_CACHE_TTL_S,
+    })
+
+# 음성 대화에서 모델이 호출하는 성분 중복/상호작용 검사 도구 (브라우저가 /api/meds/check/ 로 대신 실행)
+MEDS_CHECK_TOOL = {
+    "type": "function",
+    "name": "check_medications",
+    "description": "Check duplicate ingredients and interactions among the medicines the user mentions "
+                   "plus the medicines saved from their scanned envelopes. Use Korean product names.",
+    "parameters": {
+        "type": "object",
+        "properties": {"medicines": {"type": "array", "items": {"type": "string"}}},
+        "required": ["medicines"],
+    },
+}
+
+class EphemeralError(Exception):
+    def __init__(self, status: int, body: Dict):
+        super().__init__(body.get("error"))
+        self.status = status
+        self.body = body
+
+
+def _mint_ephemeral(client: str, priority: int = REALTIME) -> Dict:
+    """/realtime/sessions 호출 → {value, expires_at, session}. 실패하면 EphemeralError"""
+    try:
+        r = get_upstream().post(
+            "/realtime/sessions",
+            name="realtime_session",
+            priority=priority,
+            client=client,
+            headers=openai_headers(beta="realtime=v1"),
+            json={
+                "model": "gpt-4o-mini-realtime-preview-2024-12-17",
+                "voice": "verse",
+                "modalities": ["audio", "text"],
+                "turn_detection": {
+                    "type": "server_vad", 
+                    "create_response": True, 
+                    "silence_duration_ms": 500
+                },
+                "input_audio_transcription": {"model": "gpt-4o-mini-transcribe"},
+                "instructions": (
+                    "You are 'CarePill', a voice-based medication assistant designed to help visually impaired users. "
+                    "Speak Korean with clear, precise pronunciation, like a professional news announcer. "
+                    "Provide guidance about medication usage, dosage, timing, and potential drug interactions. "
+                    "Offer emotional support and speak warmly, as if you are a trusted friend who cares about the user’s well-being. "
+                    "Keep your responses short, calm, and friendly, delivering them with confidence and kindness. "
+                    "Whenever the user asks whether medicines can be taken together, call check_medications "
+                    "and answer from its result instead of guessing ingredients."
+                ),
+                "tools": [MEDS_CHECK_TOOL],
+                "tool_choice": "auto",
             },
-            "input_audio_transcription": {"model": "gpt-4o-mini-transcribe"},
-            "instructions": (
-                "You are 'CarePill', a voice-based medication assistant designed to help visually impaired users. "
-                "Speak Korean with clear, precise pronunciation, like a professional news announcer. "
-                "Provide guidance about medication usage, dosage, timing, and potential drug interactions. "
-                "Offer emotional support and speak warmly, as if you are a trusted friend who cares about the user’s well-being. "
-                "Keep your responses short, calm, and friendly, delivering them with confidence and kindness."
-            ),
-        },
-        timeout=20,
-    )
+            timeout=20,
+        )
+    except UpstreamBusy as e:
+        raise EphemeralError(503, {"error": "upstream_busy", "detail": str(e)})
+    except httpx.HTTPError as e:
+        raise EphemeralError(502, {"error": "upstream_network_error", "detail": str(e)})
 
     try:
         data = r.json()
     except Exception:
         # OpenAI에서 예외적으로 비JSON이 오면 원문 전달
-        return JsonResponse({"error": "upstream_non_json", "text": r.text}, status=r.status_code)
+        raise EphemeralError(r.status_code, {"error": "upstream_non_json", "text": r.text})
 
     if r.status_code != 200:
         # 에러 원문 그대로 반환
-        return JsonResponse(data, status=r.status_code)
+        raise EphemeralError(r.status_code, data)
 
     # ✅ 스키마 정규화: 항상 {value, expires_at, session} 형태로 반환
     value = data.get("value") or (data.get("client_secret") or {}).get("value")
@@ -52,14 +161,36 @@ def issue_ephemeral(request):
     session = data.get("session") or {"id": data.get("id"), "type": "realtime", "object": "realtime.session"}
 
     if not value:
-        return JsonResponse({"error": "no_ephemeral_value", "upstream": data}, status=502)
+        raise EphemeralError(502, {"error": "no_ephemeral_value", "upstream": data})
 
-    return JsonResponse({"value": value, "expires_at": expires_at, "session": session}, status=200)
+    return {"value": value, "expires_at": expires_at, "session": session}
 
 
-import os, requests
-from django.http import JsonResponse, HttpResponse
-from django.views.decorators.csrf import csrf_exempt
+# 임시 토큰 사전 발급 풀: 최근 요청률만큼 미리 발급해 두고 만료 전에 교체 (백그라운드 발급은 SCAN 우선순위)
+_rt_pool = EphemeralPool(
+    lambda: _mint_ephemeral("rt-pool", priority=SCAN),
+    max_size=int(os.getenv("RT_POOL_MAX", "4")),
+    min_size=int(os.getenv("RT_POOL_MIN", "0")),
+    min_remaining_s=float(os.getenv("RT_POOL_MIN_REMAINING_S", "20")),
+)
+RT_POOL = os.getenv("RT_POOL", "1") == "1"
+
+
+def issue_ephemeral(request):
+    """GET /api/realtime/session/ → {value, expires_at, session}
+    풀에 토큰이 있으면 업스트림 왕복 없이 바로 주고(X-Ephemeral-Pool: hit), 없으면 그 자리에서 발급(miss)"""
+    tok = _rt_pool.take() if RT_POOL else None
+    pooled = tok is not None
+    if not pooled:
+        try:
+            tok = _mint_ephemeral(_client_id(request))
+        except EphemeralError as e:
+            return JsonResponse(e.body, status=e.status)
+    resp = JsonResponse({k: tok[k] for k in ("value", "expires_at", "session")}, status=200)
+    resp["X-Ephemeral-Pool"] = "hit" if pooled else "miss"
+    resp["Cache-Control"] = "no-store"
+    return resp
+
 
 @csrf_exempt
 def realtime_sdp_exchange(request):
@@ -82,63 +213,30 @@ def realtime_sdp_exchange(request):
         return JsonResponse({"error": "empty_offer_sdp"}, status=400)
 
     try:
-        upstream = requests.post(
-            "https://api.openai.com/v1/realtime?model=gpt-4o-mini-realtime-preview-2024-12-17",
+        upstream = get_upstream().post(
+            "/realtime?model=gpt-4o-mini-realtime-preview-2024-12-17",
+            name="realtime_sdp",
+            priority=REALTIME,
+            client=_client_id(request),
             headers={
                 "Authorization": auth,                   # Bearer ek_... (ephemeral)
                 "Content-Type": "application/sdp",
                 "OpenAI-Beta": "realtime=v1",
             },
-            data=offer_sdp,
+            content=offer_sdp,
             timeout=20,
         )
-    except requests.RequestException as e:
+    except UpstreamBusy as e:
+        return JsonResponse({"error": "upstream_busy", "detail": str(e)}, status=503)
+    except httpx.HTTPError as e:
         return JsonResponse({"error": "upstream_network_error", "detail": str(e)}, status=502)
 
     # OpenAI는 answer SDP를 text로 반환
     return HttpResponse(upstream.text, status=upstream.status_code, content_type="application/sdp")
 
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-# views.py
-import os
-import re
-import json
-import time
-import uuid
-import traceback
-import datetime
-import logging
-import requests
-
-from django.conf import settings
-from django.http import JsonResponse, HttpResponse, Http404
-from django.views.decorators.csrf import csrf_exempt
-
-logger = logging.getLogger(__name__)
-
 # ===== OpenAI 설정 =====
 SUMMARIZER_MODEL = os.getenv("SUMMARIZER_MODEL", "gpt-4o-mini")
-OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
 
 
 # ===== 파일명/저장 유틸 =====
@@ -326,17 +424,23 @@ def api_conversation_summarize_and_save(request):
 
     t1 = time.time()
     try:
-        resp = requests.post(
-            OPENAI_API_URL,
-            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-            json={
-                "model": SUMMARIZER_MODEL,
-                "messages": [
-                    {"role": "system", "content": "너는 한국어 대화 요약 도우미다. 결과는 텍스트(3줄)로만 답한다."},
-                    {"role": "user", "content": prompt},
-                ],
-                "temperature": 0.2,
-            },
+        body = {
+            "model": SUMMARIZER_MODEL,
+            "messages": [
+                {"role": "system", "content": "너는 한국어 대화 요약 도우미다. 결과는 텍스트(3줄)로만 답한다."},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": 0.2,
+        }
+        resp = get_upstream().post(
+            "/chat/completions",
+            name="summarize",
+            priority=SUMMARY,
+            client=_client_id(request),
+            est_tokens=estimate_chat_tokens(body),
+            hedge=True,
+            headers=openai_headers(api_key),
+            json=body,
             timeout=60,
         )
         debug["openai_status"] = resp.status_code
@@ -388,25 +492,6 @@ def api_conversation_summarize_and_save(request):
     return JsonResponse(resp_out, status=200)
 
 
-
-
-
-
-
-
-
-
-
-
-
-import os, re, json, time, uuid, traceback, datetime, logging, requests
-from django.conf import settings
-from django.http import JsonResponse, HttpResponse, Http404
-from django.shortcuts import render
-from django.views.decorators.csrf import csrf_exempt
-
-logger = logging.getLogger(__name__)
-
 # (상단: home/scan/meds/voice, realtime, summarize 부분은 이전 버전과 동일)
 
 # -----------------------------
@@ -441,35 +526,121 @@ def _strip_code_fence(text: str) -> str:
     return t
 
 
-from collections import Counter
-from typing import List, Dict, Tuple
-import os
-import requests
+# 샷 병렬 분석 설정: 동시 호출 수 / 요청 전체 마감시간(초)
+SCAN_MAX_WORKERS = int(os.getenv("SCAN_MAX_WORKERS", "4"))
+SCAN_DEADLINE_S  = float(os.getenv("SCAN_DEADLINE_S", "75"))
+
+# 약봉투 추출 모델/프롬프트 버전 (프롬프트를 바꾸면 버전을 올려 캐시를 무효화)
+ENVELOPE_MODEL = os.getenv("ENVELOPE_MODEL", "gpt-4o-mini")
+ENVELOPE_PROMPT_VERSION = "v3"
+
+# structured output(json_schema) 요청 여부. 모델이 스키마를 벗어난 JSON을 내지 못하게 한다
+SCAN_STRUCTURED_OUTPUT = os.getenv("SCAN_STRUCTURED_OUTPUT", "1") == "1"
+
+# 샷 파싱 결과(ok/repaired/failed) 누적 → 버려지는 업스트림 호출 비율 측정
+_parse_stats = ParseStats()
+
+# 추출 결과 캐시 (사용자별): 같은 이미지를 다시 보내면 재사용하고, 한 스캔(요청/세션) 안의 연사 프레임끼리는
+# dHash 거리 SCAN_CACHE_NEAR_DISTANCE 이하면 앞 샷의 결과를 재사용한다
+SCAN_CACHE = os.getenv("SCAN_CACHE", "1") == "1"
+_envelope_cache = ExtractionCache(
+    max_entries=int(os.getenv("SCAN_CACHE_MAX", "256")),
+    ttl_s=float(os.getenv("SCAN_CACHE_TTL_S", "1800")),
+    near_distance=int(os.getenv("SCAN_CACHE_NEAR_DISTANCE", "12")),
+    burst_s=float(os.getenv("SCAN_CACHE_BURST_S", str(SCAN_DEADLINE_S))),
+)
+# 지금 실행 중인 스캔(요청/세션) id: 근사 일치 재사용 범위. 샷 스레드까지 contextvars 로 전달된다
+_scan_burst = contextvars.ContextVar("scan_burst", default=None)
+
+
+@contextmanager
+def _burst_scope(burst: str):
+    token = _scan_burst.set(burst)
+    try:
+        yield
+    finally:
+        _scan_burst.reset(token)
+
+# 업스트림 전 이미지 정규화 (원근/기울기 보정 + 타일 해상도로 축소 + JPEG 재인코딩)
+SCAN_PREPROCESS = os.getenv("SCAN_PREPROCESS", "1") == "1"
+SCAN_JPEG_QUALITY = int(os.getenv("SCAN_JPEG_QUALITY", "85"))
+
+# 한 프레임에 약봉투 여러 개: 봉투별로 잘라 각각 추출/병합 (fanout 모드에서만, 기본 꺼짐 — 요청 옵션 segment 로 켬)
+# 사각형들이 서로 포개지지 않고 합쳐서 프레임의 SCAN_SEGMENT_MIN_COVERAGE 이상을 덮을 때만 여러 봉투로 본다
+SCAN_SEGMENT = os.getenv("SCAN_SEGMENT", "0") == "1"
+SCAN_SEGMENT_MIN_COVERAGE = float(os.getenv("SCAN_SEGMENT_MIN_COVERAGE", "0.5"))
+SCAN_MAX_ENVELOPES = int(os.getenv("SCAN_MAX_ENVELOPES", "6"))
+
+# 분석 모드: fanout(샷별 개별 요청, 기본) | multi(한 요청에 모든 샷 이미지)
+SCAN_MODES = ("fanout", "multi")
+SCAN_MODE = os.getenv("SCAN_MODE", "fanout")
+
+# 스캔 결과를 Scan/ScanShot 에 저장하고 현재 복용약(Medication)을 갱신 (/meds/ 페이지)
+SCAN_PERSIST = os.getenv("SCAN_PERSIST", "1") == "1"
+
+# 중복 제출 합치기: 같은 이미지 묶음(또는 같은 Idempotency-Key)은 진행 중인 분석에 합류하고,
+# 끝난 결과는 SCAN_REPLAY_TTL_S 동안 다시 계산하지 않고 돌려준다
+_scan_flight = SingleFlight(replay_ttl_s=float(os.getenv("SCAN_REPLAY_TTL_S", "120")))
+
+# 연사 프레임 품질(선명도/반사광/노출) 상위 K장만 카메라별로 분석 (0이면 전부 분석)
+SCAN_TOP_K = int(os.getenv("SCAN_TOP_K", "2"))
+
+ENVELOPE_SYSTEM_PROMPT = "너는 한국 약봉투 OCR/정보추출 전문가다. 반드시 유효한 JSON만 출력한다. 사진에 없는 정보는 공란('')으로 남긴다."
+
+ENVELOPE_SCHEMA = (
+    "{\n"
+    '  "patient_name": "환자명(문자열)",\n'
+    '  "age": "나이(숫자 또는 빈 문자열)",\n'
+    '  "dispense_date": "조제일자(YYYY-MM-DD 또는 YYYY.MM.DD)",\n'
+    '  "pharmacy_name": "약국명",\n'
+    '  "prescription_number": "처방전 또는 조제 번호",\n'
+    '  "medicine_name": "약품명",\n'
+    '  "dosage_instructions": "복용법(예: 아침, 저녁, 취침 전)",\n'
+    '  "frequency": "복용횟수/기간(예: 1일 1회 총 30일분)"\n'
+    "}\n"
+)
+
+ENVELOPE_FIELDS = ["patient_name", "age", "dispense_date", "pharmacy_name", "prescription_number",
+                   "medicine_name", "dosage_instructions", "frequency"]
 
-def _call_openai_envelope(image_b64: str, model: str = "gpt-4o-mini") -> str:
+ENVELOPE_JSON_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {k: {"type": "string"} for k in ENVELOPE_FIELDS},
+    "required": ENVELOPE_FIELDS,
+}
+
+
+def _response_format(name: str, schema: Dict) -> Dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "strict": True, "schema": schema}}
+
+
+ENVELOPE_RULES = "주의: 오타를 피하고, 사진 속 정보만 사용하세요. 모를 경우 빈 문자열로 두세요. 설명 문장이나 코드펜스 없이 JSON만 출력합니다."
+
+
+def _post_openai_chat(payload: Dict, timeout: float = 60, usage: Dict = None, priority: int = SCAN) -> str:
+    """chat/completions 호출 → 응답 content. usage dict를 주면 토큰 사용량을 채운다."""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY가 설정되지 않았습니다.")
 
+    # 공용 keep-alive 클라이언트 (429/5xx 재시도 포함, timeout 은 재시도까지 합친 예산)
+    r = get_upstream().post("/chat/completions", name="chat", headers=openai_headers(api_key), json=payload,
+                            timeout=timeout, priority=priority, est_tokens=estimate_chat_tokens(payload),
+                            hedge=True)
+    if r.status_code != 200:
+        raise RuntimeError(f"OpenAI 오류 {r.status_code}: {r.text[:200]}")
+    data = r.json()
+    if usage is not None:
+        usage.update(data.get("usage") or {})
+    return data["choices"][0]["message"]["content"]
+
+
+def _call_openai_envelope(image_b64: str, model: str = ENVELOPE_MODEL, timeout: float = 60, usage: Dict = None) -> str:
     text_prompt = (
         "다음 약봉투 이미지를 분석하여 아래 스키마의 정확한 JSON만 출력하세요.\n"
         "가능하면 숫자/날짜는 포맷을 맞추세요.\n"
-        "{\n"
-        '  "patient_name": "환자명(문자열)",\n'
-        '  "age": "나이(숫자 또는 빈 문자열)",\n'
-        '  "dispense_date": "조제일자(YYYY-MM-DD 또는 YYYY.MM.DD)",\n'
-        '  "pharmacy_name": "약국명",\n'
-        '  "prescription_number": "처방전 또는 조제 번호",\n'
-        '  "medicine_name": "약품명",\n'
-        '  "dosage_instructions": "복용법(예: 아침, 저녁, 취침 전)",\n'
-        '  "frequency": "복용횟수/기간(예: 1일 1회 총 30일분)",\n'
-        '  "med_features": {\n'
-        '    "description": "약의 한줄 설명",\n'
-        '    "indications": "어디에 좋은지(적응증)",\n'
-        '    "cautions": "주의사항(상호작용/부작용/주의대상 간단 요약)"\n'
-        "  }\n"
-        "}\n"
-        "주의: 오타를 피하고, 사진 속 정보만 사용하세요. 모를 경우 빈 문자열로 두세요. 설명 문장이나 코드펜스 없이 JSON만 출력합니다."
+        + ENVELOPE_SCHEMA + ENVELOPE_RULES
     )
 
     payload = {
@@ -477,7 +648,7 @@ def _call_openai_envelope(image_b64: str, model: str = "gpt-4o-mini") -> str:
         "messages": [
             {
                 "role": "system",
-                "content": "너는 한국 약봉투 OCR/정보추출 전문가다. 반드시 유효한 JSON만 출력한다. 사진에 없는 정보는 공란('')으로 남긴다."
+                "content": ENVELOPE_SYSTEM_PROMPT
             },
             {
                 "role": "user",
@@ -488,71 +659,731 @@ def _call_openai_envelope(image_b64: str, model: str = "gpt-4o-mini") -> str:
                 ]
             }
         ],
-        "max_tokens": 1000,
+        # 봉투에 인쇄된 8개 필드만 읽으므로 짧다 (med_features 는 로컬 저장소에서 채움)
+        "max_tokens": 300,
         "temperature": 0.1
     }
-
-    r = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
-        json=payload,
-        timeout=60
-        )
-    if r.status_code != 200:
-        raise RuntimeError(f"OpenAI 오류 {r.status_code}: {r.text[:200]}")
-    data = r.json()
-    return data["choices"][0]["message"]["content"]
-
-
+    if SCAN_STRUCTURED_OUTPUT:
+        payload["response_format"] = _response_format("envelope", ENVELOPE_JSON_SCHEMA)
+    return _post_openai_chat(payload, timeout=timeout, usage=usage)
 
 
+def _call_openai_envelope_multi(images_b64: List[str], model: str = ENVELOPE_MODEL, timeout: float = 90, usage: Dict = None) -> str:
+    """같은 약봉투의 여러 샷을 한 번의 요청(image_url 여러 개)으로 분석.
+    출력: {"shots": [샷별 JSON, ...], "reconciled": 종합 JSON}"""
+    n = len(images_b64)
+    text_prompt = (
+        f"다음 {n}장의 이미지는 같은 약봉투를 여러 번 촬영한 것입니다.\n"
+        "각 이미지를 따로 읽어 아래 스키마의 JSON을 이미지 순서대로 shots 배열에 넣고,\n"
+        "모든 이미지를 종합해 가장 정확하다고 판단되는 값을 reconciled 에 넣으세요.\n"
+        "가능하면 숫자/날짜는 포맷을 맞추세요.\n"
+        f'출력 형식: {{"shots": [스키마 x {n}], "reconciled": 스키마}}\n'
+        "스키마:\n" + ENVELOPE_SCHEMA + ENVELOPE_RULES
+    )
+    content = [{"type": "text", "text": text_prompt}]
+    for b64 in images_b64:
+        content.append({"type": "image_url",
+                        "image_url": {"url": f"data:image/jpeg;base64,{b64}", "detail": "high"}})
 
-def _majority_merge(values: List[str]) -> Tuple[str, float]:
-    cleaned = [ (v or "").strip() for v in values if isinstance(v, str) ]
-    non_empty = [v for v in cleaned if v]
-    if not non_empty: return "", 0.0
-    cnt = Counter(non_empty)
-    top = cnt.most_common(); top_freq = top[0][1]
-    candidates = [v for v,c in top if c==top_freq]
-    winner = max(candidates, key=lambda s: len(s))
-    conf = cnt[winner] / max(1,len(values))
-    return winner, round(conf,3)
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": ENVELOPE_SYSTEM_PROMPT},
+            {"role": "user", "content": content},
+        ],
+        # 샷별 JSON + 종합 JSON
+        "max_tokens": 250 * (n + 1),
+        "temperature": 0.1
+    }
+    if SCAN_STRUCTURED_OUTPUT:
+        payload["response_format"] = _response_format("envelope_multi", {
+            "type": "object",
+            "additionalProperties": False,
+            "properties": {"shots": {"type": "array", "items": ENVELOPE_JSON_SCHEMA}, "reconciled": ENVELOPE_JSON_SCHEMA},
+            "required": ["shots", "reconciled"],
+        })
+    return _post_openai_chat(payload, timeout=timeout, usage=usage)
 
-def _digits_only(s: str) -> str: return "".join(ch for ch in (s or "") if ch.isdigit())
 
 def _merge_envelope_json(json_list: List[Dict]) -> Tuple[Dict, Dict]:
-    fields = ["patient_name","age","dispense_date","pharmacy_name","prescription_number","medicine_name","dosage_instructions","frequency"]
+    """샷별 JSON → (merged, diag). 필드마다 정규화 후 편집거리로 군집해서 가장 큰 군집을 채택"""
     merged, diag = {}, {}
-    results=[]
-    for d in json_list:
-        res = dict(d or {})
-        mf = res.get("med_features", {}) or {}
-        res["_mf_description"] = str(mf.get("description", "") or "").strip()
-        res["_mf_indications"] = str(mf.get("indications", "") or "").strip()
-        res["_mf_cautions"]    = str(mf.get("cautions", "")    or "").strip()
-        results.append(res)
-    for k in fields:
+    results = [d or {} for d in json_list]
+    for k in ENVELOPE_FIELDS:
         vals = [str(r.get(k, "") or "").strip() for r in results]
-        if k == "age":
-            norm=[_digits_only(v) for v in vals]; best,conf=_majority_merge(norm)
-            merged[k]=best; diag[k]={"per_shot":vals,"normalized":norm,"selected":best,"confidence":conf}
-        elif k == "prescription_number":
-            only=[_digits_only(v) for v in vals]; best_d,conf_d=_majority_merge(only)
-            if best_d: merged[k]=best_d; diag[k]={"per_shot":vals,"digits_only":only,"selected":best_d,"confidence":conf_d}
-            else: best,conf=_majority_merge(vals); merged[k]=best; diag[k]={"per_shot":vals,"selected":best,"confidence":conf}
-        else:
-            best,conf=_majority_merge(vals); merged[k]=best; diag[k]={"per_shot":vals,"selected":best,"confidence":conf}
-    for subk in ["description","indications","cautions"]:
-        key=f"_mf_{subk}"; vals=[r.get(key,"") for r in results]; best,conf=_majority_merge(vals); diag[key] = {"per_shot":vals,"selected":best,"confidence":conf}
-    merged["med_features"] = {"description":diag["_mf_description"]["selected"],"indications":diag["_mf_indications"]["selected"],"cautions":diag["_mf_cautions"]["selected"]}
-    del diag["_mf_description"]; del diag["_mf_indications"]; del diag["_mf_cautions"]
+        best, conf, info = cluster_merge(vals, k)
+        merged[k] = best
+        diag[k] = {"per_shot": vals, "normalized": info["normalized"], "clusters": info["clusters"],
+                   "selected": best, "confidence": conf}
     return merged, diag
 
+# ===== 약품명 → 표준 제품 (로컬 자모 n-gram 인덱스) =====
+MEDICINE_MATCH_MIN_SCORE = float(os.getenv("MEDICINE_MATCH_MIN_SCORE", "0.5"))
+
+def _resolve_medicine(name: str) -> Tuple[Dict, Dict]:
+    """병합된 medicine_name → (표준 제품 dict 또는 None, 진단)"""
+    t = time.perf_counter()
+    hits = get_medicine_index().search(name, limit=3) if name else []
+    cands = [{"name": h["name"], "ingredient": h.get("ingredient", ""), "item_seq": h.get("item_seq", ""),
+              "score": h["score"]} for h in hits]
+    best = cands[0] if cands and cands[0]["score"] >= MEDICINE_MATCH_MIN_SCORE else None
+    return best, {"query": name, "candidates": cands, "elapsed_us": int((time.perf_counter() - t) * 1e6)}
+
+# ===== med_features: 표준 제품 기준 로컬 지식 저장소 (표준 제품인데 없으면 텍스트 모델로 한 번 생성해 TTL 캐시) =====
+MED_FEATURES_LLM = os.getenv("MED_FEATURES_LLM", "1") == "1"
+MED_FEATURES_MODEL = os.getenv("MED_FEATURES_MODEL", "gpt-4o-mini")
+MED_FEATURES_SCHEMA = {
+    "type": "object",
+    "additionalProperties": False,
+    "properties": {k: {"type": "string"} for k in ("description", "indications", "cautions")},
+    "required": ["description", "indications", "cautions"],
+}
+
+def _fetch_med_features(name: str, ingredient: str = "") -> Dict:
+    prompt = (
+        f"약품명: {name}\n" + (f"성분: {ingredient}\n" if ingredient else "") +
+        "이 약에 대해 아래 JSON만 한국어로 간단히 작성하세요.\n"
+        '{"description": "약의 한줄 설명", "indications": "어디에 좋은지(적응증)", '
+        '"cautions": "주의사항(상호작용/부작용/주의대상 간단 요약)"}'
+    )
+    payload = {
+        "model": MED_FEATURES_MODEL,
+        "messages": [{"role": "system", "content": "너는 약사다. 확실하지 않은 내용은 쓰지 않는다. JSON만 출력한다."},
+                     {"role": "user", "content": prompt}],
+        "max_tokens": 400,
+        "temperature": 0.1,
+        "response_format": _response_format("med_features", MED_FEATURES_SCHEMA),
+    }
+    data, _ = parse_model_json(_post_openai_chat(payload, timeout=20))
+    return {k: str(data.get(k, "") or "").strip() for k in MED_FEATURES_SCHEMA["properties"]}
+
+def _med_features_for(merged: Dict) -> Tuple[Dict, Dict]:
+    """merged.medicine(표준 제품) 또는 medicine_name → (med_features, 진단)"""
+    t = time.perf_counter()
+    product = merged.get("medicine") or {}
+    name = product.get("name") or merged.get("medicine_name", "")
+    # 표준 제품으로 확인된 약만 생성 호출 (OCR 원문 이름으로 만든 설명은 저장하지 않음)
+    feats, source = medicine_features(name, product.get("ingredient", ""), product.get("item_seq", ""),
+                                      fetch=_fetch_med_features if MED_FEATURES_LLM else None, resolved=bool(product))
+    return feats, {"key": name, "source": source, "elapsed_ms": int((time.perf_counter() - t) * 1000)}
+
+# ===== 쿼럼 모드: 샷을 웨이브 단위로 보내고 필수 필드가 합의되면 조기 종료 =====
+QUORUM_FIELDS = ["patient_name", "dispense_date", "prescription_number", "medicine_name"]
+QUORUM_CONFIDENCE = float(os.getenv("SCAN_QUORUM_CONFIDENCE", "0.66"))
+QUORUM_MIN_SHOTS = 2
+
+def _quorum_options(payload, meta_in) -> Dict:
+    """payload.quorum: true | {confidence?, fields?, wave_size?, min_shots?} → 옵션 dict (비활성 시 None)"""
+    q = payload.get("quorum", os.getenv("SCAN_QUORUM") == "1")
+    if not q:
+        return None
+    q = q if isinstance(q, dict) else {}
+    cams = {m.get("camera_index") for m in meta_in if isinstance(m, dict)} - {None}
+    min_shots = max(1, int(q.get("min_shots") or QUORUM_MIN_SHOTS))
+    fields = [f for f in (q.get("fields") or QUORUM_FIELDS) if isinstance(f, str)]
+    return {
+        "confidence": float(q.get("confidence") or QUORUM_CONFIDENCE),
+        "fields": fields or QUORUM_FIELDS,
+        "min_shots": min_shots,
+        # 기본 웨이브 = 카메라당 1장 (브라우저는 shot-major 순서로 보냄)
+        "wave_size": max(min_shots, int(q.get("wave_size") or len(cams) or min_shots)),
+    }
+
+def _quorum_reached(diag: Dict, n_analyzed: int, opts: Dict) -> bool:
+    if n_analyzed < opts["min_shots"]:
+        return False
+    return all((diag.get(k) or {}).get("confidence", 0.0) >= opts["confidence"] for k in opts["fields"])
+
+
+def _b64_to_bytes(b64: str):
+    b64 = re.sub(r'^data:image\/(png|jpeg);base64,', '', b64 or '', flags=re.I)
+    try:
+        return base64.b64decode(b64)
+    except Exception:
+        return None
+
+
+def _read_shot(src):
+    """샷 소스(base64 문자열 / 바이트 / 업로드 파일 객체 / 세션 샷) → 이미지 바이트.
+    파일 소스는 필요할 때만 읽으므로 동시에 메모리에 올라가는 이미지는 작업 중인 샷뿐이다."""
+    if src is None or isinstance(src, bytes):
+        return src
+    if isinstance(src, SessionShot):
+        return src.image
+    if isinstance(src, str):
+        return _b64_to_bytes(src)
+    src.seek(0)
+    return src.read()
+
+
+def _scan_fingerprint(images: List, payload: Dict, meta_in: List = ()) -> str:
+    """이미지 바이트 + 결과에 영향을 주는 옵션/카메라 번호(top-K·쿼럼 묶음)의 sha256
+    (base64/multipart/raw 어느 쪽으로 보내도 같은 값)"""
+    h = hashlib.sha256()
+    opts = {k: payload.get(k) for k in ("mode", "top_k", "quorum", "segment")}
+    opts["cams"] = [m.get("camera_index") if isinstance(m, dict) else None for m in meta_in]
+    h.update(json.dumps(opts, sort_keys=True, default=str).encode("utf-8"))
+    for src in images:
+        img = _read_shot(src) or b""
+        h.update(len(img).to_bytes(8, "big"))
+        h.update(img)
+    return h.hexdigest()
+
+
+def _prepare_image(img: bytes) -> Tuple[bytes, Dict]:
+    """원본 이미지 바이트 → (업스트림으로 보낼 이미지 바이트, 정규화 통계)"""
+    if not SCAN_PREPROCESS:
+        return img, None
+    try:
+        return normalize_envelope(img, quality=SCAN_JPEG_QUALITY)
+    except Exception as e:
+        return img, {"error": str(e)}
+
+
+def _analyze_shot(src, ctx, prepared: bool = False) -> Dict:
+    """샷 하나: 정규화 → 캐시 조회 → 업스트림 호출 → 파싱.
+    prepared=True 면 이미 보정/축소된 이미지(봉투 crop)라 정규화를 건너뛴다.
+    세션 샷(SessionShot)은 업로드 때 이미 시작한 분석이 있으면 그 결과를 기다려 쓴다.
+    반환: {raw, json, parse, cache, preprocess, usage}"""
+    if isinstance(src, SessionShot) and src.future is not None:
+        try:
+            o = src.future.result(timeout=ctx.timeout(60))
+        except FutureTimeout:
+            ctx.check()
+            raise ShotCancelled("deadline_exceeded")
+        except CancelledError:
+            o = None
+        if o is not None and o.ok:
+            return o.value
+        if o is not None and not isinstance(o.error, ShotCancelled):
+            raise o.error
+        ctx.check()   # 미리 시작한 분석이 취소됐으면 지금 다시 분석
+    raw_img = _read_shot(src)
+    if not raw_img:
+        raise ValueError("bad_image")
+    img, prep = (raw_img, None) if prepared else _prepare_image(raw_img)
+    ctx.check()
+    # 사용자(client_scope)별 namespace: 다른 사용자의 추출 결과는 절대 재사용하지 않는다
+    cache_ns = f"{current_client()}|{ENVELOPE_PROMPT_VERSION}:{ENVELOPE_MODEL}"
+    h = content_key(img) if SCAN_CACHE else None
+    # 근사 일치는 같은 스캔의 연사 프레임끼리만. 봉투 crop(prepared)은 한 프레임의 다른 봉투일 수 있으므로 제외
+    burst = None if prepared else _scan_burst.get()
+    dh = dhash(img) if h is not None and burst is not None else None
+    waited = False
+    while h is not None:
+        state, val = _envelope_cache.claim(cache_ns, h, burst, dh)
+        if state == "wait":
+            # 같은(거의 같은) 이미지가 이미 분석 중 → 끝나면 그 결과를 재사용
+            waited = True
+            val.wait(ctx.timeout(60))
+            ctx.check()
+            continue
+        if state != "miss":
+            return {"raw": val[0], "json": val[1], "parse": None, "cache": "coalesced" if waited else state,
+                    "preprocess": prep, "usage": None}
+        break
+
+    usage = {}
+    try:
+        raw = _call_openai_envelope(base64.b64encode(img).decode("ascii"), timeout=ctx.timeout(60), usage=usage)
+        ctx.check()
+    except Exception:
+        if h is not None: _envelope_cache.release(cache_ns, h)
+        raise
+    cleaned = _strip_code_fence(raw)
+    # 잘린 출력/끝 쉼표/앞뒤 설명 문장은 복구해서 살린다. 잘린 출력은 끊긴 필드를 버리고
+    # truncated 로 표시한다 (병합에서는 빈 값 = 신뢰도 하락, 실패율은 /api/scan/stats/ 로 노출)
+    info = {}
+    parsed, status = parse_model_json(cleaned, info)
+    _parse_stats.record(status)
+    if h is not None:
+        if parsed and not info.get("truncated"): _envelope_cache.put(cache_ns, h, (cleaned, parsed))
+        else: _envelope_cache.release(cache_ns, h)
+    return {"raw": cleaned, "json": parsed, "parse": status, "cache": "miss" if h is not None else None,
+            "preprocess": prep, "usage": usage, "truncated": info.get("truncated") or None}
+
+
+def _analyze_multi(items: List[Tuple[int, object]], deadline_at: float) -> Tuple[Dict, Dict, Dict]:
+    """multi 모드: 선택된 샷 전부를 한 요청으로 분석.
+    반환: ({index: ShotOutcome}, reconciled, usage) — 호출하지 않았으면 usage 는 None"""
+    def _prepare(it, ctx):
+        img = _read_shot(it[1])
+        if not img:
+            raise ValueError("bad_image")
+        return _prepare_image(img)
+
+    prepared = run_shots(_prepare, items, max_workers=SCAN_MAX_WORKERS,
+                         deadline_s=max(0.0, deadline_at - time.monotonic()))
+    ready = [(it[0], p.value) for it, p in zip(items, prepared) if p.ok]
+    outcomes = {it[0]: p for it, p in zip(items, prepared) if not p.ok}
+    if not ready:
+        return outcomes, {}, None
+    usage, reconciled = {}, {}
+
+    t0 = time.monotonic()
+    try:
+        raw = _call_openai_envelope_multi([base64.b64encode(img).decode("ascii") for _, (img, _) in ready],
+                                          timeout=max(0.1, min(90.0, deadline_at - time.monotonic())), usage=usage)
+        parsed, status = parse_model_json(_strip_code_fence(raw))
+        per_shot = parsed.get("shots")
+        if not isinstance(per_shot, list):
+            for _ in ready: _parse_stats.record("failed")
+            raise ValueError("multi_response_without_shots")
+        reconciled = parsed.get("reconciled") if isinstance(parsed.get("reconciled"), dict) else {}
+        elapsed = int((time.monotonic() - t0) * 1000)
+        for j, (i, (_, prep)) in enumerate(ready):
+            js = per_shot[j] if j < len(per_shot) and isinstance(per_shot[j], dict) else {}
+            shot_status = status if js else "failed"
+            _parse_stats.record(shot_status)
+            outcomes[i] = ShotOutcome(i, ok=True, elapsed_ms=elapsed, value={
+                "raw": json.dumps(js, ensure_ascii=False), "json": js, "parse": shot_status, "cache": None, "preprocess": prep, "usage": None})
+    except Exception as e:
+        elapsed = int((time.monotonic() - t0) * 1000)
+        for i, _ in ready:
+            outcomes[i] = ShotOutcome(i, error=e, elapsed_ms=elapsed)
+    return outcomes, reconciled, usage
+
+
+def _shot_entry(idx: int, o, meta_obj, quality, skip_reason=None) -> Dict:
+    """ShotOutcome → 응답 shots[] 항목"""
+    if o is None:
+        return {"index": idx, "raw": f"SKIPPED: {skip_reason}", "json": {}, "image_path": None, "meta": meta_obj, "skipped": True, "quality": quality}
+    if o.ok:
+        v = o.value
+        return {"index": idx, "raw": v["raw"], "json": v["json"], "image_path": f"client_shot_{idx}", "meta": meta_obj, "elapsed_ms": o.elapsed_ms,
+                "parse": v["parse"], "truncated": v.get("truncated"), "cache": v["cache"], "preprocess": v["preprocess"],
+                "usage": v["usage"], "quality": quality}
+    return {"index": idx, "raw": f"ERROR: {o.error}", "json": {}, "image_path": None, "meta": meta_obj, "elapsed_ms": o.elapsed_ms, "quality": quality}
+
+
+def _score_shot(src):
+    img = _read_shot(src)
+    return score_frame(img) if img else None
+
+
+def _shot_usage(outcomes) -> Tuple[int, Counter]:
+    """샷 결과들 → (업스트림 호출 수, 토큰 사용량 합계). 캐시 히트/취소/이미지 오류는 호출로 세지 않는다"""
+    calls, usage = 0, Counter()
+    for o in outcomes:
+        if o.ok and o.value["usage"] is not None:
+            calls += 1
+            usage.update({k: v for k, v in o.value["usage"].items() if isinstance(v, int)})
+        elif not o.ok and not isinstance(o.error, (ShotCancelled, ValueError)):
+            calls += 1
+    return calls, usage
+
+
+def _assemble_scan(n: int, meta_in: List, outcomes: Dict, scores: List, skip: Dict, mode: str) -> Tuple[List, Dict, Dict]:
+    """샷 결과({index: ShotOutcome}) → (shots[], merged, diagnostics). 병합 + 표준 제품/med_features + 샷 통계"""
+    shots_raw=[]; json_list=[]
+    for idx in range(1, n + 1):
+        meta_obj = meta_in[idx-1] if idx-1 < len(meta_in) else None
+        o = outcomes.get(idx)
+        shots_raw.append(_shot_entry(idx, o, meta_obj, scores[idx-1], skip.get(idx)))
+        if o is not None:
+            json_list.append(o.value["json"] if o.ok else {})
+
+    merged, diag = _merge_envelope_json(json_list)
+    merged["medicine"], diag["_medicine"] = _resolve_medicine(merged.get("medicine_name", ""))
+    merged["med_features"], diag["_med_features"] = _med_features_for(merged)
+    parse_states = Counter(sh.get("parse") for sh in shots_raw if sh.get("parse"))
+    diag["_parse"] = {"ok": parse_states["ok"], "repaired": parse_states["repaired"], "failed": parse_states["failed"],
+                      "truncated_fields": sum(len(sh.get("truncated") or []) for sh in shots_raw)}
+    if SCAN_CACHE and mode == "fanout":
+        states = Counter(sh.get("cache") for sh in shots_raw)
+        diag["_cache"] = {"hits": states["hit"], "near_hits": states["near"], "coalesced": states["coalesced"],
+                          "misses": states["miss"], "global": _envelope_cache.stats()}
+    if SCAN_PREPROCESS:
+        preps = [sh["preprocess"] for sh in shots_raw if sh.get("preprocess") and "error" not in sh["preprocess"]]
+        diag["_preprocess"] = {
+            "shots": len(preps),
+            "bytes_in": sum(p["bytes_in"] for p in preps),
+            "bytes_out": sum(p["bytes_out"] for p in preps),
+            "est_image_tokens_in": sum(p["est_image_tokens_in"] for p in preps),
+            "est_image_tokens_out": sum(p["est_image_tokens_out"] for p in preps),
+        }
+    return shots_raw, merged, diag
+
+
+def _quality_diag(top_k: int, scores: List, cams: List, keep: List, skip: Dict) -> Dict:
+    return {
+        "top_k": top_k,
+        "skipped": sum(1 for r in skip.values() if r == "low_quality"),
+        "scores": [dict(sc or {}, index=i, camera_index=cams[i-1], selected=bool(keep[i-1]))
+                   for i, sc in enumerate(scores, 1)],
+    }
+
+
+def _run_segmented_scan(t0: float, items: List, meta_in: List, scores: List, skip: Dict, quorum: Dict,
+                        deadline_at: float, on_event=None):
+    """프레임마다 약봉투를 여러 개 찾으면 봉투별로 잘라 각각 추출 → 봉투별 병합.
+    분석할 샷(top-K 로 고른 샷) 전부가 봉투 여러 장으로 나뉠 때만 이 경로를 쓰고, 하나라도 안 나뉘면
+    None (단일 봉투 경로로 진행) — 일부 샷만 나뉘었다고 나머지 샷을 버리지 않는다.
+    quorum 이 있으면 샷 웨이브마다 봉투별로 합의를 보고, 합의된 봉투의 남은 crop 은 분석하지 않는다"""
+    if not items:
+        return None
+    def _camera(i):
+        m = meta_in[i-1] if i-1 < len(meta_in) else None
+        return m.get("camera_index") if isinstance(m, dict) else None
+
+    segs = run_shots(lambda it, ctx: segment_frame(_read_shot(it[1]) or b"", it[0], SCAN_JPEG_QUALITY,
+                                                   min_coverage=SCAN_SEGMENT_MIN_COVERAGE, camera=_camera(it[0])),
+                     items, max_workers=SCAN_MAX_WORKERS, deadline_s=max(0.0, deadline_at - time.monotonic()))
+    if not all(o.ok and o.value for o in segs):
+        return None
+    per_shot = [o.value for o in segs]
+    groups = group_crops(per_shot)[:SCAN_MAX_ENVELOPES]
+    crops = [(e, c) for e, g in enumerate(groups, 1) for c in g]
+
+    if on_event is not None:
+        on_event({"event": "start", "total": len(crops), "mode": "fanout", "envelopes": len(groups),
+                  "selected": [i for i, _ in items], "skipped": dict(skip)})
+    completed = [0]
+
+    def _on_done(o, run, batch):
+        completed[0] += 1
+        if on_event is None:
+            return
+        e, c = batch[o.index]
+        on_event({"event": "shot", "envelope": e, "shot": _shot_entry(c.shot, o, None, None),
+                  "completed": completed[0], "total": len(crops), "elapsed_ms": int((time.monotonic() - t0) * 1000)})
+
+    # 웨이브(쿼럼이 없으면 전체 한 번)마다 아직 합의 안 된 봉투의 crop 을 한 풀에서 병렬로 추출
+    results = {}                 # id(crop) → ShotOutcome
+    pending = set(range(1, len(groups) + 1))
+    reached = {}
+    shot_ids = [i for i, _ in items]
+    wave_size = quorum["wave_size"] if quorum else max(1, len(shot_ids))
+    waves = 0
+    for start in range(0, len(shot_ids), wave_size):
+        wave = set(shot_ids[start:start + wave_size])
+        batch = [(e, c) for e, c in crops if e in pending and c.shot in wave]
+        if batch:
+            res = run_shots(lambda it, ctx: _analyze_shot(it[1].jpeg, ctx, prepared=True), batch,
+                            max_workers=SCAN_MAX_WORKERS, deadline_s=max(0.0, deadline_at - time.monotonic()),
+                            on_done=lambda o, run, batch=batch: _on_done(o, run, batch))
+            results.update({id(c): o for (_, c), o in zip(batch, res)})
+            waves += 1
+        if not quorum:
+            break
+        for e in sorted(pending):
+            done = [results[id(c)].value["json"] for c in groups[e-1] if id(c) in results and results[id(c)].ok]
+            _, diag = _merge_envelope_json(done)
+            if _quorum_reached(diag, len(done), quorum):
+                reached[e] = True
+                pending.discard(e)
+        if not pending:
+            break
+
+    def _assemble_envelope(e, ctx):
+        g = groups[e-1]
+        metas = [meta_in[c.shot-1] if c.shot-1 < len(meta_in) else None for c in g]
+        outcomes = {k: results[id(c)] for k, c in enumerate(g, 1) if id(c) in results}
+        env_skip = {k: "quorum_reached" for k in range(1, len(g) + 1) if k not in outcomes}
+        shots_raw, merged, diag = _assemble_scan(len(g), metas, outcomes, [scores[c.shot-1] for c in g], env_skip, "fanout")
+        for sh, c in zip(shots_raw, g):
+            sh["index"] = c.shot
+            sh["crop"] = c.as_dict()
+        env = {"index": e, "center": [round(sum(c.center[k] for c in g) / len(g), 4) for k in (0, 1)],
+               "shots": shots_raw, "merged": merged, "diagnostics": diag}
+        if quorum:
+            env["quorum"] = {"reached": bool(reached.get(e)), "calls_made": len(outcomes), "calls_skipped": len(env_skip)}
+        return env
+
+    # 봉투별 병합/표준 제품 매칭/med_features 조회도 병렬로
+    assembled = run_shots(_assemble_envelope, list(range(1, len(groups) + 1)), max_workers=SCAN_MAX_WORKERS,
+                          deadline_s=max(1.0, deadline_at - time.monotonic()))
+    envelopes = [o.value for o in assembled if o.ok]
+    calls, usage = _shot_usage(results.values())
+
+    shots_raw = []
+    for idx in range(1, len(scores) + 1):
+        meta_obj = meta_in[idx-1] if idx-1 < len(meta_in) else None
+        found = next((cs for cs in per_shot if cs[0].shot == idx), [])
+        shots_raw.append({"index": idx, "meta": meta_obj, "quality": scores[idx-1], "skipped": idx in skip,
+                          "envelopes_found": len(found)})
+    out = {
+        "analysis_type":"envelope",
+        "shots": shots_raw,
+        # 첫 번째(왼쪽 위) 봉투를 merged 로도 내려 기존 클라이언트와 호환
+        "merged": envelopes[0]["merged"] if envelopes else {},
+        "envelopes": envelopes,
+        "diagnostics": {"_segment": {"envelopes": len(groups),
+                                     "crops_per_envelope": [len(g) for g in groups],
+                                     "shots_segmented": len(per_shot)}},
+        "perf": {
+            "mode": "fanout",
+            "upstream_calls": calls,
+            "elapsed_ms": int((time.monotonic() - t0) * 1000),
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "total_tokens": usage["total_tokens"],
+        },
+    }
+    if quorum:
+        out["quorum"] = dict(quorum, reached=not pending, waves=waves,
+                             calls_made=len(results), calls_skipped=len(crops) - len(results))
+    return out
+
+
+def _run_envelope_scan(images: List, meta_in: List, payload: Dict, on_event=None) -> Dict:
+    """샷 분석 → 병합까지 수행하고 api_scan_envelope 응답 dict를 반환한다.
+    images: 샷 소스 목록 (base64 문자열 / 바이트 / 업로드 파일 객체)
+    on_event(dict): 스트리밍용. 분석 시작("start")과 샷 하나가 끝날 때마다("shot", 부분 병합 포함) 호출"""
+    t0 = time.monotonic()
+    cams = [(m.get("camera_index") if isinstance(m, dict) else None)
+            for m in (meta_in[i] if i < len(meta_in) else None for i in range(len(images)))]
+
+    # 품질 점수로 카메라별 상위 K장만 선택 (흔들림/반사광 프레임은 병합을 오염시킴)
+    # 카메라 번호가 없는 샷은 어느 연사에 속하는지 모르므로 샷마다 따로 묶는다 (= 버리지 않음)
+    top_k = int(payload.get("top_k", SCAN_TOP_K) or 0)
+    if not any(c is not None for c in cams):
+        top_k = 0
+    scores = [_score_shot(src) for src in images] if top_k > 0 else [None] * len(images)
+    keep = select_top_k(scores, [c if c is not None else ("shot", i) for i, c in enumerate(cams)], top_k)
+    skip = {i: "low_quality" for i, k in enumerate(keep, 1) if not k}
+    items = [(i, img) for i, img in enumerate(images, 1) if i not in skip]
+
+    mode = payload.get("mode") or SCAN_MODE
+    if mode not in SCAN_MODES:
+        mode = "fanout"
+    quorum = _quorum_options(payload, meta_in) if mode == "fanout" else None
+    deadline_at = time.monotonic() + SCAN_DEADLINE_S
+
+    if mode == "fanout" and payload.get("segment", SCAN_SEGMENT):
+        out = _run_segmented_scan(t0, items, meta_in, scores, skip, quorum, deadline_at, on_event)
+        if out is not None:
+            if top_k > 0:
+                out["diagnostics"]["_quality"] = _quality_diag(top_k, scores, cams, keep, skip)
+            return out
+
+    outcomes = {}
+    waves, reached, reconciled, upstream_calls = 0, False, None, 0
+    usage_total = Counter()
+
+    def _emit_shot(idx, o):
+        if on_event is None:
+            return
+        done = [outcomes[i] for i in sorted(outcomes)]
+        partial, pdiag = _merge_envelope_json([d.value["json"] if d.ok else {} for d in done])
+        meta_obj = meta_in[idx-1] if idx-1 < len(meta_in) else None
+        on_event({"event": "shot", "shot": _shot_entry(idx, o, meta_obj, scores[idx-1]),
+                  "completed": len(done), "total": len(items), "merged": partial, "diagnostics": pdiag,
+                  "elapsed_ms": int((time.monotonic() - t0) * 1000)})
+
+    if on_event is not None:
+        on_event({"event": "start", "total": len(items), "mode": mode,
+                  "selected": [i for i, _ in items], "skipped": dict(skip)})
+
+    if mode == "multi":
+        outcomes, reconciled, usage = _analyze_multi(items, deadline_at)
+        for i in sorted(outcomes):
+            _emit_shot(i, outcomes[i])
+        if usage is not None:
+            upstream_calls = 1
+            usage_total.update({k: v for k, v in usage.items() if isinstance(v, int)})
+    else:
+        # 샷별 업스트림 호출을 병렬로 실행 (결과 순서는 입력 순서 유지)
+        wave_size = quorum["wave_size"] if quorum else max(1, len(items))
+        for start in range(0, len(items), wave_size):
+            wave = items[start:start + wave_size]
+
+            def _on_done(o, run, wave=wave):
+                idx = wave[o.index][0]
+                outcomes[idx] = o
+                _emit_shot(idx, o)
+
+            res = run_shots(lambda it, ctx: _analyze_shot(it[1], ctx), wave, max_workers=SCAN_MAX_WORKERS,
+                            deadline_s=max(0.0, deadline_at - time.monotonic()), on_done=_on_done)
+            outcomes.update({i: o for (i, _), o in zip(wave, res)})
+            waves += 1
+            if quorum:
+                done = [o.value["json"] for o in outcomes.values() if o.ok]
+                _, diag = _merge_envelope_json(done)
+                reached = _quorum_reached(diag, len(done), quorum)
+                if reached:
+                    break
+        upstream_calls, usage = _shot_usage(outcomes.values())
+        usage_total.update(usage)
+    quorum_skipped = [i for i, _ in items if i not in outcomes]
+    skip.update({i: "quorum_reached" for i in quorum_skipped})
+
+    shots_raw, merged, diag = _assemble_scan(len(images), meta_in, outcomes, scores, skip, mode)
+
+    if top_k > 0:
+        diag["_quality"] = _quality_diag(top_k, scores, cams, keep, skip)
+
+    out = {"analysis_type":"envelope", "shots": shots_raw, "merged": merged, "diagnostics": diag}
+    if quorum:
+        out["quorum"] = dict(quorum, reached=reached, waves=waves,
+                             calls_made=len(items) - len(quorum_skipped), calls_skipped=len(quorum_skipped))
+    if reconciled is not None:
+        # multi 모드: 모델이 직접 종합한 값 (merged 와 비교용)
+        out["reconciled"] = reconciled
+    # 모드별 벤치마크용 지표
+    out["perf"] = {
+        "mode": mode,
+        "upstream_calls": upstream_calls,
+        "elapsed_ms": int((time.monotonic() - t0) * 1000),
+        "prompt_tokens": usage_total["prompt_tokens"],
+        "completion_tokens": usage_total["completion_tokens"],
+        "total_tokens": usage_total["total_tokens"],
+    }
+    return out
+
+
+def _record_scan(client: str, out: Dict) -> Dict:
+    """스캔 응답을 저장하고 scan_id 를 붙여 반환 (저장 실패해도 응답은 그대로)"""
+    if SCAN_PERSIST:
+        out["scan_id"] = save_scan(client, out)
+    return out
+
+
+def _upstream_degraded():
+    """chat 차단기가 열려 있으면 샷마다 실패를 기다리지 않고 바로 503"""
+    b = get_upstream().breaker("chat")
+    if not b.is_open():
+        return None
+    wait_s = int(b.retry_after_s()) + 1
+    resp = JsonResponse({"error": "upstream_degraded", "retry_after_s": wait_s}, status=503)
+    resp["Retry-After"] = str(wait_s)
+    return resp
+
+
+def _scan_as(client: str, images: List, meta_in: List, payload: Dict, on_event=None, burst: str = None) -> Dict:
+    """업스트림 스케줄러에서 client 몫으로 스캔 실행 (샷 스레드까지 contextvars 로 전달).
+    burst: 캐시 근사 일치 범위 (기본은 이 호출 하나)"""
+    with client_scope(client), _burst_scope(burst or uuid.uuid4().hex):
+        return _run_envelope_scan(images, meta_in, payload, on_event=on_event)
+
+
+# ===== 스캔 요청 파싱 (JSON base64 / multipart / raw image/jpeg) =====
+SCAN_MAX_SHOTS = 9
+# 요청당 업로드 상한(바이트). 넘으면 413
+SCAN_MAX_UPLOAD_BYTES = int(os.getenv("SCAN_MAX_UPLOAD_BYTES", str(24 * 1024 * 1024)))
+# raw 업로드를 메모리에 둘 최대 크기. 넘으면 임시 파일로 내려간다
+SCAN_SPOOL_BYTES = int(os.getenv("SCAN_SPOOL_BYTES", str(1024 * 1024)))
+
+
+class ScanRequestError(Exception):
+    def __init__(self, status: int, body: Dict):
+        super().__init__(body.get("error"))
+        self.status = status
+        self.body = body
+
+
+def _json_field(value, default):
+    if not value:
+        return default
+    try:
+        return json.loads(value)
+    except Exception as e:
+        raise ScanRequestError(400, {"error": "bad_payload", "detail": str(e)})
+
+
+def _spool_body(request):
+    """raw 요청 본문을 청크 단위로 SpooledTemporaryFile에 복사 (상한 초과 시 413)"""
+    buf = tempfile.SpooledTemporaryFile(max_size=SCAN_SPOOL_BYTES)
+    total = 0
+    while True:
+        chunk = request.read(64 * 1024)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > SCAN_MAX_UPLOAD_BYTES:
+            buf.close()
+            raise ScanRequestError(413, {"error": "upload_too_large", "limit": SCAN_MAX_UPLOAD_BYTES})
+        buf.write(chunk)
+    buf.seek(0)
+    return buf
+
+
+def _parse_scan_request(request) -> Tuple[List, List, Dict]:
+    """스캔 요청 → (샷 소스 목록, meta 목록, 옵션 payload)
+    - application/json      : {images: [base64...], meta?, ...옵션}
+    - multipart/form-data   : images(여러 파일) 또는 image, meta/options 는 JSON 문자열 필드
+    - image/jpeg, image/png : 본문 = 이미지 1장, 옵션은 쿼리스트링
+    바이너리 업로드는 파일 객체 그대로 넘기고 base64 인코딩은 업스트림 호출 직전에만 한다."""
+    ctype = (request.headers.get('Content-Type') or '').lower()
+    try:
+        length = int(request.META.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if 'application/json' in ctype:
+        # base64는 원본보다 4/3배 크다
+        limit = SCAN_MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
+    else:
+        limit = SCAN_MAX_UPLOAD_BYTES + 64 * 1024
+    if length > limit:
+        raise ScanRequestError(413, {"error": "upload_too_large", "limit": SCAN_MAX_UPLOAD_BYTES})
+
+    if 'application/json' in ctype:
+        try:
+            payload = json.loads(request.body.decode('utf-8'))
+        except RequestDataTooBig:
+            raise ScanRequestError(413, {"error": "upload_too_large", "detail": "use multipart/form-data for large scans"})
+        except Exception as e:
+            raise ScanRequestError(400, {"error": "bad_payload", "detail": str(e)})
+        if not isinstance(payload, dict):
+            raise ScanRequestError(400, {"error": "bad_payload", "detail": "object expected"})
+        arr = payload.get('images') or []
+        if not isinstance(arr, list): arr = []
+        images = [str(x or '').strip() for x in arr][:SCAN_MAX_SHOTS]  # 최대 9장
+        meta_in = payload.get('meta') or []
+    elif ctype.startswith('multipart/form-data'):
+        files = request.FILES.getlist('images') or request.FILES.getlist('image')
+        if not files:
+            raise ScanRequestError(400, {"error": "no_image"})
+        files = files[:SCAN_MAX_SHOTS]
+        if sum(f.size or 0 for f in files) > SCAN_MAX_UPLOAD_BYTES:
+            raise ScanRequestError(413, {"error": "upload_too_large", "limit": SCAN_MAX_UPLOAD_BYTES})
+        payload = _json_field(request.POST.get('options'), {})
+        meta_in = _json_field(request.POST.get('meta'), None)
+        if meta_in is None:
+            # 카메라 번호를 모르면 비워 둔다 (top_k 는 카메라 번호가 있는 샷에만 적용)
+            meta_in = [{"shot_index": i, "deviceId": "upload"} for i in range(1, len(files) + 1)]
+        images = files
+    elif ctype.startswith('image/'):
+        images = [_spool_body(request)]
+        payload = {k: v for k, v in request.GET.items() if k in ("mode", "top_k", "quorum", "segment")}
+        if "top_k" in payload:
+            payload["top_k"] = int(payload["top_k"]) if payload["top_k"].isdigit() else 0
+        for k in ("quorum", "segment"):
+            if k in payload:
+                payload[k] = payload[k] == "1"
+        meta_in = [{"shot_index": 1, "deviceId": "upload"}]
+    else:
+        raise ScanRequestError(415, {"error": "unsupported_content_type", "content_type": ctype})
+
+    if not isinstance(meta_in, list): meta_in = []
+    if not isinstance(payload, dict): payload = {}
+    if not images:
+        raise ScanRequestError(400, {"error": "no_images"})
+    return images, meta_in, payload
+
+
 @csrf_exempt
 def api_scan_envelope(request):
-    """POST { images: [base64_jpeg_without_prefix, ...], meta?: [{camera_index, shot_index, deviceId}, ...] }
+    """POST (application/json) { images: [base64_jpeg_without_prefix, ...], meta?: [{camera_index, shot_index, deviceId}, ...],
+              quorum?: true | {confidence, fields, wave_size, min_shots}, top_k?: int,
+              mode?: "fanout" | "multi" }
        - 카메라를 1~3대 선택하고 각 3연사(총 3~9장) 이미지를 보냄.
        - meta 는 선택사항이며, 진단 정보에만 사용.
+       - quorum 을 켜면 웨이브 단위로 분석하고, 필수 필드 신뢰도가 기준에 도달하면
+         나머지 샷은 호출하지 않는다 (응답 quorum.calls_skipped).
+       - top_k: 카메라별로 품질 점수 상위 K장만 분석 (기본 SCAN_TOP_K, 0이면 전부).
+         meta 에 camera_index 가 없는 샷은 골라내지 않고 모두 분석한다.
+       - mode: fanout(샷별 요청) | multi(모든 샷을 한 요청으로, 응답에 reconciled 포함).
+         두 모드 모두 perf 블록(업스트림 호출 수/토큰/소요시간)으로 비교할 수 있다.
+       - segment (기본 SCAN_SEGMENT=꺼짐): 고른 샷 전부에서 약봉투가 여러 장으로 나뉘면 봉투별로 잘라 각각 추출/병합하고
+         응답 envelopes[] 에 봉투마다 {index, center, shots, merged, diagnostics, quorum?} 를 담는다 (fanout 모드만).
+         top_k 선택과 quorum(봉투별 합의)은 이 경로에도 그대로 적용된다.
+       POST (multipart/form-data) images=<jpeg>... , meta=<JSON>, options=<JSON 위 옵션>
+       POST (image/jpeg) 본문=이미지 1장, ?mode=&top_k=&quorum=
+         바이너리 업로드는 base64 대비 33% 작고, 요청당 SCAN_MAX_UPLOAD_BYTES 상한을 둔다.
+       결과는 Scan/ScanShot 에 저장되고 현재 복용약(Medication)이 갱신된다 (응답 scan_id, /meds/).
+       같은 사용자의 같은 이미지/옵션(또는 같은 Idempotency-Key 헤더) 요청은 진행 중인 분석에 합류하거나
+       SCAN_REPLAY_TTL_S 동안 저장된 결과를 받는다 (응답 헤더 X-Scan-Dedup: leader|joined|replay).
     """
     if request.method != "POST":
         return JsonResponse({"error":"method_not_allowed"}, status=405)
@@ -560,47 +1391,415 @@ def api_scan_envelope(request):
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         return JsonResponse({"error":"missing_api_key"}, status=500)
+    degraded = _upstream_degraded()
+    if degraded is not None:
+        return degraded
 
-    images_b64 = []
-    meta_in = []
-    ctype = (request.headers.get('Content-Type') or '').lower()
     try:
-        if 'application/json' in ctype:
-            payload = json.loads(request.body.decode('utf-8'))
-            arr = payload.get('images') or []
-            if not isinstance(arr, list): arr=[]
-            images_b64 = [str(x or '').strip() for x in arr][:9]  # 최대 9장
-            meta_in = payload.get('meta') or []
+        images, meta_in, payload = _parse_scan_request(request)
+    except ScanRequestError as e:
+        return JsonResponse(e.body, status=e.status)
+
+    # 연타/재시도로 같은 요청이 여러 번 와도 업스트림 호출(과 저장)은 한 번만
+    # 키는 사용자별: 다른 사용자가 같은 이미지/같은 Idempotency-Key 를 보내도 남의 결과(scan_id)에 합류하지 않는다
+    client = _client_id(request)
+    fp = _scan_fingerprint(images, payload, meta_in)
+    idem = (request.headers.get("Idempotency-Key") or "").strip()[:128]
+    try:
+        out, dedup = _scan_flight.do(f"{client}|idem:{idem}" if idem else f"{client}|sha:{fp}",
+                                     lambda: _record_scan(client, _scan_as(client, images, meta_in, payload)),
+                                     fingerprint=fp, timeout=SCAN_DEADLINE_S + 15)
+    except KeyConflict:
+        return JsonResponse({"error":"idempotency_key_reused"}, status=422)
+    except TimeoutError:
+        return JsonResponse({"error":"scan_timeout"}, status=504)
+    resp = JsonResponse(out, status=200)
+    resp["X-Scan-Dedup"] = dedup
+    if dedup == "replay":
+        resp["Idempotent-Replayed"] = "true"
+    return resp
+
+
+# ===== 스트리밍 스캔: 샷이 끝날 때마다 결과/부분 병합을 NDJSON 또는 SSE로 전송 =====
+def _stream_events(run, fmt: str):
+    """run(on_event) 를 백그라운드 스레드에서 실행하고 이벤트를 순서대로 직렬화해 yield"""
+    q = queue.Queue()
+    DONE = object()
+
+    def _worker():
+        try:
+            out = run(q.put)
+            q.put(dict(out, event="done"))
+        except Exception as e:
+            logger.exception("scan stream failed")
+            q.put({"event": "error", "error": "scan_failed", "detail": str(e)})
+        finally:
+            q.put(DONE)
+
+    threading.Thread(target=_worker, name="carepill-scan-stream", daemon=True).start()
+    while True:
+        ev = q.get()
+        if ev is DONE:
+            break
+        data = json.dumps(ev, ensure_ascii=False)
+        if fmt == "sse":
+            yield f"event: {ev.get('event', 'message')}\ndata: {data}\n\n"
         else:
-            f = request.FILES.get('image')
-            if not f: return JsonResponse({"error":"no_image"}, status=400)
-            images_b64 = [ (f.read()).decode('latin1') ]
-            meta_in = [{"camera_index":1, "shot_index":1, "deviceId":"upload"}]
-    except Exception as e:
-        return JsonResponse({"error":"bad_payload","detail":str(e)}, status=400)
+            yield data + "\n"
 
-    if not images_b64:
-        return JsonResponse({"error":"no_images"}, status=400)
 
-    shots_raw=[]; json_list=[]
-    for idx,b64 in enumerate(images_b64,1):
-        b64 = re.sub(r'^data:image\/(png|jpeg);base64,', '', b64, flags=re.I)
+@csrf_exempt
+def api_scan_envelope_stream(request):
+    """POST /api/scan/envelope/stream/  (요청 형식은 api_scan_envelope 와 동일)
+    응답: application/x-ndjson (기본) 또는 text/event-stream (Accept 또는 ?format=sse)
+      {"event":"start", total, mode, selected, skipped}
+      {"event":"shot", shot, completed, total, merged, diagnostics, elapsed_ms}   # 샷마다
+      {"event":"done", ...api_scan_envelope 응답과 동일}
+    첫 샷이 끝나는 즉시 약품명 등 부분 병합 결과를 받을 수 있다."""
+    if request.method != "POST":
+        return JsonResponse({"error":"method_not_allowed"}, status=405)
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return JsonResponse({"error":"missing_api_key"}, status=500)
+    degraded = _upstream_degraded()
+    if degraded is not None:
+        return degraded
+
+    try:
+        images, meta_in, payload = _parse_scan_request(request)
+    except ScanRequestError as e:
+        return JsonResponse(e.body, status=e.status)
+
+    fmt = "sse" if (request.GET.get("format") == "sse" or "text/event-stream" in (request.headers.get("Accept") or "")) else "ndjson"
+    client = _client_id(request)
+    resp = StreamingHttpResponse(
+        _stream_events(lambda on_event: _record_scan(client, _scan_as(client, images, meta_in, payload, on_event=on_event)), fmt),
+        content_type="text/event-stream; charset=utf-8" if fmt == "sse" else "application/x-ndjson; charset=utf-8",
+    )
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"
+    return resp
+
+
+# ===== 비동기 스캔 작업: 제출 즉시 job_id 반환, 로컬 워커 풀에서 처리 =====
+def _upstream_retry_after() -> float:
+    b = get_upstream().breaker("chat")
+    return b.retry_after_s() + 0.5 if b.is_open() else 0.0
+
+
+# 작업은 제출한 사용자 몫으로 실행되고, chat 차단기가 열려 있으면 시도 횟수를 쓰지 않고 미뤄진다
+# Scan 저장은 마지막 시도 결과에만 (재시도마다 Scan 이 쌓이지 않게)
+_scan_jobs = ScanJobQueue(
+    lambda images, meta, options, client: _scan_as(client, images, meta, options),
+    finish=lambda result, client: _record_scan(client, result),
+    workers=int(os.getenv("SCAN_JOB_WORKERS", "2")),
+    max_attempts=int(os.getenv("SCAN_JOB_MAX_ATTEMPTS", "3")),
+    lease_s=float(os.getenv("SCAN_JOB_LEASE_S", "60")),
+    retry_after=_upstream_retry_after,
+)
+SCAN_JOB_MAX_WAIT_S = 30.0
+
+
+@csrf_exempt
+def api_scan_jobs(request):
+    """POST /api/scan/jobs/  (요청 형식은 api_scan_envelope 와 동일)
+    → 202 { job_id, status: "queued", poll_url }
+    업스트림 호출은 워커 풀에서 수행되므로 요청 스레드는 바로 반환된다.
+    결과는 제출한 사용자 몫으로 Scan 에 저장된다 (result.scan_id)."""
+    if request.method != "POST":
+        return JsonResponse({"error":"method_not_allowed"}, status=405)
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return JsonResponse({"error":"missing_api_key"}, status=500)
+    degraded = _upstream_degraded()
+    if degraded is not None:
+        return degraded
+
+    try:
+        images, meta_in, payload = _parse_scan_request(request)
+    except ScanRequestError as e:
+        return JsonResponse(e.body, status=e.status)
+
+    options = {k: payload[k] for k in ("mode", "quorum", "top_k", "segment") if k in payload}
+    job = _scan_jobs.submit((_read_shot(src) for src in images), meta_in, options, client=_client_id(request))
+    out = job.as_dict(include_result=False)
+    out["poll_url"] = f"/api/scan/jobs/{job.id}/"
+    return JsonResponse(out, status=202)
+
+
+def api_scan_job(request, job_id):
+    """GET /api/scan/jobs/<job_id>/?wait=<초>
+    wait 를 주면 완료될 때까지 최대 30초 long-poll. 완료 전이면 result 는 null."""
+    try:
+        wait_s = min(SCAN_JOB_MAX_WAIT_S, float(request.GET.get("wait") or 0))
+    except ValueError:
+        wait_s = 0.0
+    job = _scan_jobs.get(job_id, wait_s=wait_s)
+    # 결과(처방 정보)는 제출한 사용자에게만
+    if job is None or job.client != _client_id(request):
+        return JsonResponse({"error": "job_not_found"}, status=404)
+    return JsonResponse(job.as_dict(), status=200)
+
+
+# ===== 스캔 세션: 샷마다 업로드 → 도착 즉시 분석 → finalize 에서 일반 스캔 파이프라인으로 병합 =====
+def _session_admit(sess, idx: int, img: bytes, meta) -> bool:
+    """업로드된 샷의 분석을 바로 시작할지. finalize 의 파이프라인이 쓸 샷만 미리 당겨 둔다:
+    - quorum: 첫 웨이브(카메라마다 첫 샷: shot_index 가 있으면 1번, 없으면 먼저 도착한 샷)만
+      — 나머지 웨이브는 합의가 안 됐을 때만 finalize 에서
+    - top_k: 카메라마다 최대 K장, 그때까지 받은 샷 중 품질 상위 K 안일 때만
+      (더 좋은 샷이 나중에 오면 finalize 가 그 샷을 고르고 그때 분석한다)
+    - multi / segment: finalize 에서 한 요청으로 보내거나 봉투 crop 을 분석하므로 미리 시작하지 않음
+    카메라 번호가 없는 샷은 어느 연사인지 모르므로 항상 시작 (top-K 대상 아님)"""
+    opts = sess.options
+    if (opts.get("mode") or SCAN_MODE) == "multi" or opts.get("segment", SCAN_SEGMENT):
+        return False
+    cam = meta.get("camera_index") if isinstance(meta, dict) else None
+    if cam is None:
+        return True
+    st = sess.state.setdefault(cam, {"scores": [], "started": 0})
+    if _quorum_options(opts, []):
+        shot_no = meta.get("shot_index")
+        if (shot_no != 1) if isinstance(shot_no, int) else st["started"] >= 1:
+            return False
+    top_k = int(opts.get("top_k", SCAN_TOP_K) or 0)
+    sc = score_frame(img) if top_k > 0 else None
+    if sc is not None:
+        st["scores"].append(sc["score"])
+        if st["started"] >= top_k or sum(1 for x in st["scores"] if x > sc["score"]) >= top_k:
+            return False
+    st["started"] += 1
+    return True
+
+
+_scan_sessions = ScanSessionStore(
+    lambda img, ctx: _analyze_shot(img, ctx),
+    max_workers=int(os.getenv("SCAN_SESSION_WORKERS", str(SCAN_MAX_WORKERS * 2))),
+    ttl_s=float(os.getenv("SCAN_SESSION_TTL_S", "300")),
+    max_shots=SCAN_MAX_SHOTS,
+    deadline_s=SCAN_DEADLINE_S,
+    admit=_session_admit,
+)
+SESSION_ERROR_STATUS = {"not_found": 404, "finalized": 409, "duplicate_shot": 409, "too_many_shots": 413,
+                        "too_many_sessions": 503}
+# 세션을 열 때 받을 수 있는 스캔 옵션 (api_scan_envelope 와 같은 의미)
+SESSION_OPTIONS = ("mode", "top_k", "quorum", "segment")
+
+
+def _session_error(e: SessionError):
+    return JsonResponse({"error": f"session_{e.code}"}, status=SESSION_ERROR_STATUS.get(e.code, 400))
+
+
+def _build_session_result(client: str, sess) -> Dict:
+    """세션의 샷 전체를 api_scan_envelope 와 같은 파이프라인(top-K/쿼럼/봉투 분리/중복 제출 합치기)으로 병합.
+    업로드 때 시작한 분석은 _analyze_shot 이 기다려 재사용한다"""
+    shots = list(sess.shots)
+    fp = _scan_fingerprint(shots, sess.options, sess.meta)
+    out, dedup = _scan_flight.do(f"{client}|sha:{fp}",
+                                 lambda: _record_scan(client, _scan_as(client, shots, sess.meta, sess.options, burst=sess.id)),
+                                 fingerprint=fp, timeout=SCAN_DEADLINE_S + 15)
+    return dict(out, session=dict(sess.status(), dedup=dedup),
+                perf=dict(out.get("perf") or {}, session=True,
+                          # 세션을 연 시점부터: 촬영/업로드 시간과 분석이 얼마나 겹쳤는지 볼 수 있다
+                          session_elapsed_ms=int((time.monotonic() - sess.opened_at) * 1000)))
+
+
+@csrf_exempt
+def api_scan_sessions(request):
+    """POST /api/scan/sessions/  본문(선택, application/json): {mode?, top_k?, quorum?, segment?} — api_scan_envelope 옵션과 같음
+    → 201 { session_id, shot_url, events_url, finalize_url, max_shots, ttl_s }"""
+    if request.method != "POST":
+        return JsonResponse({"error":"method_not_allowed"}, status=405)
+    if not os.getenv("OPENAI_API_KEY"):
+        return JsonResponse({"error":"missing_api_key"}, status=500)
+    degraded = _upstream_degraded()
+    if degraded is not None:
+        return degraded
+    body = {}
+    if request.content_type == "application/json":
+        try:
+            body = json.loads(request.body or b"{}")
+        except (ValueError, UnicodeDecodeError):
+            return JsonResponse({"error":"invalid_json"}, status=400)
+    options = {k: body[k] for k in SESSION_OPTIONS if k in body} if isinstance(body, dict) else {}
+    try:
+        sess = _scan_sessions.open(options, owner=_client_id(request))
+    except SessionError as e:
+        return _session_error(e)
+    base = f"/api/scan/sessions/{sess.id}/"
+    return JsonResponse({"session_id": sess.id, "shot_url": base + "shots/", "events_url": base + "events/",
+                         "finalize_url": base + "finalize/",
+                         "max_shots": _scan_sessions.max_shots, "ttl_s": _scan_sessions.ttl_s}, status=201)
+
+
+@csrf_exempt
+def api_scan_session(request, session_id):
+    """GET /api/scan/sessions/<id>/ → 진행 상태,  DELETE → 세션 취소(진행 중 분석 중단)
+    세션을 연 사용자가 아니면 404"""
+    sid, owner = str(session_id), _client_id(request)
+    try:
+        if request.method == "DELETE":
+            _scan_sessions.discard(sid, owner)
+            return JsonResponse({"session_id": sid, "discarded": True}, status=200)
+        if request.method != "GET":
+            return JsonResponse({"error":"method_not_allowed"}, status=405)
+        return JsonResponse(_scan_sessions.get(sid, owner).status(), status=200)
+    except SessionError as e:
+        return _session_error(e)
+
+
+@csrf_exempt
+def api_scan_session_shot(request, session_id):
+    """POST /api/scan/sessions/<id>/shots/  (형식은 api_scan_envelope 와 동일: image/jpeg 본문, multipart, JSON)
+    → 202 { indexes: [도착 번호...], shots, started, analyzed }.
+    업로드는 병렬로 도착하므로 샷마다 meta 의 shot_index/camera_index 로 세션 안 위치를 정한다
+    (없으면 도착 순서대로 뒤에 붙음, 같은 shot_index/camera_index 를 다시 올리면 409 session_duplicate_shot).
+    카메라별 품질 상위 top_k 안에 드는 샷은 응답 전에 분석을 시작한다 (나머지는 finalize 에서 필요할 때만)."""
+    if request.method != "POST":
+        return JsonResponse({"error":"method_not_allowed"}, status=405)
+    try:
+        images, meta_in, _ = _parse_scan_request(request)
+    except ScanRequestError as e:
+        return JsonResponse(e.body, status=e.status)
+    if request.content_type.startswith("image/"):
+        # raw 업로드는 샷 번호를 쿼리스트링으로 받는다 (?camera_index=&shot_index=)
+        meta_in = [dict(meta_in[0], **{k: int(request.GET[k]) for k in ("camera_index", "shot_index")
+                                       if request.GET.get(k, "").isdigit()})]
+    indexes, owner = [], _client_id(request)
+    try:
+        with client_scope(owner), _burst_scope(str(session_id)):
+            for i, src in enumerate(images):
+                img = _read_shot(src)
+                if not img:
+                    return JsonResponse({"error":"bad_image", "index": i}, status=400)
+                meta = meta_in[i] if i < len(meta_in) else None
+                indexes.append(_scan_sessions.add_shot(str(session_id), img, meta, owner, order=_session_order(meta)))
+        status = _scan_sessions.get(str(session_id), owner).status()
+    except SessionError as e:
+        return _session_error(e)
+    return JsonResponse({"indexes": indexes, "shots": status["shots"], "started": status["started"],
+                         "analyzed": status["analyzed"]}, status=202)
+
+
+def _session_order(meta):
+    """업로드 meta → 세션 안 샷 위치 (샷 번호, 카메라 번호). shot_index 가 없으면 None (도착 순서)"""
+    if not isinstance(meta, dict) or not isinstance(meta.get("shot_index"), int):
+        return None
+    cam = meta.get("camera_index")
+    return (meta["shot_index"], cam if isinstance(cam, int) else 0)
+
+
+def _session_events(sess):
+    """세션의 미리 시작한 분석이 끝날 때마다 부분 병합 이벤트를 낸다 (finalize/취소/만료 시 종료)
+      {"event":"shot", shot, completed, started, merged, diagnostics, elapsed_ms}
+      {"event":"finalized"} | {"event":"closed"}"""
+    seen, version = set(), -1
+    until = time.monotonic() + _scan_sessions.ttl_s
+    while time.monotonic() < until:
+        version = sess.wait(version, 1.0)
+        shots, metas = list(sess.shots), list(sess.meta)
+        started = [(i, sh) for i, sh in enumerate(shots, 1) if sh.future is not None]
+        done = [(i, sh, sh.future.result()) for i, sh in started if sh.future.done() and not sh.future.cancelled()]
+        for i, sh, o in done:
+            if id(sh) in seen:
+                continue
+            seen.add(id(sh))
+            partial, pdiag = _merge_envelope_json([d.value["json"] for _, _, d in done if d.ok])
+            yield {"event": "shot", "shot": _shot_entry(i, o, metas[i-1] if i-1 < len(metas) else None, None),
+                   "completed": len(done), "started": len(started), "merged": partial, "diagnostics": pdiag,
+                   "elapsed_ms": int((time.monotonic() - sess.opened_at) * 1000)}
+        if sess.result is not None or sess.closed:
+            yield {"event": "finalized" if sess.result is not None else "closed"}
+            return
+
+
+def api_scan_session_events(request, session_id):
+    """GET /api/scan/sessions/<id>/events/  → application/x-ndjson (기본) 또는 text/event-stream (?format=sse)
+    촬영하는 동안 먼저 도착한 샷의 분석이 끝나는 대로 부분 병합 결과를 보낸다 (약품명을 finalize 전에 읽어줄 수 있음).
+    finalize 결과는 finalize 응답으로 받고, 이 스트림은 finalized 이벤트로 끝난다."""
+    if request.method != "GET":
+        return JsonResponse({"error":"method_not_allowed"}, status=405)
+    try:
+        sess = _scan_sessions.get(str(session_id), _client_id(request))
+    except SessionError as e:
+        return _session_error(e)
+    fmt = "sse" if (request.GET.get("format") == "sse" or "text/event-stream" in (request.headers.get("Accept") or "")) else "ndjson"
+
+    def _lines():
+        for ev in _session_events(sess):
+            data = json.dumps(ev, ensure_ascii=False)
+            yield f"event: {ev['event']}\ndata: {data}\n\n" if fmt == "sse" else data + "\n"
+
+    resp = StreamingHttpResponse(_lines(), content_type="text/event-stream; charset=utf-8" if fmt == "sse"
+                                 else "application/x-ndjson; charset=utf-8")
+    resp["Cache-Control"] = "no-cache"
+    resp["X-Accel-Buffering"] = "no"
+    return resp
+
+
+@csrf_exempt
+def api_scan_session_finalize(request, session_id):
+    """POST /api/scan/sessions/<id>/finalize/ → api_scan_envelope 와 같은 응답 (+ session, perf.session_elapsed_ms)
+    샷 선택/쿼럼/봉투 분리는 api_scan_envelope 와 같고, 남은 분석은 SCAN_DEADLINE_S 까지 기다린다.
+    다시 호출하면 같은 결과."""
+    if request.method != "POST":
+        return JsonResponse({"error":"method_not_allowed"}, status=405)
+    client = _client_id(request)
+    try:
+        out = _scan_sessions.finalize(str(session_id), lambda sess: _build_session_result(client, sess), owner=client)
+    except SessionError as e:
+        return _session_error(e)
+    except TimeoutError:
+        return JsonResponse({"error":"scan_timeout"}, status=504)
+    return JsonResponse(out, status=200)
+
+
+def api_scan_stats(request):
+    """GET /api/scan/stats/ — 프로세스 누적 스캔 지표 (샷 파싱 실패율, 캐시, 작업 큐, 중복 제출, 세션)"""
+    return JsonResponse({
+        "parse": _parse_stats.snapshot(),
+        "cache": _envelope_cache.stats(),
+        "jobs": _scan_jobs.stats(),
+        "dedup": _scan_flight.stats(),
+        "sessions": _scan_sessions.stats(),
+    }, status=200)
+
+
+@csrf_exempt
+def api_meds_check(request):
+    """성분 중복/상호작용 검사 (LLM 호출 없이 로컬 규칙 비트셋으로)
+    GET                       → 내 복용약(스캔으로 저장된 Medication)끼리 검사
+    POST {medicines: ["타이레놀", {"name": "...", "ingredient": "..."}...], include_current?: true}
+                              → 보낸 약 + (include_current 면) 내 복용약까지 함께 검사
+    응답: {medicines: [{label, ingredients, matched, source, id?, prescription_number?, pharmacy_name?}],
+           duplicates, class_duplicates, interactions, elapsed_us}
+    저장된 복용약은 처방(행)마다 따로 검사하므로 같은 제품을 두 번 처방받았어도 성분 중복으로 잡힌다"""
+    items = []
+    include_current = True
+    if request.method == "POST":
         try:
-            raw = _call_openai_envelope(b64)
-            cleaned = _strip_code_fence(raw)
-            try:
-                parsed = json.loads(cleaned)
-            except Exception:
-                parsed = {}
-            meta_obj = meta_in[idx-1] if idx-1 < len(meta_in) else None
-            shots_raw.append({"index": idx, "raw": cleaned, "json": parsed, "image_path": f"client_shot_{idx}", "meta": meta_obj})
-            json_list.append(parsed)
+            payload = json.loads(request.body.decode("utf-8") or "{}")
         except Exception as e:
-            meta_obj = meta_in[idx-1] if idx-1 < len(meta_in) else None
-            shots_raw.append({"index": idx, "raw": f"ERROR: {e}", "json": {}, "image_path": None, "meta": meta_obj})
-            json_list.append({})
+            return JsonResponse({"error": "bad_payload", "detail": str(e)}, status=400)
+        if not isinstance(payload, dict) or not isinstance(payload.get("medicines", []), list):
+            return JsonResponse({"error": "bad_payload", "detail": "medicines must be a list"}, status=400)
+        for m in payload.get("medicines", [])[:50]:
+            if isinstance(m, str) and m.strip():
+                items.append({"name": m.strip()})
+            elif isinstance(m, dict) and str(m.get("name") or "").strip():
+                items.append({"name": str(m["name"]).strip(), "ingredient": str(m.get("ingredient") or "")})
+        include_current = payload.get("include_current", True) is not False
+    elif request.method != "GET":
+        return JsonResponse({"error":"method_not_allowed"}, status=405)
 
-    merged, diag = _merge_envelope_json(json_list)
+    if include_current:
+        items += current_medicine_items(_client_id(request))
+    return JsonResponse(check_medicines(items), status=200)
 
-    out = {"analysis_type":"envelope", "shots": shots_raw, "merged": merged, "diagnostics": diag}
-    return JsonResponse(out, status=200)
\ No newline at end of file
+
+def api_upstream_stats(request):
+    """GET /api/upstream/stats/ — 업스트림 호출/재시도, 지연 백분위, 헤지, 차단기, 스케줄러 상태, 임시 토큰 풀"""
+    snap = get_upstream().snapshot()
+    snap["realtime_pool"] = dict(_rt_pool.stats(), enabled=RT_POOL)
+    return JsonResponse(snap, status=200)
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_asgi_application()
+
+# 웹 서버 프로세스에서만 스캔 작업 lease/복구 스레드를 띄운다
+from carepill.apps import start_scan_jobs  # noqa: E402
+
+start_scan_jobs()
@@ -0,0 +1,269 @@
+import sys
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# =========================
+# 멀티 카메라 프레임 그래버
+# =========================
+# - 카메라마다 그래버 스레드 1개가 cap.read()를 계속 돌면서
+#   미리 할당한 NumPy 링버퍼에 (타임스탬프, 프레임)을 기록한다.
+# - 미리보기/버스트는 버퍼에서 꺼내 쓰기만 하므로 read() 블로킹과 무관하다.
+# - 버스트는 목표 시각마다 모든 카메라 버퍼에서 그 시각에 가장 가까운 프레임을 고른다.
+# - 소스: 카메라 인덱스(int), 영상 파일 경로, "synthetic[:WxH@fps]" (카메라 없이 테스트용)
+
+
+class SyntheticSource:
+    """카메라 대용 합성 소스. 움직이는 사각형 + 프레임 번호를 fps 속도로 생성"""
+
+    def __init__(self, width=1280, height=720, fps=30.0, seed=0):
+        self.width, self.height, self.fps = int(width), int(height), float(fps)
+        self._n = 0
+        self._next = time.monotonic()
+        self._rng = np.random.default_rng(seed)
+        self._base = self._rng.integers(0, 40, (self.height, self.width, 3), dtype=np.uint8)
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        # 실제 카메라처럼 다음 프레임 시각까지 블로킹
+        self._next += 1.0 / self.fps
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self._next = time.monotonic()
+        frame = self._base.copy()
+        x = int((self._n * 7) % max(1, self.width - 200))
+        cv2.rectangle(frame, (x, self.height // 3), (x + 200, self.height // 3 + 120), (240, 240, 240), -1)
+        cv2.putText(frame, f"#{self._n}", (20, self.height - 30), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 255, 0), 2)
+        self._n += 1
+        return True, frame
+
+    def release(self):
+        pass
+
+
+class VideoFileSource:
+    """영상 파일을 원래 fps 속도로 재생하는 소스. 끝나면 처음부터 반복(loop=True)"""
+
+    def __init__(self, path: str, loop=True):
+        self.cap = cv2.VideoCapture(path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.loop = loop
+        self._next = time.monotonic()
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        self._next += 1.0 / self.fps
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self._next = time.monotonic()
+        ok, frame = self.cap.read()
+        if not ok and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read()
+        return ok, frame
+
+    def release(self):
+        self.cap.release()
+
+
+def open_source(spec, width=1920, height=1080):
+    """spec: 카메라 인덱스(int 또는 숫자 문자열) / 영상 파일 경로 / "synthetic[:WxH@fps]" """
+    if isinstance(spec, str) and spec.isdigit():
+        spec = int(spec)
+    if isinstance(spec, int):
+        # 윈도우는 DSHOW가 열기/해상도 전환이 빠르다
+        cap = cv2.VideoCapture(spec, cv2.CAP_DSHOW) if sys.platform == "win32" else cv2.VideoCapture(spec)
+        if not cap.isOpened():
+            cap.release()
+            raise RuntimeError(f"카메라(index={spec})를 열 수 없습니다.")
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, float(width))
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, float(height))
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        # 드라이버 내부 큐를 줄여 오래된 프레임이 쌓이지 않게 (지원하는 백엔드만)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+    if spec.startswith("synthetic"):
+        w, h, fps = 1280, 720, 30.0
+        if ":" in spec:
+            size, _, rate = spec.split(":", 1)[1].partition("@")
+            w, h = (int(v) for v in size.lower().split("x"))
+            fps = float(rate or fps)
+        return SyntheticSource(w, h, fps)
+    src = VideoFileSource(spec)
+    if not src.isOpened():
+        src.release()
+        raise RuntimeError(f"영상 파일을 열 수 없습니다: {spec}")
+    return src
+
+
+class FrameRing:
+    """미리 할당한 (capacity, H, W, 3) uint8 버퍼 + 타임스탬프 배열.
+    첫 프레임 크기로 할당하고, 이후 크기가 다른 프레임은 슬롯 크기로 resize 해서 넣는다."""
+
+    def __init__(self, capacity: int = 32):
+        self.capacity = int(capacity)
+        self.frames: Optional[np.ndarray] = None
+        self.ts = np.full(self.capacity, np.nan)
+        self.seq = 0  # 지금까지 기록한 프레임 수
+        self._lock = threading.Lock()
+
+    def push(self, frame: np.ndarray, ts: float):
+        with self._lock:
+            if self.frames is None:
+                self.frames = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+            slot = self.seq % self.capacity
+            dst = self.frames[slot]
+            if frame.shape == dst.shape:
+                np.copyto(dst, frame)
+            else:
+                cv2.resize(frame, (dst.shape[1], dst.shape[0]), dst=dst)
+            self.ts[slot] = ts
+            self.seq += 1
+
+    def latest(self) -> Tuple[Optional[np.ndarray], float]:
+        with self._lock:
+            if self.seq == 0:
+                return None, float("nan")
+            slot = (self.seq - 1) % self.capacity
+            return self.frames[slot].copy(), float(self.ts[slot])
+
+    def nearest(self, t: float) -> Tuple[Optional[np.ndarray], float]:
+        """버퍼에 남아 있는 프레임 중 시각 t 에 가장 가까운 것 (복사본)"""
+        with self._lock:
+            if self.seq == 0:
+                return None, float("nan")
+            slot = int(np.nanargmin(np.abs(self.ts - t)))
+            return self.frames[slot].copy(), float(self.ts[slot])
+
+
+def sharpness(frame: np.ndarray) -> float:
+    """라플라시안 분산 (클수록 선명). 긴 변 640px로 줄여서 계산"""
+    g = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    s = 640.0 / max(g.shape[:2])
+    if s < 1.0:
+        g = cv2.resize(g, None, fx=s, fy=s, interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(g, cv2.CV_64F).var())
+
+
+class CameraGrabber(threading.Thread):
+    """소스 하나를 계속 읽어 FrameRing 에 기록하는 스레드"""
+
+    def __init__(self, name: str, source, capacity: int = 32):
+        super().__init__(name=f"grab-{name}", daemon=True)
+        self.cam = name
+        self.source = source
+        self.ring = FrameRing(capacity)
+        self.failures = 0
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.is_set():
+            ok, frame = self.source.read()
+            if not ok or frame is None:
+                self.failures += 1
+                time.sleep(0.01)
+                continue
+            # 타임스탬프는 read() 가 반환된 시각 (노출 시각의 근사)
+            self.ring.push(frame, time.monotonic())
+
+    def stop(self):
+        self._halt.set()
+
+
+class MultiCamGrabber:
+    """with MultiCamGrabber([0, 1, "synthetic"]) as g:
+           g.wait_ready()
+           shots = g.burst(count=3, interval_s=0.5)"""
+
+    def __init__(self, sources: List, width=1920, height=1080, capacity: int = 32):
+        self.grabbers: List[CameraGrabber] = []
+        try:
+            for i, spec in enumerate(sources, 1):
+                self.grabbers.append(CameraGrabber(f"cam{i}", open_source(spec, width, height), capacity))
+        except Exception:
+            for g in self.grabbers:
+                g.source.release()
+            raise
+
+    def start(self):
+        for g in self.grabbers:
+            g.start()
+        return self
+
+    def close(self):
+        for g in self.grabbers:
+            g.stop()
+        for g in self.grabbers:
+            g.join(timeout=1.0)
+            g.source.release()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def wait_ready(self, min_frames: int = 6, timeout_s: float = 10.0):
+        """모든 카메라가 min_frames 장 이상 기록할 때까지 대기 (워밍업)"""
+        deadline = time.monotonic() + timeout_s
+        while any(g.ring.seq < min_frames for g in self.grabbers):
+            if time.monotonic() > deadline:
+                slow = [g.cam for g in self.grabbers if g.ring.seq < min_frames]
+                raise RuntimeError(f"카메라 프레임을 가져오지 못했습니다: {slow}")
+            time.sleep(0.02)
+
+    def latest(self) -> List[Optional[np.ndarray]]:
+        return [g.ring.latest()[0] for g in self.grabbers]
+
+    def burst(self, count: int = 3, interval_s: float = 0.5, roi_rel=None,
+              settle_s: float = 0.05) -> List[Dict]:
+        """count 개의 목표 시각(지금부터 interval_s 간격)마다 모든 카메라에서 가장 가까운 프레임을 고른다.
+        목표 시각 직후 프레임까지 버퍼에 들어오도록 settle_s 만큼 더 기다린 뒤 고른다.
+        반환: [{camera_index, shot_index, ts, offset_ms, sharpness, frame}, ...] (샷 순, 카메라 순)"""
+        t0 = time.monotonic()
+        shots = []
+        for k in range(count):
+            target = t0 + k * interval_s
+            delay = target + settle_s - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            for ci, g in enumerate(self.grabbers, 1):
+                frame, ts = g.ring.nearest(target)
+                if frame is None:
+                    continue
+                if roi_rel is not None:
+                    frame = crop_roi(frame, roi_rel)
+                shots.append({"camera_index": ci, "shot_index": k + 1, "ts": ts,
+                              "offset_ms": round((ts - target) * 1000, 1),
+                              "sharpness": round(sharpness(frame), 1), "frame": frame})
+        return shots
+
+    def stats(self) -> List[Dict]:
+        out = []
+        for g in self.grabbers:
+            ts = g.ring.ts[~np.isnan(g.ring.ts)]
+            fps = (len(ts) - 1) / (ts.max() - ts.min()) if len(ts) > 1 and ts.max() > ts.min() else 0.0
+            out.append({"camera": g.cam, "frames": g.ring.seq, "failures": g.failures, "fps": round(float(fps), 1)})
+        return out
+
+
+def roi_rect(shape, roi_rel) -> Tuple[int, int, int, int]:
+    H, W = shape[:2]
+    rx, ry, rw, rh = roi_rel
+    return int(W * rx), int(H * ry), int(W * rw), int(H * rh)
+
+
+def crop_roi(frame: np.ndarray, roi_rel) -> np.ndarray:
+    x, y, w, h = roi_rect(frame.shape, roi_rel)
+    return frame[y:y+h, x:x+w].copy()
@@ -1,5 +1,7 @@
 import os
 import cv2
+import argparse
+import numpy as np
 import time
 import base64
 import json
@@ -9,6 +11,8 @@ import openai
 from collections import Counter
 from typing import List, Dict, Tuple
 
+from grabber import MultiCamGrabber, roi_rect
+
 # =========================
 # 1) OpenAI 클라이언트
 # =========================
@@ -120,80 +124,65 @@ def draw_overlay(frame, roi_rect: Tuple[int, int, int, int]):
     cv2.putText(frame, "Press SPACE / C / Q to capture (3 shots). ESC or Q to cancel.",
                 (20, 75), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (200, 255, 200), 2, cv2.LINE_AA)
 
-def capture_burst_with_roi(camera_index=2, width=1920, height=1080,
+def _tile(frames: List, width: int = 1280):
+    """카메라별 최신 프레임을 가로로 이어 붙여 미리보기 한 장으로 (높이는 첫 프레임 기준)"""
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        return None
+    h = frames[0].shape[0]
+    row = np.hstack([cv2.resize(f, (int(f.shape[1] * h / f.shape[0]), h)) for f in frames])
+    s = width / row.shape[1]
+    return cv2.resize(row, (width, int(row.shape[0] * s)), interpolation=cv2.INTER_AREA)
+
+
+def capture_burst_with_roi(sources=(2,), width=1920, height=1080,
                            warmup_frames=6, burst_count=3, interval_s=0.5,
                            roi_rel=(0.15, 0.2, 0.70, 0.55),
-                           window_name="Medicine Envelope Scanner") -> List:
+                           window_name="Medicine Envelope Scanner",
+                           preview=True, preview_fps=30.0) -> List[Dict]:
     """
     실행 즉시 미리보기 + ROI 안내 표시.
     SPACE/C/Q -> 3연사 촬영 시작, ESC/Q -> 취소.
-    ROI는 화면 중앙 상대비율(roi_rel)로 그려지고, 촬영 이미지는 ROI로 크롭해서 반환.
-    반환: [cropped_frame1, cropped_frame2, cropped_frame3]
+    sources: 카메라 인덱스 / 영상 파일 경로 / "synthetic" 목록. 카메라마다 그래버 스레드가 링버퍼에 기록하고
+    미리보기는 preview_fps 로 버퍼의 최신 프레임만 그리므로 cap.read() 에 막히지 않는다.
+    버스트는 목표 시각마다 모든 카메라에서 가장 가까운 프레임을 동시에 고른다.
+    preview=False 면 창 없이 워밍업 직후 바로 촬영(헤드리스 테스트용).
+    반환: [{camera_index, shot_index, ts, offset_ms, sharpness, frame(ROI 크롭)}, ...]
     """
-    cap = cv2.VideoCapture(camera_index, cv2.CAP_DSHOW)
-    if not cap.isOpened():
-        cap.release()
-        raise RuntimeError(f"카메라(index={camera_index})를 열 수 없습니다.")
-
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH,  float(width))
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, float(height))
-    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
-
-    # 워밍업
-    for _ in range(warmup_frames):
-        cap.read()
-
-    cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
-    cv2.resizeWindow(window_name, 1280, 720)
-
-    # ROI 절대 좌표 계산
-    ret, sample = cap.read()
-    if not ret or sample is None:
-        cap.release()
-        cv2.destroyAllWindows()
-        raise RuntimeError("카메라 프레임을 가져오지 못했습니다.")
-    H, W = sample.shape[:2]
-    rx, ry, rw, rh = roi_rel
-    roi_rect = (int(W * rx), int(H * ry), int(W * rw), int(H * rh))
-
-    print("정렬 후 스페이스/ C / Q 로 3연사 촬영을 시작합니다. ESC/Q 로 취소.")
-
-    # 미리보기 루프
-    try:
-        while True:
-            ok, frame = cap.read()
-            if not ok:
-                continue
-            vis = frame.copy()
-            draw_overlay(vis, roi_rect)
-            cv2.imshow(window_name, vis)
-            key = cv2.waitKey(1) & 0xFF
-            if key in (27, ord('q')):  # ESC or q => cancel
-                raise KeyboardInterrupt("촬영이 취소되었습니다.")
-            if key in (32, ord('c'), ord('Q')):  # Space or c or Q => start capture
-                break
-    except KeyboardInterrupt:
-        cap.release()
-        cv2.destroyAllWindows()
-        raise
-
-    # 3연사 촬영 (ROI 크롭)
-    cropped_frames = []
-    x, y, w, h = roi_rect
-    for i in range(burst_count):
-        if i > 0:
-            time.sleep(interval_s)
-        ok, fr = cap.read()
-        if not ok or fr is None:
-            continue
-        crop = fr[y:y+h, x:x+w].copy()
-        cropped_frames.append(crop)
-
-    cap.release()
-    cv2.destroyAllWindows()
-    if len(cropped_frames) == 0:
+    with MultiCamGrabber(list(sources), width, height) as grabber:
+        grabber.wait_ready(min_frames=warmup_frames)
+
+        if preview:
+            cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+            cv2.resizeWindow(window_name, 1280, 720)
+            print("정렬 후 스페이스/ C / Q 로 3연사 촬영을 시작합니다. ESC/Q 로 취소.")
+            period = 1.0 / preview_fps
+            try:
+                while True:
+                    t = time.monotonic()
+                    frames = grabber.latest()
+                    for fr in frames:
+                        if fr is not None:
+                            draw_overlay(fr, roi_rect(fr.shape, roi_rel))
+                    vis = _tile(frames)
+                    if vis is not None:
+                        cv2.imshow(window_name, vis)
+                    key = cv2.waitKey(max(1, int((period - (time.monotonic() - t)) * 1000))) & 0xFF
+                    if key in (27, ord('q')):  # ESC or q => cancel
+                        raise KeyboardInterrupt("촬영이 취소되었습니다.")
+                    if key in (32, ord('c'), ord('Q')):  # Space or c or Q => start capture
+                        break
+            finally:
+                cv2.destroyAllWindows()
+
+        # 3연사 촬영 (ROI 크롭) — 모든 카메라 동시에
+        shots = grabber.burst(burst_count, interval_s, roi_rel=roi_rel)
+        for st in grabber.stats():
+            print(f"  {st['camera']}: {st['frames']}프레임, {st['fps']}fps, 읽기 실패 {st['failures']}")
+
+    if len(shots) == 0:
         raise RuntimeError("촬영된 이미지가 없습니다.")
-    return cropped_frames
+    return shots
 
 # =========================
 # 4) 인코딩
@@ -302,15 +291,21 @@ def merge_envelope_json(json_list: List[Dict]) -> Tuple[Dict, Dict]:
 # 6) 메인
 # =========================
 def main():
+    ap = argparse.ArgumentParser(description="약봉투 스캔 프로그램(ROI 가이드 + 3연사)")
+    ap.add_argument("--source", action="append",
+                    help="카메라 인덱스 / 영상 파일 / synthetic[:WxH@fps] (여러 번 지정하면 멀티 카메라, 기본 2)")
+    ap.add_argument("--no-preview", action="store_true", help="미리보기 없이 바로 촬영")
+    args = ap.parse_args()
     print("\n=== 약봉투 스캔 프로그램(ROI 가이드 + 3연사) ===")
 
     # 촬영
     try:
-        frames = capture_burst_with_roi(
-            camera_index=2,            # 필요 시 0/1/2로 바꿔 테스트
+        shots = capture_burst_with_roi(
+            sources=args.source or [2],  # 필요 시 0/1/2로 바꿔 테스트
             width=1920, height=1080,
             burst_count=3, interval_s=0.5,
-            roi_rel=(0.15, 0.20, 0.70, 0.55)  # (x,y,w,h) 비율: 화면 중앙 70%x55%
+            roi_rel=(0.15, 0.20, 0.70, 0.55),  # (x,y,w,h) 비율: 화면 중앙 70%x55%
+            preview=not args.no_preview,
         )
     except KeyboardInterrupt:
         print("촬영이 취소되었습니다.")
@@ -325,15 +320,17 @@ def main():
     cap_dir.mkdir(parents=True, exist_ok=True)
     b64_list = []
     shot_paths = []
-    for i, fr in enumerate(frames, 1):
-        p = cap_dir / f"envelope_crop_{ts}_{i}.jpg"
+    for sh in shots:
+        fr = sh["frame"]
+        p = cap_dir / f"envelope_crop_{ts}_cam{sh['camera_index']}_{sh['shot_index']}.jpg"
         ok = cv2.imwrite(str(p), fr, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
         if not ok:
             print(f"경고: {p} 저장 실패")
         shot_paths.append(str(p))
         b64_list.append(encode_frame_to_b64_jpeg(fr))
+        print(f"  cam{sh['camera_index']} 샷{sh['shot_index']}: 목표 시각 대비 {sh['offset_ms']:+.1f}ms, 선명도 {sh['sharpness']}")
 
-    print("\n이미지 3장을 촬영했습니다. 분석을 시작합니다...")
+    print(f"\n이미지 {len(shots)}장을 촬영했습니다. 분석을 시작합니다...")
 
     # 각 샷 분석
     raw_list, json_list = [], []
@@ -383,8 +380,9 @@ def main():
             {
                 "analysis_type": "envelope",
                 "shots": [
-                    {"image_path": p, "raw": r, "json": j}
-                    for p, r, j in zip(shot_paths, raw_list, json_list)
+                    {"image_path": p, "camera_index": sh["camera_index"], "shot_index": sh["shot_index"],
+                     "raw": r, "json": j}
+                    for p, sh, r, j in zip(shot_paths, shots, raw_list, json_list)
                 ],
                 "merged": merged,
                 "diagnostics": diag,